@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Compare fido.fetch_many with a loop of fido.fetch calls against a local
+web server.
+
+Usage::
+
+    $ python benchmarks/fetch_many_benchmark.py --requests 200 --rounds 20
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import time
+from multiprocessing import Process
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver as SocketServer
+
+import fido
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        response = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', len(response))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class MultiThreadedHTTPServer(
+    SocketServer.ThreadingMixIn,
+    BaseHTTPServer.HTTPServer
+):
+    request_queue_size = 1000
+    daemon_threads = True
+
+
+def fetch_loop(urls, timeout):
+    results = [fido.fetch(url) for url in urls]
+    return [result.wait(timeout=timeout) for result in results]
+
+
+def fetch_many(urls, timeout):
+    return fido.fetch_many(urls).wait_all(timeout=timeout)
+
+
+def run(function, urls, rounds, timeout):
+    timings = []
+    for _ in range(rounds):
+        start = time.time()
+        function(urls, timeout)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    httpd = MultiThreadedHTTPServer(('localhost', 0), KeepAliveHandler)
+    server = Process(target=httpd.serve_forever)
+    server.start()
+    try:
+        url = 'http://{0}:{1}/'.format(*httpd.server_address)
+        urls = [url] * args.requests
+
+        # warm up the reactor thread and the connection pool
+        fetch_many(urls, args.timeout)
+
+        for name, function in (
+            ('fetch loop', fetch_loop),
+            ('fetch_many', fetch_many),
+        ):
+            best, median = run(function, urls, args.rounds, args.timeout)
+            print(
+                '{name:<12} {requests} requests: best {best:.2f}ms '
+                'median {median:.2f}ms'.format(
+                    name=name,
+                    requests=args.requests,
+                    best=best * 1000,
+                    median=median * 1000,
+                )
+            )
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the JSON decoders of Response.json() on large payloads: the previous
+implementation (decoding the body to text then calling json.loads), the
+standard library parsing bytes, and orjson / ujson when installed. Also
+measures repeated calls, which are memoized.
+
+Usage::
+
+    $ python benchmarks/json_benchmark.py --items 100000 --rounds 5
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import importlib
+import json
+import time
+
+from twisted.web.http_headers import Headers
+
+from fido.fido import Response
+from fido.fido import _stdlib_json_loads
+
+
+class PreviousResponse(Response):
+    """The previous Response.json(): decoded to text, not memoized."""
+
+    __slots__ = ()
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+
+def build_payload(items):
+    return json.dumps([
+        {
+            'id': i,
+            'name': u'business {0} café'.format(i),
+            'rating': i % 50 / 10.0,
+            'open': bool(i % 2),
+            'categories': ['food', 'coffee'],
+            'location': {'lat': 37.77, 'lon': -122.41},
+        }
+        for i in range(items)
+    ]).encode('utf-8')
+
+
+def run(response_class, decoder, body, rounds, calls):
+    timings = []
+    for _ in range(rounds):
+        response = response_class(
+            code=200, headers=Headers(), body=body, reason=b'OK',
+            json_decoder=decoder,
+        )
+        start = time.time()
+        for _ in range(calls):
+            response.json()
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--calls', type=int, default=3)
+    args = parser.parse_args()
+
+    body = build_payload(args.items)
+    print('payload: {0:.1f}MiB'.format(len(body) / 1024.0 / 1024.0))
+
+    decoders = [
+        ('previous', PreviousResponse, None),
+        ('json bytes', Response, _stdlib_json_loads),
+    ]
+    for name in ('orjson', 'ujson'):
+        try:
+            decoders.append(
+                (name, Response, importlib.import_module(name).loads))
+        except ImportError:
+            print('{0} not installed, skipped'.format(name))
+
+    for name, response_class, decoder in decoders:
+        for calls in (1, args.calls):
+            best, median = run(
+                response_class, decoder, body, args.rounds, calls)
+            print(
+                '{name:<14} {calls} json() calls: best {best:.2f}ms '
+                'median {median:.2f}ms'.format(
+                    name=name,
+                    calls=calls,
+                    best=best * 1000,
+                    median=median * 1000,
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Load test fido.fetch end to end against a local twisted web server, for a
+matrix of concurrency levels, body sizes, gzip on/off, tcp_nodelay on/off and
+direct or proxied connections. Reports the requests per second and the p50 /
+p99 latencies of each scenario, and writes them as JSON to compare releases.
+
+The server and the proxy run in a separate process on localhost, no network
+access is needed. The latency of a request is the wall clock time from the
+fetch() call to its response being returned by wait(). Only the fetch()
+arguments and the http_proxy environment variable every release supports are
+used, so that the results of released versions can serve as baselines;
+tcp_nodelay scenarios are skipped if the installed fido does not support it.
+
+Usage::
+
+    $ python benchmarks/load_benchmark.py --output 4.2.3.json
+    $ python benchmarks/load_benchmark.py --concurrency 1,50 \\
+        --sizes 100,1048576 --gzip on --proxy off --requests 1000
+    $ python benchmarks/load_benchmark.py --compare 4.2.3.json
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import collections
+import gzip
+import inspect
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from multiprocessing import Process
+from multiprocessing import Queue
+
+import twisted
+
+import fido
+from fido.__about__ import __version__
+
+
+SWITCHES = {'off': False, 'on': True}
+
+Scenario = collections.namedtuple(
+    'Scenario', 'concurrency size gzip tcp_nodelay proxy')
+
+
+def make_body(size):
+    """A JSON-like body of `size` bytes, compressing like a real payload."""
+    words = [
+        '"id"', '"name"', '"value"', '"items"', '"enabled"', 'true', 'null',
+        '"fido"', '"twisted"', '"reactor"', '"ok"', '"error"',
+    ] + [str(number) for number in range(100)]
+    rng = random.Random(0)
+    # every word takes at least 3 bytes with its separator
+    data = ', '.join(rng.choice(words) for _ in range(size // 3 + 1))
+    return data.encode('ascii')[:size]
+
+
+def compress(body):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+        gzip_file.write(body)
+    return buf.getvalue()
+
+
+def serve(sizes, ports):
+    """Run the web server and a forwarding HTTP proxy until terminated."""
+
+    from twisted.internet import reactor
+    from twisted.web import http
+    from twisted.web import proxy
+    from twisted.web import resource
+    from twisted.web import server
+
+    bodies = dict((size, make_body(size)) for size in sizes)
+    gzipped = dict((size, compress(body)) for size, body in bodies.items())
+
+    class Bytes(resource.Resource):
+        """/<size> answers with a body of size bytes, gzipped if accepted."""
+
+        isLeaf = True
+
+        def render_GET(self, request):
+            size = int(request.postpath[0])
+            accept_encoding = request.getHeader(b'accept-encoding') or b''
+            if b'gzip' in accept_encoding:
+                request.setHeader(b'content-encoding', b'gzip')
+                return gzipped[size]
+            return bodies[size]
+
+    site = server.Site(Bytes())
+    site.log = lambda request: None
+    web_port = reactor.listenTCP(0, site, backlog=1024, interface='127.0.0.1')
+
+    proxy_factory = http.HTTPFactory()
+    proxy_factory.protocol = proxy.Proxy
+    proxy_factory.log = lambda request: None
+    proxy_port = reactor.listenTCP(
+        0, proxy_factory, backlog=1024, interface='127.0.0.1')
+
+    ports.put((web_port.getHost().port, proxy_port.getHost().port))
+    reactor.run()
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted `values`."""
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def fetch_arguments():
+    """The names of the arguments fido.fetch accepts in this fido version."""
+    try:
+        return set(inspect.signature(fido.fetch).parameters)
+    except AttributeError:  # python 2
+        return set(inspect.getargspec(fido.fetch).args)
+
+
+def use_proxy(proxy_url):
+    """
+    Send the requests through the HTTP proxy at `proxy_url`, or directly if
+    None, by setting the http_proxy environment variable.
+    """
+
+    os.environ.pop('no_proxy', None)
+    os.environ.pop('NO_PROXY', None)
+    if proxy_url is None:
+        os.environ.pop('http_proxy', None)
+    else:
+        os.environ['http_proxy'] = proxy_url
+    try:
+        # newer versions read the environment once and cache it
+        from fido.proxy import refresh_proxy_config
+    except ImportError:
+        return
+    refresh_proxy_config()
+
+
+def run_scenario(scenario, url, requests, timeout):
+    """
+    Send `requests` requests from `scenario.concurrency` threads, each one
+    sending its next request once the previous one completed.
+
+    :returns: the wall clock duration, the sorted latencies of the successful
+        requests and the number of errors.
+    """
+
+    fetch_kwargs = dict(timeout=timeout, decompress_gzip=scenario.gzip)
+    if scenario.tcp_nodelay:
+        fetch_kwargs['tcp_nodelay'] = True
+    latencies = []
+    errors = []
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def send():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                response = fido.fetch(url, **fetch_kwargs).wait(
+                    timeout=timeout)
+            except Exception:
+                ok = False
+            else:
+                ok = response.code == 200 and \
+                    len(response.body) == scenario.size
+            latency = time.time() - start
+            with lock:
+                (latencies if ok else errors).append(latency)
+
+    threads = [
+        threading.Thread(target=send) for _ in range(scenario.concurrency)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    latencies.sort()
+    return duration, latencies, len(errors)
+
+
+def scenario_key(result):
+    return tuple(result[field] for field in Scenario._fields)
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Print the change of each scenario relative to the baseline results.
+
+    :returns: whether a scenario regressed beyond `threshold`.
+    """
+
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = dict(
+        (scenario_key(result), result) for result in baseline['results'])
+
+    print('\ncompared to fido {0} ({1}):'.format(
+        baseline['fido_version'], baseline_path))
+    regressed = False
+    for result in results:
+        before = previous.get(scenario_key(result))
+        if before is None or not before['rps'] or not before['p99_ms']:
+            continue
+        rps_change = result['rps'] / before['rps'] - 1
+        p99_change = result['p99_ms'] / before['p99_ms'] - 1
+        worse = rps_change < -threshold or p99_change > threshold
+        regressed = regressed or worse
+        print('{name:<48} rps {rps:+7.1%}  p99 {p99:+7.1%}{flag}'.format(
+            name=format_scenario(result),
+            rps=rps_change,
+            p99=p99_change,
+            flag='  REGRESSION' if worse else '',
+        ))
+    return regressed
+
+
+def format_scenario(result):
+    return (
+        'c={concurrency:<4} size={size:<8} gzip={gzip:d} '
+        'nodelay={tcp_nodelay:d} proxy={proxy:d}'.format(**result)
+    )
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def switch_list(value):
+    try:
+        return [SWITCHES[item] for item in value.split(',')]
+    except KeyError:
+        raise argparse.ArgumentTypeError(
+            'expected a list of on/off, got {0!r}'.format(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', type=int_list, default=[1, 10, 50])
+    parser.add_argument(
+        '--sizes', type=int_list, default=[100, 16 * 1024, 512 * 1024],
+        help='response body sizes in bytes')
+    parser.add_argument('--gzip', type=switch_list, default=[False, True])
+    parser.add_argument(
+        '--tcp-nodelay', type=switch_list, default=[False, True])
+    parser.add_argument('--proxy', type=switch_list, default=[False, True])
+    parser.add_argument(
+        '--requests', type=int, default=500,
+        help='number of requests per scenario')
+    parser.add_argument(
+        '--warmup', type=int, default=50,
+        help='number of requests per scenario before measuring')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument(
+        '--compare', metavar='BASELINE',
+        help='JSON results of a previous run to compare with')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative change in rps or p99 reported as a regression')
+    args = parser.parse_args()
+
+    if True in args.tcp_nodelay and 'tcp_nodelay' not in fetch_arguments():
+        print('fido {0} does not support tcp_nodelay, skipping '
+              'nodelay=1 scenarios'.format(__version__))
+        args.tcp_nodelay = [False]
+
+    environ = dict(os.environ)
+    ports = Queue()
+    server = Process(target=serve, args=(args.sizes, ports))
+    server.start()
+    results = []
+    try:
+        web_port, proxy_port = ports.get(timeout=30)
+        for values in itertools.product(
+            args.concurrency, args.sizes, args.gzip, args.tcp_nodelay,
+            args.proxy,
+        ):
+            scenario = Scenario(*values)
+            url = 'http://127.0.0.1:{0}/{1}'.format(web_port, scenario.size)
+            use_proxy(
+                'http://127.0.0.1:{0}'.format(proxy_port)
+                if scenario.proxy else None
+            )
+
+            # warm up the connection pool for the scenario
+            run_scenario(scenario, url, args.warmup, args.timeout)
+            duration, latencies, errors = run_scenario(
+                scenario, url, args.requests, args.timeout)
+
+            result = scenario._asdict()
+            result.update(
+                requests=args.requests,
+                errors=errors,
+                duration=duration,
+                rps=args.requests / duration,
+                p50_ms=percentile(latencies, 50) * 1000 if latencies else None,
+                p99_ms=percentile(latencies, 99) * 1000 if latencies else None,
+            )
+            results.append(result)
+            print(
+                '{name:<48} {rps:9.1f} req/s  p50 {p50:8.2f}ms  '
+                'p99 {p99:8.2f}ms  errors {errors}'.format(
+                    name=format_scenario(result),
+                    rps=result['rps'],
+                    p50=result['p50_ms'] or 0,
+                    p99=result['p99_ms'] or 0,
+                    errors=errors,
+                )
+            )
+    finally:
+        server.terminate()
+        os.environ.clear()
+        os.environ.update(environ)
+
+    report = {
+        'fido_version': __version__,
+        'twisted_version': twisted.__version__,
+        'python_version': platform.python_version(),
+        'python_implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'parameters': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'timeout': args.timeout,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
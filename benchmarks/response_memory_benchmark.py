@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the memory allocated to keep many fido.Response objects alive,
+compared with the previous implementation copying the response headers into
+a new dict for every response.
+
+Usage::
+
+    $ python benchmarks/response_memory_benchmark.py --responses 100000
+
+Requires Python 3 (tracemalloc).
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import gc
+import time
+import tracemalloc
+
+from twisted.web.http_headers import Headers
+
+from fido.fido import Response
+
+
+# typical headers of a JSON API response
+HEADERS = {
+    b'Content-Type': [b'application/json; charset=utf-8'],
+    b'Content-Length': [b'1234'],
+    b'Date': [b'Tue, 01 Jan 2019 00:00:00 GMT'],
+    b'Server': [b'nginx'],
+    b'Cache-Control': [b'no-cache'],
+    b'X-Request-Id': [b'0123456789abcdef'],
+}
+
+
+class EagerResponse(object):
+    """The previous Response: a __dict__ and a copy of the headers."""
+
+    def __init__(self, code, headers, body, reason):
+        self.headers = dict(headers.getAllRawHeaders())
+        self.code = code
+        self.body = body
+        self.reason = reason
+
+
+def build(response_class, count, read_headers):
+    # the twisted Headers are created by twisted for every response anyway,
+    # they are built outside of the measurement
+    headers = [Headers(HEADERS) for _ in range(count)]
+    body = b'{}'
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    responses = [
+        response_class(code=200, headers=h, body=body, reason=b'OK')
+        for h in headers
+    ]
+    if read_headers:
+        for response in responses:
+            response.headers[b'Content-Type']
+    elapsed = time.time() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del responses
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--responses', type=int, default=100000)
+    args = parser.parse_args()
+
+    for read_headers in (False, True):
+        print('headers {0}:'.format(
+            'read' if read_headers else 'not read'))
+        results = {}
+        for name, response_class in (
+            ('eager dict', EagerResponse),
+            ('Response', Response),
+        ):
+            size, elapsed = build(response_class, args.responses, read_headers)
+            results[name] = size
+            print(
+                '  {name:<12} {size:>10.1f}KiB {per:>6.0f}B/response '
+                '{elapsed:.2f}ms'.format(
+                    name=name,
+                    size=size / 1024.0,
+                    per=float(size) / args.responses,
+                    elapsed=elapsed * 1000,
+                )
+            )
+        print('  saved {0:.0f}B/response'.format(
+            float(results['eager dict'] - results['Response']) /
+            args.responses
+        ))
+
+
+if __name__ == '__main__':
+    main()
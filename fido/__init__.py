@@ -1,9 +1,15 @@
 from __future__ import absolute_import
 
+from .batch import fetch_many
 from .fido import fetch
 from .fido import Response
+from .prepared import prepare
+from .session import Session
 
 __all__ = [
     'fetch',
+    'fetch_many',
+    'prepare',
     'Response',
+    'Session',
 ]
@@ -2,6 +2,11 @@
 NOTE: Make sure to only import this module from the reactor thread as
       the class definitions call the Twisted API which is not thread safe.
 """
+from fido.metrics import POOL_HITS
+from fido.metrics import POOL_MISSES
+from fido.metrics import get_metrics
+from fido.timings import current as current_timings
+from fido.timings import now
 
 
 def _twisted_web_client():
@@ -19,5 +24,80 @@ class HTTP11ClientFactoryOverride(_twisted_web_client()._HTTP11ClientFactory):
         return HTTP11ClientProtocolOverride(self._quiescentCallback)
 
 
-class HTTPConnectionPoolOverride(_twisted_web_client().HTTPConnectionPool):
+def _connected(connection, timings):
+    timings.connected = now()
+    return connection
+
+
+def _keeps_alive(connection):
+    """
+    Whether the server keeps the connection of the response just received
+    open. Twisted only honors "Connection: close", but HTTP/1.0 servers close
+    the connection after each response unless they answer with
+    "Connection: keep-alive": a request sent on such a connection fails with
+    ResponseNeverReceived, and twisted does not retry non-idempotent ones.
+    """
+
+    # the parser of the response is still set when the connection is handed
+    # back to the pool
+    parser = getattr(connection, '_parser', None)
+    response = getattr(parser, 'response', None)
+    if response is None or tuple(response.version[1:]) >= (1, 1):
+        return True
+
+    return any(
+        token.strip().lower() == b'keep-alive'
+        for value in parser.connHeaders.getRawHeaders(b'connection', ())
+        for token in value.split(b',')
+    )
+
+
+class HTTPConnectionPool(_twisted_web_client().HTTPConnectionPool):
+    # the number of connections opened, see _newConnection
+    _opened = 0
+
+    def getConnection(self, key, endpoint):
+        timings = current_timings()
+        metrics = get_metrics()
+        if timings is None and metrics is None:
+            return _twisted_web_client().HTTPConnectionPool.getConnection(
+                self, key, endpoint,
+            )
+
+        opened = self._opened
+        deferred = _twisted_web_client().HTTPConnectionPool.getConnection(
+            self, key, endpoint,
+        )
+        reused = self._opened == opened
+
+        if metrics is not None:
+            metrics.increment(POOL_HITS if reused else POOL_MISSES)
+        # record the connection phase of the request being sent
+        if timings is not None:
+            timings.reused = reused
+            deferred.addCallback(_connected, timings)
+        return deferred
+
+    def _newConnection(self, key, endpoint):
+        self._opened += 1
+        return _twisted_web_client().HTTPConnectionPool._newConnection(
+            self, key, endpoint,
+        )
+
+    def _putConnection(self, key, connection):
+        # fido stops producing to abort the delivery of a body it does not
+        # want anymore: the response may still complete before the
+        # connection is closed, but the connection must not be reused.
+        if getattr(connection.transport, 'disconnecting', False):
+            return
+        # the server closes the connection after the response
+        if not _keeps_alive(connection):
+            connection.transport.loseConnection()
+            return
+        _twisted_web_client().HTTPConnectionPool._putConnection(
+            self, key, connection,
+        )
+
+
+class HTTPConnectionPoolOverride(HTTPConnectionPool):
     _factory = HTTP11ClientFactoryOverride
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio flavour of :func:`fido.fetch`, returning awaitable futures instead
+of crochet EventualResult objects. Awaiting a request does not block any
+thread.
+
+If the Twisted asyncio reactor is installed and running on the event loop,
+requests are sent straight from the loop. Otherwise the reactor runs in the
+crochet thread as usual and the result of each request is handed back to the
+event loop as soon as it is available.
+
+This module requires Python 3.
+"""
+from __future__ import absolute_import
+import asyncio
+
+import crochet
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from .fido import _fetch_in_reactor
+from .fido import _import_reactor
+from .fido import _prepare_fetch_args
+
+
+def _runs_on_loop(reactor, loop):
+    """Whether `reactor` is the Twisted asyncio reactor running `loop`."""
+    return (
+        getattr(reactor, '_asyncioEventloop', None) is loop and
+        reactor.running
+    )
+
+
+def _call_in_reactor(reactor, loop, function, *args):
+    """
+    Call `function` in the reactor thread and return an asyncio Future
+    bound to `loop` resolved with the result of the Deferred it returns.
+    Cancelling the future cancels the Deferred.
+    """
+
+    future = loop.create_future()
+    # the Deferred, only accessed from the reactor thread
+    pending = []
+
+    def resolve(result):
+        if future.cancelled():
+            return
+        if isinstance(result, Failure):
+            future.set_exception(result.value)
+        else:
+            future.set_result(result)
+
+    def resolve_threadsafe(result):
+        try:
+            loop.call_soon_threadsafe(resolve, result)
+        except RuntimeError:
+            # the event loop was closed, nobody is waiting for the result
+            pass
+
+    def start():
+        deferred = maybeDeferred(function, *args)
+        pending.append(deferred)
+        deferred.addBoth(resolve_threadsafe)
+
+    def cancel():
+        for deferred in pending:
+            deferred.cancel()
+
+    def on_done(future):
+        if future.cancelled():
+            reactor.callFromThread(cancel)
+
+    future.add_done_callback(on_done)
+    reactor.callFromThread(start)
+    return future
+
+
+def fetch(url, **kwargs):
+    """
+    Make an HTTP request from an asyncio event loop.
+
+    :param url: the URL to fetch.
+    :param kwargs: the other :func:`fido.fetch` arguments, except `stream`
+        as a streamed body can only be read by blocking.
+
+    :returns: an asyncio Future resolved with the fido.fido.Response object
+        or failing with the same exceptions as :func:`fido.fetch`. Cancelling
+        the future cancels the request.
+    """
+
+    if kwargs.get('stream'):
+        raise ValueError('stream=True is not supported by fido.aio')
+
+    args = _prepare_fetch_args(url, **kwargs)
+    loop = asyncio.get_event_loop()
+    reactor = _import_reactor()
+
+    if _runs_on_loop(reactor, loop):
+        return maybeDeferred(_fetch_in_reactor, *args).asFuture(loop)
+
+    # initializes twisted reactor in a different thread
+    crochet.setup()
+    return _call_in_reactor(reactor, loop, _fetch_in_reactor, *args)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import time
+
+import crochet
+import six
+from six.moves import queue
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+
+from .fido import _fetch_in_reactor
+from .fido import _import_reactor
+from .fido import _prepare_fetch_args
+
+
+class Batch(object):
+    """The results of the requests made by :func:`fetch_many`.
+
+    A batch is a sequence of crochet EventualResult objects, one per request
+    and in the same order as the requests.
+    """
+
+    def __init__(self, results, completed):
+        self._results = results
+        # indexes of the requests, pushed from the reactor thread as they
+        # complete
+        self._completed = completed
+        self._completed_order = []
+
+    def __len__(self):
+        return len(self._results)
+
+    def __getitem__(self, index):
+        return self._results[index]
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def as_completed(self, timeout=None):
+        """
+        Iterate over the EventualResult objects of the batch as the requests
+        complete, so that .wait() on them never blocks.
+
+        :param timeout: maximum time in seconds to wait for all the requests
+            to complete.
+        :raises crochet.TimeoutError: if timeout is reached before all
+            the requests complete.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        for position in six.moves.range(len(self._results)):
+            if position == len(self._completed_order):
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+                try:
+                    index = self._completed.get(timeout=remaining)
+                except queue.Empty:
+                    raise crochet.TimeoutError()
+                self._completed_order.append(index)
+
+            yield self._results[self._completed_order[position]]
+
+    def wait_all(self, timeout=None):
+        """
+        Wait for all the requests to complete.
+
+        :param timeout: maximum time in seconds to wait for all the requests
+            to complete.
+        :returns: the list of fido.fido.Response objects, in request order.
+        :raises: crochet.TimeoutError if timeout is reached before all
+            the requests complete, otherwise the exception of the first
+            failed request.
+        """
+
+        # wait for everything first so that a failed request does not hide
+        # a timeout
+        for _ in self.as_completed(timeout):
+            pass
+
+        return [result.wait(timeout=0) for result in self._results]
+
+
+@crochet.run_in_reactor
+def _fetch_one(index, args, completed):
+    """
+    This function must be run in the reactor thread because it is calling
+    twisted API which is not thread safe.
+
+    Start one request of a batch, pushing its index to `completed` once it
+    completes. Going through crochet registers its EventualResult, which
+    then raises crochet.ReactorStopped at reactor shutdown like the results
+    of :func:`fido.fetch`.
+    """
+
+    def complete(result):
+        completed.put(index)
+        return result
+
+    deferred = maybeDeferred(_fetch_in_reactor, *args)
+    deferred.addBoth(complete)
+    return deferred
+
+
+@crochet.run_in_reactor
+def _start_batch(requests, completed):
+    """
+    This function must be run in the reactor thread because it is calling
+    twisted API which is not thread safe.
+
+    Start all the requests and return their EventualResult objects. Called
+    from the reactor thread, `_fetch_one` does not wait for another thread:
+    the requests all start at the next reactor iteration.
+
+    :return: a twisted.internet.defer.Deferred firing with the results once
+        all the requests started.
+    """
+
+    results = [
+        _fetch_one(index, args, completed)
+        for index, args in enumerate(requests)
+    ]
+
+    # queued after the requests, which are started in order
+    started = Deferred()
+    _import_reactor().callFromThread(started.callback, results)
+    return started
+
+
+def fetch_many(requests):
+    """
+    Make several HTTP requests at once. All the requests are started with a
+    single call into the reactor thread, which is cheaper than calling
+    :func:`fetch` in a loop for large fan-outs.
+
+    :param requests: an iterable of requests. Each request is either an URL or
+        a dictionary of :func:`fetch` keyword arguments. For example::
+
+            [
+                'http://www.example.com',
+                {'url': 'http://www.example.com', 'method': 'POST'},
+            ]
+
+    :returns: a :class:`fido.batch.Batch` of crochet EventualResult objects,
+        in the same order as `requests`.
+    """
+
+    prepared = []
+    for request in requests:
+        if isinstance(request, (six.text_type, bytes)):
+            request = {'url': request}
+        prepared.append(_prepare_fetch_args(**request))
+
+    completed = queue.Queue()
+
+    # initializes twisted reactor in a different thread
+    crochet.setup()
+    results = _start_batch(prepared, completed).wait(timeout=None)
+    return Batch(results, completed)
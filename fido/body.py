@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+File-like adapters turning the request bodies accepted by :func:`fido.fetch`
+into input files for a twisted FileBodyProducer, which reads them in chunks
+so that large uploads run in constant memory.
+"""
+from __future__ import absolute_import
+import io
+import mmap
+import os
+
+import six
+from twisted.python.filepath import FilePath
+
+
+def is_path(body):
+    """Whether the body is a path to a file to upload."""
+    path_like = getattr(os, 'PathLike', None)
+    return isinstance(body, FilePath) or (
+        path_like is not None and isinstance(body, path_like)
+    )
+
+
+def is_bytes_like(body):
+    """Whether the body is held in memory as a bytes-like object."""
+    return isinstance(body, (six.binary_type, bytearray, memoryview))
+
+
+def as_byte_view(body):
+    """
+    Return a memoryview body as a flat view of bytes, so that its length and
+    slices count bytes whatever the item size of the object it views (e.g.
+    an array of ints). Other bodies are returned as they are.
+    """
+
+    if not isinstance(body, memoryview) or six.PY2:
+        return body
+    if body.format == 'B' and body.ndim == 1:
+        return body
+    try:
+        return body.cast('B')
+    except TypeError:
+        # only C-contiguous views can be cast
+        return memoryview(body.tobytes())
+
+
+def _to_bytes(data):
+    """Copy a bytes-like chunk to bytes."""
+    if isinstance(data, memoryview):
+        # bytes(memoryview) is its repr on python 2
+        return data.tobytes()
+    return bytes(data)
+
+
+def is_reusable(body):
+    """
+    Whether the body can be sent more than once: files and iterables can
+    only be read once.
+    """
+    return (
+        not body or
+        is_bytes_like(body) or
+        isinstance(body, six.text_type) or
+        is_path(body)
+    )
+
+
+class BufferReader(object):
+    """Reads a bytes-like object (bytearray, memoryview, mmap) without
+    copying it as a whole: only the chunks being read are copied.
+
+    :param buffer: the object to read from.
+    :param close: an optional function called when the reader is closed.
+    """
+
+    def __init__(self, buffer, close=None):
+        self._buffer = as_byte_view(buffer)
+        self._position = 0
+        self._close = close
+
+    def read(self, size=-1):
+        if self._buffer is None:
+            raise ValueError('I/O operation on closed reader')
+        end = len(self._buffer) if size < 0 else self._position + size
+        data = _to_bytes(self._buffer[self._position:end])
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._buffer is None:
+            return
+        self._buffer = None
+        if self._close is not None:
+            self._close()
+
+
+class IteratorReader(object):
+    """Reads the chunks of an iterable, one chunk per read. Having no known
+    length, its content is sent with the chunked transfer encoding.
+
+    Empty chunks are skipped: an empty read means the end of the body.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        # the size is only a hint, chunks are passed on as they are
+        for chunk in self._chunks:
+            if chunk:
+                return _to_bytes(chunk)
+        return b''
+
+    def close(self):
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def open_mapped_file(path):
+    """
+    Memory-map the file to upload, so that its pages are read lazily by the
+    OS as the body is sent.
+
+    :param path: a twisted FilePath or an os.PathLike object.
+    :returns: a BufferReader over the mapped file, or an empty BytesIO if the
+        file is empty as empty files cannot be mapped.
+    """
+
+    if isinstance(path, FilePath):
+        path = path.path
+    else:
+        path = os.fspath(path)
+
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return io.BytesIO()
+        # the mapping stays valid once the file is closed
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return BufferReader(mapped, close=mapped.close)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+
+from fido.exceptions import CircuitOpenError
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+FAILURE_STATUS_CODES = frozenset((502, 503, 504))
+
+DEFAULT_CONSECUTIVE_FAILURES = 5
+DEFAULT_ERROR_RATE = 0.5
+DEFAULT_MIN_REQUESTS = 20
+DEFAULT_WINDOW = 10
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_MAX_PROBES = 1
+
+
+class _Circuit(object):
+    """The state of the circuit of a host."""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self.probes = 0
+        # [second, requests, failures], oldest first
+        self.buckets = collections.deque()
+
+
+class CircuitBreaker(object):
+    """Fails the requests to an unhealthy host right away instead of waiting
+    for their connect_timeout or timeout.
+
+    The circuit of a host opens when `consecutive_failures` requests in a
+    row failed, or when `error_rate` of the requests failed over the last
+    `window` seconds, once at least `min_requests` were sent. While open,
+    requests fail with :class:`fido.exceptions.CircuitOpenError` without
+    being sent. After `reset_timeout` seconds the circuit is half-open: up to
+    `max_probes` requests are let through at a time to probe the host. The
+    circuit closes when a probe succeeds and opens again when one fails.
+
+    A request fails if it times out, if the connection fails, or if the
+    response status is one of `failure_status_codes`. Requests cancelled
+    otherwise than by their timeout are not accounted for.
+
+    Hosts are identified by a ``'host:port'`` string. Only the hosts with a
+    failure in the last `window` seconds, or with an open circuit, are
+    tracked: the accounting of a host starts at its first failure and is
+    dropped once its circuit is closed without requests in the window. A
+    breaker can be shared by any number of :func:`fido.fetch` calls and
+    sessions; its state is only ever modified from the reactor thread.
+
+    :param consecutive_failures: number of failures in a row opening the
+        circuit, None to disable.
+    :param error_rate: ratio of failed requests opening the circuit, None to
+        disable.
+    :param min_requests: minimum number of requests in the window to
+        compute the error rate.
+    :param window: seconds the requests are accounted for by the error
+        rate.
+    :param reset_timeout: seconds the circuit stays open before probing the
+        host.
+    :param max_probes: maximum number of probe requests in flight while
+        half-open.
+    :param failure_status_codes: the response codes counted as failures.
+
+    :ivar opened: number of times a circuit opened.
+    :ivar rejected: number of requests failed without being sent.
+    """
+
+    def __init__(
+        self,
+        consecutive_failures=DEFAULT_CONSECUTIVE_FAILURES,
+        error_rate=DEFAULT_ERROR_RATE,
+        min_requests=DEFAULT_MIN_REQUESTS,
+        window=DEFAULT_WINDOW,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        max_probes=DEFAULT_MAX_PROBES,
+        failure_status_codes=FAILURE_STATUS_CODES,
+    ):
+        self.consecutive_failures = consecutive_failures
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.max_probes = max_probes
+        self.failure_status_codes = frozenset(failure_status_codes)
+
+        self.opened = 0
+        self.rejected = 0
+
+        # key -> _Circuit of the tracked hosts
+        self._circuits = {}
+        # when the idle circuits were last dropped
+        self._swept_at = None
+
+    def __len__(self):
+        return len(self._circuits)
+
+    def state(self, reactor, key):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        :returns: the state of the circuit of `key`: 'closed', 'open' or
+            'half-open'.
+        """
+
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            return CLOSED
+        if (
+            circuit.state == OPEN and
+            reactor.seconds() >= circuit.opened_at + self.reset_timeout
+        ):
+            circuit.state = HALF_OPEN
+            circuit.probes = 0
+        return circuit.state
+
+    def acquire(self, reactor, key):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Let a request to `key` through, to be followed by a call to
+        :meth:`release` once it completed.
+
+        :returns: whether the request is a probe of a half-open circuit.
+        :raises fido.exceptions.CircuitOpenError: if the circuit is open, or
+            half-open with all its probes in flight.
+        """
+
+        state = self.state(reactor, key)
+        if state == CLOSED:
+            return False
+
+        circuit = self._circuits[key]
+        if state == HALF_OPEN and circuit.probes < self.max_probes:
+            circuit.probes += 1
+            return True
+
+        self.rejected += 1
+        raise CircuitOpenError(
+            "Request was not sent by fido because the circuit to {key} is "
+            "{state} after too many failures, the next attempt is in "
+            "{delay:.1f} seconds".format(
+                key=key,
+                state=state,
+                delay=max(
+                    0,
+                    circuit.opened_at + self.reset_timeout -
+                    reactor.seconds(),
+                ),
+            )
+        )
+
+    def release(self, reactor, key, probe, failed):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Account for the completion of a request let through by
+        :meth:`acquire`.
+
+        :param probe: the value returned by :meth:`acquire`.
+        :param failed: True if the request failed, False if it succeeded,
+            None if it was cancelled.
+        """
+
+        now = reactor.seconds()
+        self._sweep(now)
+        circuit = self._circuits.get(key)
+
+        if probe:
+            if circuit is None or circuit.state != HALF_OPEN:
+                return
+            circuit.probes -= 1
+            if failed:
+                self._open(reactor, circuit)
+            elif failed is not None:
+                # the host is back
+                self._circuits.pop(key)
+            return
+
+        if failed is None:
+            return
+        if circuit is None:
+            if not failed:
+                # healthy hosts are not tracked
+                return
+            circuit = self._circuits[key] = _Circuit()
+        if circuit.state != CLOSED:
+            return
+
+        second = int(now)
+        buckets = circuit.buckets
+        while buckets and buckets[0][0] <= second - self.window:
+            buckets.popleft()
+        if not buckets and not failed:
+            # no failure left in the window
+            del self._circuits[key]
+            return
+        if not buckets or buckets[-1][0] != second:
+            buckets.append([second, 0, 0])
+        buckets[-1][1] += 1
+
+        if not failed:
+            circuit.consecutive_failures = 0
+            return
+
+        buckets[-1][2] += 1
+        circuit.consecutive_failures += 1
+
+        if (
+            self.consecutive_failures is not None and
+            circuit.consecutive_failures >= self.consecutive_failures
+        ):
+            self._open(reactor, circuit)
+            return
+
+        if self.error_rate is not None:
+            requests = sum(bucket[1] for bucket in buckets)
+            failures = sum(bucket[2] for bucket in buckets)
+            if (
+                requests >= self.min_requests and
+                failures >= self.error_rate * requests
+            ):
+                self._open(reactor, circuit)
+
+    def _sweep(self, now):
+        """Drop the closed circuits without requests in the window, at most
+        once per window."""
+
+        if self._swept_at is not None and now < self._swept_at + self.window:
+            return
+        self._swept_at = now
+
+        oldest = int(now) - self.window
+        for key, circuit in list(self._circuits.items()):
+            if circuit.state == CLOSED and (
+                not circuit.buckets or circuit.buckets[-1][0] <= oldest
+            ):
+                del self._circuits[key]
+
+    def _open(self, reactor, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = reactor.seconds()
+        circuit.consecutive_failures = 0
+        circuit.buckets.clear()
+        self.opened += 1
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+
+from twisted.internet.defer import succeed
+from twisted.web.http import stringToDatetime
+
+from fido.fido import Response
+from fido.timings import now
+
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# The response codes cacheable by default, see RFC 7231 section 6.1.
+CACHEABLE_STATUS_CODES = frozenset(
+    (200, 203, 204, 300, 301, 404, 405, 410, 414, 501))
+
+# The methods that do not change the state of the server, see RFC 7231
+# section 4.2.1. Successful requests with any other method invalidate the
+# cached responses of their URL.
+SAFE_METHODS = frozenset((b'GET', b'HEAD', b'OPTIONS', b'TRACE'))
+
+_CONDITIONAL_HEADERS = (
+    b'if-none-match', b'if-modified-since', b'if-match',
+    b'if-unmodified-since', b'if-range',
+)
+
+# The headers of a 304 response that must not replace the stored ones.
+_NOT_UPDATED_HEADERS = frozenset((
+    b'content-length', b'content-encoding', b'transfer-encoding',
+    b'content-range',
+))
+
+
+def _directives(headers):
+    """
+    Return the cache-control directives of twisted `headers`, as a dict
+    from lowercase bytes names to bytes arguments or None.
+    """
+
+    directives = {}
+    for value in headers.getRawHeaders(b'cache-control', []):
+        for directive in value.split(b','):
+            name, _, argument = directive.strip().partition(b'=')
+            if name:
+                directives[name.lower()] = argument.strip(b'"') or None
+    return directives
+
+
+def _seconds(value):
+    """Parse delta-seconds, None if invalid."""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(headers, name):
+    """Parse the HTTP date of header `name` in seconds, None if invalid."""
+    values = headers.getRawHeaders(name)
+    if not values:
+        return None
+    try:
+        return stringToDatetime(values[-1])
+    except (ValueError, IndexError):
+        return None
+
+
+def _hit_timings(timings):
+    """
+    NOTE: Make sure to call this only from the reactor thread.
+
+    Return the timings of a request answered from the cache, None if
+    disabled.
+    """
+
+    if timings is None:
+        return None
+    timings = timings._next_attempt()
+    timings.end = now()
+    return timings
+
+
+class _Entry(object):
+    """A stored response and its freshness information."""
+
+    __slots__ = (
+        'code', 'headers', 'body', 'reason', 'size', 'stored_at', 'age',
+        'lifetime', 'stale_while_revalidate', 'must_revalidate',
+        'revalidating',
+    )
+
+    def __init__(self, code, headers, body, reason, stored_at):
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.reason = reason
+        self.size = len(body) + sum(
+            len(name) + sum(len(value) for value in values)
+            for name, values in headers.getAllRawHeaders()
+        )
+        self.revalidating = False
+        self._update_freshness(stored_at)
+
+    def _update_freshness(self, stored_at):
+        directives = _directives(self.headers)
+        self.stored_at = stored_at
+        self.age = _seconds(
+            (self.headers.getRawHeaders(b'age') or [None])[-1]) or 0
+
+        if b'no-cache' in directives:
+            lifetime = 0
+        elif b'max-age' in directives:
+            lifetime = _seconds(directives[b'max-age']) or 0
+        else:
+            expires = _date(self.headers, b'expires')
+            date = _date(self.headers, b'date')
+            if expires is None or date is None:
+                lifetime = 0
+            else:
+                lifetime = max(0, expires - date)
+        self.lifetime = lifetime
+
+        self.stale_while_revalidate = _seconds(
+            directives.get(b'stale-while-revalidate')) or 0
+        self.must_revalidate = (
+            b'must-revalidate' in directives or
+            b'proxy-revalidate' in directives or
+            b'no-cache' in directives
+        )
+
+    def current_age(self, now):
+        return self.age + max(0, now - self.stored_at)
+
+    def validators(self):
+        """Return the conditional request headers revalidating the entry."""
+        validators = []
+        etag = self.headers.getRawHeaders(b'etag')
+        if etag:
+            validators.append((b'if-none-match', etag))
+        last_modified = self.headers.getRawHeaders(b'last-modified')
+        if last_modified:
+            validators.append((b'if-modified-since', last_modified[-1:]))
+        return validators
+
+    def update(self, response, stored_at):
+        """Update the entry with the headers of a 304 response."""
+        headers = self.headers.copy()
+        for name, values in response._raw_headers.getAllRawHeaders():
+            if name.lower() not in _NOT_UPDATED_HEADERS:
+                headers.setRawHeaders(name, values)
+        self.headers = headers
+        self._update_freshness(stored_at)
+
+
+class ResponseCache(object):
+    """An in-memory HTTP cache of the responses to GET requests, following
+    RFC 7234 for a private cache.
+
+    Fresh responses (see the max-age directive and the Expires header) are
+    returned without sending the request. Stale responses are revalidated
+    with a conditional request (If-None-Match, If-Modified-Since): a 304
+    response returns the stored response with its headers updated. Within
+    their stale-while-revalidate window, stale responses are returned at
+    once while they are revalidated in the background. Responses are stored
+    per value of the request headers listed by their Vary header.
+
+    Requests with a no-store or no-cache directive, or with conditional
+    headers of their own, are sent as they are. Successful requests with an
+    unsafe method (POST, PUT, DELETE...) invalidate the responses of their
+    URL. Streamed requests bypass the cache.
+
+    The cache is bounded by the size of the stored responses, the least
+    recently used ones are evicted first. It can be shared by any number of
+    :func:`fido.fetch` calls and sessions; its state is only ever modified
+    from the reactor thread.
+
+    :param max_bytes: maximum total size in bytes of the stored bodies and
+        headers.
+
+    :ivar hits: number of fresh responses returned from the cache.
+    :ivar stale_hits: number of stale responses returned from the cache
+        while being revalidated.
+    :ivar revalidated: number of stored responses confirmed by a 304.
+    :ivar misses: number of requests that needed a full response.
+    :ivar evictions: number of responses evicted to respect max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.size = 0
+        # (url, decompressed, vary values) -> _Entry, least recently used
+        # first
+        self._entries = collections.OrderedDict()
+        # url -> the lowercase header names the responses vary by
+        self._vary = {}
+        # url -> the keys of its entries
+        self._keys = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def request(self, reactor, method, url, headers, send,
+                decompressed=False, json_decoder=None, timings=None):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Return the response to a request from the cache, or send the request
+        with `send` and store its response.
+
+        :param method: the HTTP method, as bytes.
+        :param url: the URL, as bytes.
+        :param headers: the twisted Headers of the request. The conditional
+            headers revalidating a stored response are added to them.
+        :param send: a function sending the request, returning a Deferred
+            firing with a fido Response.
+        :param decompressed: whether the response bodies are decompressed,
+            they are stored separately from the compressed ones.
+        :param json_decoder: the function parsing Response.json() of the
+            responses returned from the cache.
+        :param timings: the :class:`fido.timings.Timings` of the request,
+            None to disable the timings. The responses returned without
+            sending the request get the timings of an attempt ending at once.
+        :returns: a Deferred firing with a fido Response.
+        """
+
+        if method not in SAFE_METHODS:
+            deferred = send()
+            deferred.addCallback(self._invalidate_on_success, url)
+            return deferred
+
+        directives = _directives(headers)
+        if (
+            method != b'GET' or
+            b'no-store' in directives or
+            b'no-cache' in directives or
+            any(headers.hasHeader(name) for name in _CONDITIONAL_HEADERS)
+        ):
+            return send()
+
+        key = self._key(url, decompressed, headers)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            deferred = send()
+            deferred.addCallback(
+                self._store, reactor, url, decompressed, headers)
+            return deferred
+
+        self._put(url, key, entry)
+        age = entry.current_age(reactor.seconds())
+        max_age = _seconds(directives.get(b'max-age'))
+        if max_age is not None:
+            lifetime = min(entry.lifetime, max_age)
+        else:
+            lifetime = entry.lifetime
+
+        if age < lifetime:
+            self.hits += 1
+            return succeed(
+                self._response(entry, json_decoder, _hit_timings(timings)))
+
+        if (
+            not entry.must_revalidate and
+            max_age is None and
+            age < lifetime + entry.stale_while_revalidate
+        ):
+            self.stale_hits += 1
+            if not entry.revalidating:
+                entry.revalidating = True
+                revalidation = self._revalidate(
+                    reactor, url, key, entry, headers, send, decompressed,
+                    json_decoder,
+                )
+                # nobody waits for the background revalidation
+                revalidation.addErrback(lambda _: None)
+            return succeed(
+                self._response(entry, json_decoder, _hit_timings(timings)))
+
+        return self._revalidate(
+            reactor, url, key, entry, headers, send, decompressed,
+            json_decoder,
+        )
+
+    def _key(self, url, decompressed, headers):
+        vary = self._vary.get(url, ())
+        return (url, decompressed, tuple(
+            tuple(headers.getRawHeaders(name, ())) for name in vary
+        ))
+
+    def _response(self, entry, json_decoder, timings=None):
+        return Response(
+            code=entry.code,
+            headers=entry.headers,
+            body=entry.body,
+            reason=entry.reason,
+            json_decoder=json_decoder,
+            timings=timings,
+        )
+
+    def _revalidate(self, reactor, url, key, entry, headers, send,
+                    decompressed, json_decoder):
+        validators = entry.validators()
+        if not validators:
+            self.misses += 1
+            deferred = send()
+            deferred.addCallback(
+                self._store, reactor, url, decompressed, headers)
+            return deferred
+
+        for name, values in validators:
+            headers.setRawHeaders(name, values)
+
+        def revalidated(response):
+            entry.revalidating = False
+            if response.code != 304:
+                self.misses += 1
+                return self._store(
+                    response, reactor, url, decompressed, headers)
+
+            self.revalidated += 1
+            entry.update(response, reactor.seconds())
+            # the entry may have been evicted in the meantime
+            self._put(url, key, entry)
+            return self._response(entry, json_decoder, response.timings)
+
+        def failed(failure):
+            entry.revalidating = False
+            return failure
+
+        deferred = send()
+        deferred.addCallbacks(revalidated, failed)
+        return deferred
+
+    def _store(self, response, reactor, url, decompressed, headers):
+        """Store `response` if it can be reused, then return it."""
+
+        raw_headers = response._raw_headers
+        if (
+            response.code not in CACHEABLE_STATUS_CODES or
+            b'no-store' in _directives(raw_headers)
+        ):
+            return response
+
+        vary = tuple(sorted(set(
+            name.strip().lower()
+            for value in raw_headers.getRawHeaders(b'vary', [])
+            for name in value.split(b',')
+            if name.strip()
+        )))
+        if b'*' in vary:
+            return response
+
+        entry = _Entry(
+            response.code,
+            raw_headers.copy(),
+            response.body,
+            response.reason,
+            reactor.seconds(),
+        )
+        if (
+            entry.size > self.max_bytes or
+            not (entry.lifetime or entry.validators())
+        ):
+            return response
+
+        if self._vary.get(url, ()) != vary:
+            # the variants stored with other vary headers are unreachable
+            self._invalidate(url)
+            self._vary[url] = vary
+        self._put(url, self._key(url, decompressed, headers), entry)
+        return response
+
+    def _put(self, url, key, entry):
+        """Insert or refresh the entry as the most recently used one."""
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous.size
+        self._entries[key] = entry
+        self._keys[url].add(key)
+        self.size += entry.size
+
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self._discard_key(evicted_key[0], evicted_key)
+            self.evictions += 1
+
+    def _discard_key(self, url, key):
+        keys = self._keys.get(url)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._keys[url]
+            self._vary.pop(url, None)
+
+    def _invalidate(self, url):
+        for key in self._keys.pop(url, ()):
+            self.size -= self._entries.pop(key).size
+        self._vary.pop(url, None)
+
+    def _invalidate_on_success(self, response, url):
+        if response.code < 400:
+            self._invalidate(url)
+        return response
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import copy
+import functools
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from fido.fido import Response
+from fido.timings import now
+
+
+DEFAULT_METHODS = frozenset((b'GET', b'HEAD'))
+
+
+class _Flight(object):
+    """A request in flight and the callers waiting for its response."""
+
+    def __init__(self):
+        self.deferred = None
+        # the waiter of the caller sending the request
+        self.owner = None
+        # [(waiter, timings)] of the callers
+        self.waiters = []
+
+
+def _joined_timings(timings):
+    """
+    NOTE: Make sure to call this only from the reactor thread.
+
+    Return the timings of a caller who joined a request in flight, ending
+    now. None if disabled.
+    """
+
+    if timings is None:
+        return None
+    timings = timings._next_attempt()
+    timings.end = now()
+    return timings
+
+
+def _copy_response(response, timings):
+    """Return a Response of its own to a caller, sharing the body and the
+    parsed JSON body."""
+    copied = Response(
+        code=response.code,
+        headers=response._raw_headers,
+        body=response.body,
+        reason=response.reason,
+        json_decoder=response._json_decoder,
+        timings=timings,
+    )
+    copied._json = response._json
+    return copied
+
+
+def _copy_failure(failure, timings):
+    """Return a Failure of its own to a caller, with a copy of the exception
+    carrying its `timings`. The exception is shared if it can't be copied.
+    """
+    try:
+        exception = copy.copy(failure.value)
+    except Exception:
+        return failure
+    if timings is None:
+        vars(exception).pop('timings', None)
+    else:
+        exception.timings = timings
+    return Failure(exception, failure.type, failure.getTracebackObject())
+
+
+class RequestCoalescer(object):
+    """Sends identical requests in flight at the same time only once
+    ("singleflight"), e.g. when many threads fetch the same URL on a cache
+    stampede.
+
+    Requests are identical if they have the same method, URL, headers and
+    response options, and no body. Callers share the response of the request
+    in flight, each getting its own Response object, or its own copy of the
+    error, with its own timings. The body and the JSON body parsed with
+    `parse_json` are shared by the responses: don't mutate them. A caller
+    cancelling its request (or timing out) does not affect the others: the
+    request in flight is only cancelled once all its callers cancelled
+    theirs.
+
+    Note that the hedges of a :class:`fido.hedge.HedgePolicy` are identical
+    requests too: they wait for the request in flight instead of being sent.
+
+    A coalescer can be shared by any number of :func:`fido.fetch` calls and
+    sessions; its state is only ever modified from the reactor thread.
+
+    :param methods: the HTTP methods, as bytes, of the requests to coalesce.
+        Defaults to GET and HEAD.
+
+    :ivar requests: number of requests made through the coalescer.
+    :ivar coalesced: number of requests that waited for an identical request
+        in flight instead of being sent.
+    """
+
+    def __init__(self, methods=DEFAULT_METHODS):
+        self.methods = frozenset(methods)
+
+        self.requests = 0
+        self.coalesced = 0
+
+        # request key -> _Flight
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def request(self, method, url, headers, send, options=(), timings=None):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Send a request with `send`, unless an identical request is in flight.
+
+        :param method: the HTTP method, as bytes.
+        :param url: the URL, as bytes.
+        :param headers: the twisted Headers of the request.
+        :param send: a function sending the request, returning a Deferred
+            firing with a fido Response.
+        :param options: the other hashable values a request must share to be
+            identical, e.g. how its response is received.
+        :param timings: the :class:`fido.timings.Timings` of the request,
+            None to disable the timings. The request in flight records its
+            phases in the timings of the caller sending it, the other callers
+            only get the end of their wait.
+        :returns: a Deferred firing with a Response of its own. Cancelling it
+            only cancels the request in flight if no other caller waits for
+            it.
+        """
+
+        if method not in self.methods:
+            return send()
+
+        self.requests += 1
+        key = (
+            method,
+            url,
+            tuple(sorted(
+                (name, tuple(values))
+                for name, values in headers.getAllRawHeaders()
+            )),
+            options,
+        )
+
+        flight = self._in_flight.get(key)
+        joined = flight is not None
+        if not joined:
+            flight = self._in_flight[key] = _Flight()
+
+        waiter = Deferred(functools.partial(self._cancel, key, flight))
+        flight.waiters.append((waiter, timings))
+
+        if joined:
+            self.coalesced += 1
+        else:
+            flight.owner = waiter
+            # the waiter is registered first, send may fire at once
+            flight.deferred = maybeDeferred(send)
+            flight.deferred.addBoth(self._land, key, flight)
+        return waiter
+
+    def _land(self, result, key, flight):
+        """Fan the result of the request in flight out to its callers."""
+
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+
+        waiters, flight.waiters = flight.waiters, []
+        for waiter, timings in waiters:
+            if isinstance(result, Failure):
+                if waiter is flight.owner:
+                    waiter.errback(result)
+                else:
+                    waiter.errback(
+                        _copy_failure(result, _joined_timings(timings)))
+            elif waiter is flight.owner:
+                # the response of its own request
+                waiter.callback(result)
+            else:
+                waiter.callback(
+                    _copy_response(result, _joined_timings(timings)))
+        # the failure of a request nobody waits for anymore is ignored
+        return None
+
+    def _cancel(self, key, flight, waiter):
+        flight.waiters = [
+            (other, timings) for other, timings in flight.waiters
+            if other is not waiter
+        ]
+        if flight.waiters:
+            return
+
+        # the next identical request is sent anew
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        flight.deferred.cancel()
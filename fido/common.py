@@ -14,3 +14,17 @@ def listify_headers(headers):
         else:
             byte_headers[byte_key] = [to_bytes(x) for x in val]
     return Headers(byte_headers)
+
+
+def merge_headers(headers, overrides):
+    """
+    Return a copy of the twisted `headers` where the `overrides`, a dictionary
+    as accepted by `listify_headers`, replace the headers with the same name.
+    `headers` is returned as it is if there are no overrides.
+    """
+    if not overrides:
+        return headers
+    headers = headers.copy()
+    for key, values in listify_headers(overrides).getAllRawHeaders():
+        headers.setRawHeaders(key, values)
+    return headers
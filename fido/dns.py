@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.abstract import isIPv6Address
+from twisted.internet.address import IPv4Address
+from twisted.internet.address import IPv6Address
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import fail
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import succeed
+from twisted.internet.endpoints import HostnameEndpoint
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.endpoints import TCP6ClientEndpoint
+from twisted.internet.endpoints import wrapClientTLS
+from twisted.internet.error import DNSLookupError
+from twisted.internet.error import TCPTimedOutError
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.python.failure import Failure
+from twisted.web.error import SchemeNotSupported
+from twisted.web.iweb import IAgentEndpointFactory
+from zope.interface import Interface
+from zope.interface import implementer
+
+try:
+    from twisted.internet.interfaces import IHostnameResolver
+    from twisted.internet.interfaces import IHostResolution
+    from twisted.internet.interfaces import IReactorPluggableNameResolver
+    from twisted.internet.interfaces import IResolutionReceiver
+    _PLUGGABLE_NAME_RESOLVER = True
+except ImportError:
+    # twisted < 17.1: HostnameEndpoint can't use our resolver, connections
+    # go to the first address of the hostname
+    IHostnameResolver = IHostResolution = Interface
+    IReactorPluggableNameResolver = IResolutionReceiver = Interface
+    _PLUGGABLE_NAME_RESOLVER = False
+
+from fido.timings import current as current_timings
+from fido.timings import now
+
+
+DEFAULT_TTL = 60.0
+DEFAULT_NEGATIVE_TTL = 5.0
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_REFRESH_BEFORE = 10.0
+
+
+class _Entry(object):
+    """A cached resolution: the addresses or the Failure of the lookup."""
+
+    def __init__(self, result, expires_at):
+        self.result = result
+        self.expires_at = expires_at
+        self.refreshing = False
+
+
+class CachingResolver(object):
+    """Caches the hostname resolutions made for fido connections.
+
+    All the IPv4 and IPv6 addresses of a hostname are cached, the connections
+    try them in turn like twisted HostnameEndpoint ("happy eyeballs").
+    Addresses are kept for `ttl` seconds. A cached address used less than
+    `refresh_before` seconds before it expires is resolved again in the
+    background, so that hot hostnames never wait for a lookup. Concurrent
+    lookups of the same hostname are sent only once.
+
+    A resolver can be shared by any number of :func:`fido.fetch` calls and
+    sessions; its state is only ever modified from the reactor thread.
+
+    :param ttl: seconds a resolved address is cached.
+    :param negative_ttl: seconds a failed lookup (unknown hostname) is cached,
+        0 to disable negative caching.
+    :param max_entries: maximum number of cached hostnames, the least recently
+        used ones are evicted first.
+    :param refresh_before: seconds before expiry from which a cached address
+        is refreshed in the background, None to disable refreshing.
+    :param resolver: the twisted IHostnameResolver to make the lookups with,
+        defaults to the reactor name resolver (getaddrinfo).
+
+    :ivar hits: number of resolutions answered from the cache.
+    :ivar misses: number of resolutions that waited for a lookup.
+    :ivar refreshes: number of background refreshes started.
+    :ivar evictions: number of entries evicted to respect max_entries.
+    """
+
+    def __init__(
+        self,
+        ttl=DEFAULT_TTL,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        refresh_before=DEFAULT_REFRESH_BEFORE,
+        resolver=None,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.refresh_before = refresh_before
+        self.resolver = resolver
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+        # hostname -> _Entry, in least recently used order
+        self._entries = collections.OrderedDict()
+        # hostname -> Deferreds waiting for the lookup in progress
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resolve(self, reactor, host):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        :return: a twisted.internet.defer.Deferred firing with the tuple of
+            the IPv4 and IPv6 addresses of `host`.
+        """
+
+        if isIPAddress(host) or isIPv6Address(host):
+            return succeed((host,))
+
+        now = reactor.seconds()
+        entry = self._entries.get(host)
+
+        if entry is not None and entry.expires_at > now:
+            self.hits += 1
+            self._store(host, entry)
+
+            if isinstance(entry.result, Failure):
+                return fail(entry.result)
+
+            if (self.refresh_before is not None and not entry.refreshing and
+                    now >= entry.expires_at - self.refresh_before):
+                entry.refreshing = True
+                self.refreshes += 1
+                self._lookup(reactor, host, [])
+            return succeed(entry.result)
+
+        self.misses += 1
+        waiter = Deferred()
+        if host in self._pending:
+            self._pending[host].append(waiter)
+        else:
+            self._lookup(reactor, host, [waiter])
+        return waiter
+
+    def _lookup(self, reactor, host, waiters):
+        self._pending[host] = waiters
+        if self.resolver is None and not _PLUGGABLE_NAME_RESOLVER:
+            deferred = maybeDeferred(reactor.resolver.getHostByName, host)
+            deferred.addCallback(lambda address: (address,))
+        else:
+            resolver = self.resolver or reactor.nameResolver
+            deferred = maybeDeferred(_lookup_addresses, resolver, host)
+        deferred.addBoth(self._resolved, reactor, host)
+
+    def _resolved(self, result, reactor, host):
+        now = reactor.seconds()
+
+        if not isinstance(result, Failure):
+            self._store(host, _Entry(result, now + self.ttl))
+        else:
+            entry = self._entries.get(host)
+            if entry is not None and entry.refreshing:
+                # keep serving the address until it expires
+                entry.refreshing = False
+            elif result.check(DNSLookupError) and self.negative_ttl:
+                self._store(host, _Entry(result, now + self.negative_ttl))
+
+        for waiter in self._pending.pop(host):
+            # the waiter may have been cancelled meanwhile
+            if waiter.called:
+                continue
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+
+    def _store(self, host, entry):
+        """Insert or refresh the entry as the most recently used one."""
+        self._entries.pop(host, None)
+        self._entries[host] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+def _lookup_addresses(resolver, host):
+    """
+    Look `host` up with the IHostnameResolver `resolver`.
+
+    :return: a twisted.internet.defer.Deferred firing with the tuple of the
+        addresses of `host`, or failing with DNSLookupError if it has none.
+    """
+
+    resolved = Deferred()
+    addresses = []
+
+    @implementer(IResolutionReceiver)
+    class Receiver(object):
+
+        @staticmethod
+        def resolutionBegan(resolution):
+            pass
+
+        @staticmethod
+        def addressResolved(address):
+            if address.host not in addresses:
+                addresses.append(address.host)
+
+        @staticmethod
+        def resolutionComplete():
+            if addresses:
+                resolved.callback(tuple(addresses))
+            else:
+                resolved.errback(DNSLookupError(
+                    'no results for hostname lookup: {0}'.format(host)))
+
+    resolver.resolveHostName(Receiver(), host)
+    return resolved
+
+
+@implementer(IHostResolution)
+class _Resolution(object):
+
+    def __init__(self, name, deferred):
+        self.name = name
+        self._deferred = deferred
+
+    def cancel(self):
+        self._deferred.cancel()
+
+
+@implementer(IHostnameResolver)
+class _CachedNameResolver(object):
+    """
+    NOTE: Make sure to only use this from the reactor thread as it is
+    accessing twisted API.
+
+    Resolves the hostname of a HostnameEndpoint through a CachingResolver,
+    recording the end of the resolution in `timings`.
+    """
+
+    def __init__(self, reactor, resolver, timings=None):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._timings = timings
+
+    def resolveHostName(self, resolutionReceiver, hostName, portNumber=0,
+                        addressTypes=None, transportSemantics='TCP'):
+        deferred = self._resolver.resolve(self._reactor, hostName)
+        resolution = _Resolution(hostName, deferred)
+        resolutionReceiver.resolutionBegan(resolution)
+
+        def resolved(addresses):
+            if self._timings is not None:
+                self._timings.resolved = now()
+            for address in addresses:
+                if isIPv6Address(address):
+                    address = IPv6Address('TCP', address, portNumber)
+                else:
+                    address = IPv4Address('TCP', address, portNumber)
+                if addressTypes is None or type(address) in addressTypes:
+                    resolutionReceiver.addressResolved(address)
+
+        # a failed lookup resolves no address, failing the connection with
+        # DNSLookupError
+        deferred.addCallbacks(resolved, lambda _: None)
+        deferred.addCallback(
+            lambda _: resolutionReceiver.resolutionComplete())
+        return resolution
+
+
+@implementer(IReactorPluggableNameResolver)
+class _NameResolverReactor(object):
+    """A reactor whose name resolver is replaced, for HostnameEndpoint."""
+
+    def __init__(self, reactor, nameResolver):
+        self._reactor = reactor
+        self.nameResolver = nameResolver
+
+    def installNameResolver(self, resolver):
+        previous, self.nameResolver = self.nameResolver, resolver
+        return previous
+
+    def __getattr__(self, name):
+        return getattr(self._reactor, name)
+
+
+@implementer(IStreamClientEndpoint)
+class ResolvingEndpoint(object):
+    """A TCP endpoint resolving its hostname through a CachingResolver,
+    connecting to its IPv4 and IPv6 addresses like twisted HostnameEndpoint.
+
+    The timeout bounds the resolution and the connection together.
+    """
+
+    def __init__(self, reactor, resolver, host, port, timeout=None):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+
+    def connect(self, protocolFactory):
+        kwargs = {}
+        if self._timeout is not None:
+            kwargs['timeout'] = self._timeout
+
+        if _PLUGGABLE_NAME_RESOLVER:
+            deferred = self._connect_addresses(protocolFactory, kwargs)
+        else:
+            deferred = self._connect_first_address(protocolFactory, kwargs)
+        if self._timeout is None:
+            return deferred
+
+        timer = self._reactor.callLater(self._timeout, deferred.cancel)
+
+        def finished(result):
+            if timer.active():
+                timer.cancel()
+            elif isinstance(result, Failure):
+                raise TCPTimedOutError(
+                    string='{0}:{1} was not resolved and connected within '
+                    'connect_timeout={2} seconds'.format(
+                        self._host, self._port, self._timeout),
+                )
+            return result
+
+        deferred.addBoth(finished)
+        return deferred
+
+    def _connect_addresses(self, protocolFactory, kwargs):
+        name_resolver = _CachedNameResolver(
+            self._reactor, self._resolver, current_timings())
+        endpoint = HostnameEndpoint(
+            _NameResolverReactor(self._reactor, name_resolver),
+            self._host,
+            self._port,
+            **kwargs
+        )
+        return endpoint.connect(protocolFactory)
+
+    def _connect_first_address(self, protocolFactory, kwargs):
+        timings = current_timings()
+
+        def connect(addresses):
+            if timings is not None:
+                timings.resolved = now()
+            if isIPv6Address(addresses[0]):
+                endpoint_class = TCP6ClientEndpoint
+            else:
+                endpoint_class = TCP4ClientEndpoint
+            endpoint = endpoint_class(
+                self._reactor, addresses[0], self._port, **kwargs)
+            return endpoint.connect(protocolFactory)
+
+        deferred = self._resolver.resolve(self._reactor, self._host)
+        deferred.addCallback(connect)
+        return deferred
+
+
+@implementer(IAgentEndpointFactory)
+class ResolvingEndpointFactory(object):
+    """
+    NOTE: Make sure to only use this from the reactor thread as it is
+    accessing twisted API.
+
+    Agent endpoint factory connecting over TCP for http and TLS for https,
+    like the default one, but resolving hostnames through a CachingResolver.
+    """
+
+    def __init__(self, reactor, resolver, connect_timeout=None):
+        from twisted.web.client import BrowserLikePolicyForHTTPS
+        self._reactor = reactor
+        self._resolver = resolver
+        self._connect_timeout = connect_timeout
+        self._policy = BrowserLikePolicyForHTTPS()
+
+    def endpointForURI(self, uri):
+        endpoint = ResolvingEndpoint(
+            self._reactor,
+            self._resolver,
+            uri.host.decode('ascii'),
+            uri.port,
+            self._connect_timeout,
+        )
+        if uri.scheme == b'http':
+            return endpoint
+        elif uri.scheme == b'https':
+            creator = self._policy.creatorForNetloc(uri.host, uri.port)
+            return wrapClientTLS(creator, endpoint)
+        raise SchemeNotSupported(
+            "Unsupported scheme: {scheme!r}".format(scheme=uri.scheme))
@@ -17,6 +17,12 @@ class TCPConnectionError(NetworkError):
     """
 
 
+class ProxyTunnelError(TCPConnectionError):
+    """
+    The https proxy could not open a tunnel (CONNECT request) to the server.
+    """
+
+
 class HTTPTimeoutError(NetworkError, crochet.TimeoutError):
     """
     HTTP response was never received.
@@ -27,9 +33,32 @@ class HTTPTimeoutError(NetworkError, crochet.TimeoutError):
     """
 
 
+class CircuitOpenError(NetworkError):
+    """
+    The request was not sent because the circuit of a
+    :class:`fido.breaker.CircuitBreaker` to its host is open: too many of
+    the last requests to the host failed.
+    """
+
+
 class GzipDecompressionError(zlib.error):
     """
     Failed to decompress a gzip-enabled response.
     A server may return a response that is not compressed or has an
     unsupported format.
     """
+
+
+class QueueTimeoutError(Exception):
+    """
+    The request waited too long for a free slot in a
+    :class:`fido.limits.ConcurrencyLimiter` and was never sent.
+    """
+
+
+class ResponseTooLargeError(Exception):
+    """
+    The response body is larger than the allowed max_body_size or
+    max_decompressed_size. The connection was dropped as soon as the limit
+    was crossed.
+    """
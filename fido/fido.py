@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import collections
+import functools
 import io
 import json
-import os
 import sys
 
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
+
 import crochet
 import six
 import zlib
@@ -12,16 +18,44 @@ from six.moves.urllib_parse import urlparse
 from twisted.python.failure import Failure
 from twisted.internet.defer import CancelledError
 from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
 from twisted.internet.endpoints import TCP4ClientEndpoint
 from twisted.internet.error import ConnectError
 from twisted.internet.protocol import Protocol
+from twisted.internet.threads import deferToThreadPool
 from yelp_bytes import to_bytes
 
 from . import __about__
+from .body import BufferReader
+from .body import IteratorReader
+from .body import as_byte_view
+from .body import is_bytes_like
+from .body import is_path
+from .body import is_reusable
+from .body import open_mapped_file
 from .common import listify_headers
+from .dns import ResolvingEndpoint
+from .dns import ResolvingEndpointFactory
+from .proxy import ProxyEndpointFactory
+from .proxy import ProxyRoutingAgent
+from .proxy import SchemeDispatchAgent
+from .proxy import get_proxy_config
+from .proxy import proxy_authorization
 from fido.exceptions import TCPConnectionError
 from fido.exceptions import HTTPTimeoutError
 from fido.exceptions import GzipDecompressionError
+from fido.exceptions import ResponseTooLargeError
+from fido.limits import CancelledWhileQueued
+from fido.metrics import BYTES_RECEIVED
+from fido.metrics import CONNECT_ERRORS
+from fido.metrics import TIMEOUTS
+from fido.metrics import get_metrics
+from fido.metrics import request_completed
+from fido.metrics import request_sent
+from fido.streaming import BodyStream
+from fido.timings import Timings
+from fido.timings import now
+from fido.timings import recording
 
 
 ##############################################################################
@@ -54,13 +88,61 @@ DEFAULT_CONNECT_TIMEOUT = None
 # headers and checksums.
 GZIP_WINDOW_SIZE = zlib.MAX_WBITS | 16
 
+# Content codings fido can decompress, advertised in the accept-encoding
+# request header when decompress_gzip is enabled.
+ACCEPTED_ENCODINGS = ('gzip', 'deflate')
+
+# Request bodies are only compressed when compress_body is enabled and they
+# are at least DEFAULT_COMPRESS_MIN_SIZE bytes long: below that the gzip
+# framing overhead and the CPU time are not worth the saved bytes.
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+
+# Process-wide cache of persistent connection pools, keyed by the options
+# that affect which connections can be shared: the proxy URLs and
+# tcp_nodelay. There is one pool per distinct combination, so the cache stays
+# small as long as the proxies are a handful of URLs. The pools are owned by
+# the reactor: this dictionary must only be accessed from the reactor thread
+# and cached connections are closed when the reactor shuts down.
+_persistent_pools = {}
+
+# Maximum number of agents kept in _persistent_agents.
+MAX_PERSISTENT_AGENTS = 64
+
+# Agents using the persistent pools, keyed by the options they are built
+# from, least recently used first. Caching them saves parsing the proxy URLs
+# on every request and keeps the proxy endpoints the same, which http_proxy
+# connections are pooled by. The cache is bounded as connect_timeout may be
+# computed per request (e.g. from a deadline). Only accessed from the reactor
+# thread.
+_persistent_agents = collections.OrderedDict()
+
+
+def _stdlib_json_loads(body):
+    """Parse a JSON document from bytes with the standard library."""
+    # json.loads only accepts bytes from python 3.6
+    if six.PY3 and sys.version_info < (3, 6):
+        body = body.decode('utf-8')
+    return json.loads(body)
+
+
+# The function parsing Response.json() when no json_decoder is given. Faster
+# decoders such as orjson or ujson are opt-in: they differ from the standard
+# library on NaN and Infinity, very large integers and the errors raised.
+DEFAULT_JSON_DECODER = _stdlib_json_loads
+
+# Marks a Response whose body was not parsed yet, as None is valid JSON.
+_NOT_PARSED = object()
+
 
 def _build_body_producer(body, headers):
     """
     Prepares the body and the headers for the twisted http request performed
     by the Twisted Agent.
 
-    :param body: request body, MUST be of type bytes.
+    :param body: request body, either bytes, a bytearray or memoryview, a
+        file object, a path to a file (twisted FilePath or os.PathLike) or an
+        iterable of bytes chunks.
 
     :returns: a Twisted FileBodyProducer object as required by Twisted Agent
     """
@@ -68,14 +150,28 @@ def _build_body_producer(body, headers):
     if not body:
         return None, headers
 
-    # body must be of bytes type.
-    bodyProducer = _twisted_web_client().FileBodyProducer(io.BytesIO(body))
+    if isinstance(body, six.binary_type):
+        input_file = io.BytesIO(body)
+    elif is_bytes_like(body):
+        input_file = BufferReader(body)
+    elif is_path(body):
+        input_file = open_mapped_file(body)
+    elif hasattr(body, 'read'):
+        input_file = body
+    elif isinstance(body, six.text_type) or not hasattr(body, '__iter__'):
+        # body must be of bytes type.
+        input_file = io.BytesIO(body)
+    else:
+        input_file = IteratorReader(body)
+
+    bodyProducer = _twisted_web_client().FileBodyProducer(input_file)
 
     # content-length needs to be removed because it was computed based on
     # body but body is now being processed by twisted FileBodyProducer
     # causing content-length to lose meaning and break the client.
     # FileBodyProducer will take care of re-computing length and re-adding
-    # a new content-length header later.
+    # a new content-length header later, unless the length is unknown in
+    # which case the body is sent with the chunked transfer encoding.
     twisted_headers = dict(
         (key, value)
         for (key, value) in six.iteritems(headers)
@@ -85,37 +181,321 @@ def _build_body_producer(body, headers):
     return bodyProducer, twisted_headers
 
 
+def _compress_body(body, headers, level, min_size):
+    """
+    Gzip the request body and set the content-encoding header accordingly.
+    Bodies smaller than `min_size` or already encoded (i.e. with a
+    content-encoding header) are left as they are.
+
+    The content-length header is not updated here: it is stripped and
+    re-computed from the compressed body by `_build_body_producer`.
+
+    :param body: request body, only compressed if it is bytes-like.
+    :param headers: a dictionary of request headers, not modified in place.
+
+    :returns: a (body, headers) tuple.
+    """
+
+    # only bodies held in memory are compressed, streamed bodies are sent
+    # as they are
+    body = as_byte_view(body)
+    if not is_bytes_like(body) or len(body) < min_size:
+        return body, headers
+
+    if any(to_bytes(key).lower() == b'content-encoding' for key in headers):
+        return body, headers
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WINDOW_SIZE)
+    body = compressor.compress(body) + compressor.flush()
+
+    headers = dict(headers)
+    headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+class ResponseHeaders(Mapping):
+    """A read-only, case-insensitive mapping of the response headers, from
+    bytes header names to lists of bytes values.
+
+    It is a view over the twisted Headers of the response: nothing is copied.
+    Header names can be looked up in any case, as bytes or as text.
+    Iterating yields the canonical header names (e.g. b'Content-Type').
+    """
+
+    __slots__ = ('_headers',)
+
+    def __init__(self, headers):
+        self._headers = headers
+
+    def __getitem__(self, name):
+        if isinstance(name, six.text_type):
+            name = to_bytes(name)
+        elif not isinstance(name, six.binary_type):
+            raise KeyError(name)
+        values = self._headers.getRawHeaders(name)
+        if values is None:
+            raise KeyError(name)
+        return values
+
+    def __contains__(self, name):
+        if isinstance(name, six.text_type):
+            name = to_bytes(name)
+        elif not isinstance(name, six.binary_type):
+            return False
+        return self._headers.hasHeader(name)
+
+    def __iter__(self):
+        for name, _ in self._headers.getAllRawHeaders():
+            yield name
+
+    def __len__(self):
+        return sum(1 for _ in self._headers.getAllRawHeaders())
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, dict(self.items()))
+
+
 class Response(object):
     """An HTTP response.
 
     :ivar code: the integer response code.
-    :ivar headers: a dictionary of response headers, mapping from string keys
-        to lists of string values.
+    :ivar headers: a read-only :class:`ResponseHeaders` mapping of the
+        response headers, from case-insensitive bytes header names to lists
+        of bytes values. It is only built when first accessed.
     :ivar body: the response body.
     :ivar reason: the http reason phrase.
+    :ivar timings: the :class:`fido.timings.Timings` of the request if
+        enabled (see :func:`fido.fetch`), None otherwise.
     """
 
-    def __init__(self, code, headers, body, reason):
-        self.headers = dict(headers.getAllRawHeaders())
+    __slots__ = (
+        'code', 'body', 'reason', 'timings', '_raw_headers', '_headers',
+        '_json_decoder', '_json',
+    )
+
+    def __init__(self, code, headers, body, reason, json_decoder=None,
+                 timings=None):
+        self._raw_headers = headers
+        self._headers = None
         self.code = code
         self.body = body
         self.reason = reason
+        self.timings = timings
+        self._json_decoder = json_decoder
+        self._json = _NOT_PARSED
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = ResponseHeaders(self._raw_headers)
+        return self._headers
 
     def json(self):
-        """Helper function to load a JSON response body."""
-        return json.loads(self.body.decode('utf-8'))
+        """
+        Helper function to load a JSON response body.
+
+        The body is parsed from bytes with the `json_decoder` of the request
+        (see :func:`fido.fetch`) on the first call only: the same object is
+        returned by the following calls, so mutating it affects them too.
+        """
 
+        if self._json is _NOT_PARSED:
+            decoder = self._json_decoder or DEFAULT_JSON_DECODER
+            self._json = decoder(self.body)
+        return self._json
 
-class HTTPBodyFetcher(Protocol):
 
-    def __init__(self, response, finished, decompress_gzip):
-        self.buffer = io.BytesIO()
+class ContentDecoder(object):
+    """Incrementally decompresses a gzip or deflate encoded response body.
+
+    Servers are inconsistent with the deflate encoding: RFC 7230 specifies
+    the zlib format but some send raw deflate data. Both are accepted.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+            # data received until the zlib format is confirmed, to retry as
+            # raw deflate
+            self._first_data = b''
+        else:
+            self._decompressor = zlib.decompressobj(GZIP_WINDOW_SIZE)
+            self._first_data = None
+
+    @classmethod
+    def for_response(cls, response):
+        """
+        Return a decoder for the content-encoding of a twisted `response`,
+        None if its body is not compressed (or compressed in a format we
+        don't support).
+        """
+
+        content_encoding = [
+            coding.strip().lower()
+            for value in response.headers.getRawHeaders('Content-Encoding', [])
+            for coding in value.split(',')
+            if coding.strip()
+        ]
+        if content_encoding in (['gzip'], ['x-gzip']):
+            return cls('gzip')
+        if content_encoding == ['deflate']:
+            return cls('deflate')
+        return None
+
+    def decompress(self, data, max_length=0):
+        """
+        :param max_length: if not 0, stop decompressing once max_length bytes
+            were produced, the rest of the data is then discarded. Used to
+            bail out of decompression bombs without inflating them.
+        :raises zlib.error: if the data is corrupt.
+        """
+
+        if self._first_data is None:
+            return self._decompressor.decompress(data, max_length)
+
+        self._first_data += data
+        try:
+            decompressed = self._decompressor.decompress(data, max_length)
+        except zlib.error:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data, self._first_data = self._first_data, None
+            return self._decompressor.decompress(data, max_length)
+
+        if decompressed:
+            self._first_data = None
+        return decompressed
+
+    def flush(self):
+        """
+        Return the remaining decompressed data once the body was received.
+
+        :raises zlib.error: if the compressed stream is truncated.
+        """
+
+        data = self._decompressor.flush()
+        # Python 2 does not tell whether the end of the stream was reached
+        if not getattr(self._decompressor, 'eof', True):
+            raise zlib.error(
+                'Error -5 while decompressing data: incomplete or truncated '
+                'stream'
+            )
+        return data
+
+
+def _decompression_failure(error):
+    """Wrap a zlib error as a GzipDecompressionError twisted Failure."""
+    return Failure(
+        exc_type=GzipDecompressionError,
+        exc_value=GzipDecompressionError(error),
+        exc_tb=sys.exc_info()[2],
+    )
+
+
+def _too_large_failure(size_name, max_size):
+    """Return a ResponseTooLargeError twisted Failure."""
+    return Failure(ResponseTooLargeError(
+        "Response body exceeded {size_name}={max_size} bytes".format(
+            size_name=size_name,
+            max_size=max_size,
+        )
+    ))
+
+
+class _BodyReceiver(Protocol):
+    """
+    Base protocol receiving the body of a response: the body is decompressed
+    as it is received and its delivery is aborted as soon as it exceeds the
+    size limits.
+
+    Subclasses implement `_is_finished`, `_deliver` and `_finish`.
+    """
+
+    def __init__(
+        self,
+        response,
+        decompress_gzip,
+        max_body_size=None,
+        max_decompressed_size=None,
+        timings=None,
+        metrics=None,
+        host=None,
+    ):
         self.response = response
-        self.finished = finished
         self.decompress_gzip = decompress_gzip
+        self.max_body_size = max_body_size
+        self.max_decompressed_size = max_decompressed_size
+        self.timings = timings
+        self.metrics = metrics
+        self.host = host
+        self.received = 0
+        self.delivered = 0
+        self.decoder = None
+        if decompress_gzip:
+            self.decoder = ContentDecoder.for_response(response)
+
+    def _is_finished(self):
+        raise NotImplementedError
+
+    def _deliver(self, data):
+        raise NotImplementedError
+
+    def _finish(self, failure=None):
+        raise NotImplementedError
+
+    def _abort(self, failure):
+        self._finish(failure)
+        # drop the connection, the rest of the body is useless
+        self.transport.stopProducing()
+
+    def connectionMade(self):
+        # reject up front a body announced as too large
+        length = self.response.length
+        if (self.max_body_size is not None and
+                isinstance(length, six.integer_types) and
+                length > self.max_body_size):
+            self._abort(
+                _too_large_failure('max_body_size', self.max_body_size))
 
     def dataReceived(self, data):
-        self.buffer.write(data)
+        if self._is_finished():
+            return
+
+        self.received += len(data)
+        if self.max_body_size is not None and \
+                self.received > self.max_body_size:
+            self._abort(
+                _too_large_failure('max_body_size', self.max_body_size))
+            return
+
+        max_length = 0
+        if self.max_decompressed_size is not None:
+            # one byte more than allowed is enough to detect the overflow
+            max_length = self.max_decompressed_size - self.delivered + 1
+
+        if self.decoder is not None:
+            started = None if self.timings is None else now()
+            try:
+                data = self.decoder.decompress(data, max_length)
+            except zlib.error as e:
+                self._abort(_decompression_failure(e))
+                return
+            if started is not None:
+                self.timings.decompress_time += now() - started
+
+        if not self._check_decompressed_size(data):
+            return
+        self._deliver(data)
+
+    def _check_decompressed_size(self, data):
+        self.delivered += len(data)
+        if self.max_decompressed_size is not None and \
+                self.delivered > self.max_decompressed_size:
+            self._abort(_too_large_failure(
+                'max_decompressed_size', self.max_decompressed_size,
+            ))
+            return False
+        return True
 
     def connectionLost(self, reason):
         """
@@ -134,36 +514,92 @@ class HTTPBodyFetcher(Protocol):
                 twisted.web.client.Response.html
         """
 
+        if self.metrics is not None:
+            self.metrics.increment(
+                BYTES_RECEIVED, self.received, {'host': self.host})
+
+        if self._is_finished():
+            return
+
         if (reason.check(_twisted_web_client().ResponseDone) or
                 reason.check(_twisted_web_client().PotentialDataLoss)):
 
-            content_encoding = self.response.headers.getRawHeaders(
-                'Content-Encoding', [])
-            body = self.buffer.getvalue()
-
-            if 'gzip' in content_encoding and self.decompress_gzip:
+            if self.decoder is not None:
+                started = None if self.timings is None else now()
                 try:
-                    body = zlib.decompress(body, GZIP_WINDOW_SIZE)
+                    data = self.decoder.flush()
                 except zlib.error as e:
-                    self.finished.errback(
-                        Failure(
-                            exc_type=GzipDecompressionError,
-                            exc_value=GzipDecompressionError(e),
-                            exc_tb=sys.exc_info()[2],
-                        ),
-                    )
+                    self._finish(_decompression_failure(e))
+                    return
+                if started is not None:
+                    self.timings.decompress_time += now() - started
+                if not self._check_decompressed_size(data):
                     return
+                self._deliver(data)
 
-            self.finished.callback(
-                Response(
-                    code=self.response.code,
-                    headers=self.response.headers,
-                    body=body,
-                    reason=self.response.phrase,
-                )
-            )
+            if self.timings is not None:
+                self.timings.body = now()
+            self._finish()
         else:
-            self.finished.errback(reason)
+            self._finish(reason)
+
+
+class HTTPBodyFetcher(_BodyReceiver):
+    """Buffers the body of a response and fires `finished` with a Response."""
+
+    def __init__(self, response, finished, decompress_gzip,
+                 json_decoder=None, **kwargs):
+        super(HTTPBodyFetcher, self).__init__(
+            response, decompress_gzip, **kwargs)
+        self.buffer = io.BytesIO()
+        self.finished = finished
+        self.json_decoder = json_decoder
+
+    def _is_finished(self):
+        return self.finished.called
+
+    def _deliver(self, data):
+        self.buffer.write(data)
+
+    def _finish(self, failure=None):
+        if failure is not None:
+            self.finished.errback(failure)
+            return
+
+        self.finished.callback(
+            Response(
+                code=self.response.code,
+                headers=self.response.headers,
+                body=self.buffer.getvalue(),
+                reason=self.response.phrase,
+                json_decoder=self.json_decoder,
+                timings=self.timings,
+            )
+        )
+
+
+class HTTPBodyStreamer(_BodyReceiver):
+    """Pushes the body of a response to a BodyStream as it is received."""
+
+    def __init__(self, response, stream, decompress_gzip, **kwargs):
+        super(HTTPBodyStreamer, self).__init__(
+            response, decompress_gzip, **kwargs)
+        self.stream = stream
+
+    def connectionMade(self):
+        self.stream._connect(self.transport)
+        super(HTTPBodyStreamer, self).connectionMade()
+
+    def _is_finished(self):
+        return self.stream._done
+
+    def _deliver(self, data):
+        if data:
+            self.stream._write(data)
+        self.stream._update_production()
+
+    def _finish(self, failure=None):
+        self.stream._finish(failure)
 
 
 def _set_deferred_timeout(reactor, deferred, timeout):
@@ -175,10 +611,12 @@ def _set_deferred_timeout(reactor, deferred, timeout):
     cancelled after 'timeout' seconds. This timeout represents the maximum
     allowed time for Fido to wait for the server response after the connection
     has been established by the Twisted Agent.
+
+    :return: the timer cancelling the deferred, None if there is no timeout.
     """
 
     if timeout is None:
-        return
+        return None
 
     # set a timer to cancel the deferred request when/if the timeout is hit
     cancel_deferred_timer = reactor.callLater(timeout, deferred.cancel)
@@ -190,9 +628,162 @@ def _set_deferred_timeout(reactor, deferred, timeout):
         return response
 
     deferred.addBoth(request_completed_on_time)
+    return cancel_deferred_timer
+
+
+def _with_default_user_agent(headers):
+    """Return a copy of `headers` with the default User-Agent if missing."""
+
+    # Make a copy to avoid mutating the original value
+    headers = dict(headers or {})
+
+    if not any(header.lower() == 'user-agent' for header in headers):
+        headers['User-Agent'] = [DEFAULT_USER_AGENT]
+
+    return headers
+
+
+class _FetchOptions(collections.namedtuple('_FetchOptions', (
+    'timeout',
+    'connect_timeout',
+    'tcp_nodelay',
+    'decompress_gzip',
+    'persistent',
+    'limiter',
+    'stream',
+    'max_body_size',
+    'max_decompressed_size',
+    'resolver',
+    'json_decoder',
+    'parse_json',
+    'retry',
+    'hedge',
+    'breaker',
+    'timings',
+    'cache',
+    'coalescer',
+))):
+    """
+    The options of a request besides its url, method, headers and body, built
+    in the calling thread (see `_prepare_fetch_args`) and passed to
+    `_fetch_in_reactor`. See :func:`fetch` for their meaning.
+
+    :ivar connect_timeout: maximum time to set up the http connection before
+        aborting. Note that after it is set up, `connect_timeout` loses value.
+        If the server takes forever to send the response and if `timeout` is
+        not provided, we could block forever.
+    :ivar timeout: maximum time for the server to send a response back before
+        we abort.
+    :ivar persistent: whether to reuse connections from the shared
+        persistent connection pool.
+    :ivar timings: the :class:`fido.timings.Timings` to record the phases
+        of the request in, None to disable the timings.
+    """
+
+    __slots__ = ()
+
+
+def _fetch_in_reactor(url, method, headers, body, options, agent=None):
+    """
+    This function must be run in the reactor thread because it is calling
+    twisted API which is not thread safe. Use `_fetch_inner` to call it from
+    any other thread.
+    See https://crochet.readthedocs.org/en/1.4.0/api.html#run-in-reactor-\
+    asynchronous-results for additional information.
+
+    The implementation of this function with regards to how to use the Twisted
+    Agent is following the official book Twisted Network Programming Essentials
+    chapter 'Web Clients', paragraph 'Agent', page 55 - 2nd Edition.
+
+    :param url: the URL, as bytes.
+    :param method: the HTTP method, as bytes.
+    :param headers: the twisted Headers of the request, which are not
+        modified: each attempt sends a copy of its own.
+    :param body: the request body, see :func:`fetch`.
+    :param options: the :class:`_FetchOptions` of the request.
+    :param agent: the agent sending the request, defaults to the agent
+        returned by `get_agent` for the options.
+
+    :return: a twisted.internet.defer.Deferred object
+    """
+
+    if options.timings is not None:
+        options.timings.scheduled = now()
+
+    reactor = _import_reactor()
+    if agent is None:
+        agent = get_agent(
+            reactor,
+            options.connect_timeout,
+            options.tcp_nodelay,
+            options.persistent,
+            options.resolver,
+        )
+
+    def send():
+        bodyProducer, _ = _build_body_producer(body, {})
+
+        # each attempt may add headers to its own copy
+        request_headers = headers.copy()
+        # a content-length computed for the body would lose meaning, see
+        # _build_body_producer
+        if bodyProducer is not None:
+            request_headers.removeHeader(b'content-length')
+
+        return _send_request(
+            reactor,
+            agent,
+            url,
+            method,
+            request_headers,
+            bodyProducer,
+            options.timeout,
+            options.connect_timeout,
+            options.decompress_gzip,
+            limiter=options.limiter,
+            stream=options.stream,
+            max_body_size=options.max_body_size,
+            max_decompressed_size=options.max_decompressed_size,
+            json_decoder=options.json_decoder,
+            parse_json=options.parse_json,
+            breaker=options.breaker,
+            timings=options.timings,
+            cache=options.cache,
+            coalescer=options.coalescer,
+        )
+
+    return _send_with_policies(
+        reactor, method, body, send, options.retry, options.hedge)
+
+
+def _send_with_policies(reactor, method, body, send, retry=None, hedge=None):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Send a request with `send`, hedged and retried as allowed by the
+    policies: every retry is hedged. Requests whose body can only be sent
+    once are sent once.
+
+    :param send: a function sending the request, returning a Deferred.
+    :param retry: an optional :class:`fido.retry.RetryPolicy`.
+    :param hedge: an optional :class:`fido.hedge.HedgePolicy`.
+    """
+
+    if not is_reusable(body):
+        return send()
+    if hedge is not None:
+        send = functools.partial(hedge.run, reactor, method, send)
+    if retry is not None:
+        return retry.run(reactor, method, send)
+    return send()
+
+
+# Runs _fetch_in_reactor in the reactor thread, returning a crochet
+# EventualResult wrapping its twisted.internet.defer.Deferred object.
+_fetch_inner = crochet.run_in_reactor(_fetch_in_reactor)
 
 
-@crochet.run_in_reactor
 def fetch_inner(
     url,
     method,
@@ -204,52 +795,263 @@ def fetch_inner(
     decompress_gzip,
 ):
     """
-    This function must be run in the reactor thread because it is calling
-    twisted API which is not thread safe.
-    See https://crochet.readthedocs.org/en/1.4.0/api.html#run-in-reactor-\
-    asynchronous-results for additional information.
-
-    The implementation of this function with regards to how to use the Twisted
-    Agent is following the official book Twisted Network Programming Essentials
-    chapter 'Web Clients', paragraph 'Agent', page 55 - 2nd Edition.
-
-    :param connect_timeout: maximum time to set up the http connection before
-        aborting. Note that after it is set up, `connect_timeout` loses value.
-        If the server takes forever to send the response and if `timeout` is
-        not provided, we could block forever.
-    :param timeout: maximum time for the server to send a response back before
-        we abort.
+    Kept for backwards compatibility, use :func:`fetch` instead: make the
+    request with the default values of the other :func:`fetch` options.
 
     :return: a crochet EventualResult wrapping a
         twisted.internet.defer.Deferred object
     """
 
-    bodyProducer, twisted_headers = _build_body_producer(body, headers)
-    reactor = _import_reactor()
+    return _fetch_inner(*_prepare_fetch_args(
+        url,
+        method,
+        headers,
+        body,
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        tcp_nodelay=tcp_nodelay,
+        decompress_gzip=decompress_gzip,
+    ))
 
-    agent = get_agent(reactor, connect_timeout, tcp_nodelay)
-    new_headers = listify_headers(twisted_headers)
+
+def _send_request(
+    reactor,
+    agent,
+    url,
+    method,
+    headers,
+    bodyProducer,
+    timeout,
+    connect_timeout,
+    decompress_gzip,
+    limiter=None,
+    stream=False,
+    max_body_size=None,
+    max_decompressed_size=None,
+    json_decoder=None,
+    parse_json=False,
+    breaker=None,
+    timings=None,
+    cache=None,
+    coalescer=None,
+):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Issue the request through `agent` and wrap the result as a fido Response,
+    translating twisted timeout and connection errors into fido exceptions.
+
+    :param headers: a twisted Headers object, which may be mutated.
+    :param bodyProducer: the body producer built by `_build_body_producer`.
+    :param limiter: an optional :class:`fido.limits.ConcurrencyLimiter`
+        holding the request until a slot is available for its host.
+    :param stream: whether to fire with the Response as soon as the headers
+        are received, the body being pushed to a BodyStream.
+    :param max_body_size: maximum size in bytes of the response body as
+        received, None for no limit.
+    :param max_decompressed_size: maximum size in bytes of the response body
+        once decompressed, None for no limit.
+    :param json_decoder: the function parsing Response.json().
+    :param parse_json: whether to parse the JSON body in the reactor
+        threadpool before firing, so that Response.json() returns at once.
+        Ignored for streamed responses.
+    :param breaker: an optional :class:`fido.breaker.CircuitBreaker` failing
+        the request right before it is sent if the circuit of the host is
+        open.
+    :param timings: the :class:`fido.timings.Timings` of the request to
+        record the phases of this attempt in, None to disable the timings.
+        They are attached to the Response, or to the exception the request
+        fails with.
+    :param cache: an optional :class:`fido.cache.ResponseCache` returning
+        the stored response instead of sending the request when possible.
+        Ignored for streamed responses.
+    :param coalescer: an optional :class:`fido.coalesce.RequestCoalescer`
+        sharing the response of an identical request in flight. Ignored for
+        streamed responses and requests with a body. The `timeout` then
+        applies to the wait for the response, not to the shared request.
+
+    :return: a twisted.internet.defer.Deferred firing with a Response
+    """
 
     if decompress_gzip:
-        if 'gzip' not in new_headers.getRawHeaders('accept-encoding', []):
-            new_headers.addRawHeader('accept-encoding', 'gzip')
-
-    deferred = agent.request(
-        method=method,
-        uri=url,
-        headers=new_headers,
-        bodyProducer=bodyProducer,
-    )
+        accepted = set(
+            coding.split(';')[0].strip().lower()
+            for value in headers.getRawHeaders('accept-encoding', [])
+            for coding in value.split(',')
+        )
+        for coding in ACCEPTED_ENCODINGS:
+            if coding not in accepted:
+                headers.addRawHeader('accept-encoding', coding)
+
+    if (cache is not None or coalescer is not None) and not stream:
+        coalesced = coalescer is not None and bodyProducer is None
+        send_request = functools.partial(
+            _send_request,
+            reactor,
+            agent,
+            url,
+            method,
+            headers,
+            bodyProducer,
+            # the callers of a coalesced request each wait for it with their
+            # own timeout instead
+            None if coalesced else timeout,
+            connect_timeout,
+            decompress_gzip,
+            limiter,
+            stream,
+            max_body_size,
+            max_decompressed_size,
+            json_decoder,
+            parse_json,
+            breaker,
+            timings,
+        )
+        if coalesced:
+            send_request = functools.partial(
+                _coalesced_request,
+                reactor,
+                coalescer,
+                method,
+                url,
+                headers,
+                send_request,
+                (
+                    decompress_gzip,
+                    max_body_size,
+                    max_decompressed_size,
+                    json_decoder,
+                    parse_json,
+                ),
+                timeout,
+                timings,
+            )
+        if cache is None:
+            return send_request()
+        # the request is only sent on a cache miss or to revalidate
+        return cache.request(
+            reactor,
+            method,
+            url,
+            headers,
+            send_request,
+            decompress_gzip,
+            json_decoder,
+            timings,
+        )
+
+    if timings is not None:
+        timings = timings._next_attempt()
 
     def response_callback(response):
         """Fetch the body once we've received the headers"""
+        if timings is not None:
+            timings.headers = now()
         finished = Deferred()
         response.deliverBody(
-            HTTPBodyFetcher(response, finished, decompress_gzip)
+            HTTPBodyFetcher(
+                response,
+                finished,
+                decompress_gzip,
+                json_decoder=json_decoder,
+                max_body_size=max_body_size,
+                max_decompressed_size=max_decompressed_size,
+                timings=timings,
+                metrics=metrics,
+                host=key,
+            )
         )
         return finished
 
-    deferred.addCallback(response_callback)
+    def stream_response_callback(response):
+        """Start streaming the body once we've received the headers"""
+        if timings is not None:
+            timings.headers = now()
+        body = BodyStream(reactor)
+        response.deliverBody(
+            HTTPBodyStreamer(
+                response,
+                body,
+                decompress_gzip,
+                max_body_size=max_body_size,
+                max_decompressed_size=max_decompressed_size,
+                timings=timings,
+                metrics=metrics,
+                host=key,
+            )
+        )
+        # delivering the body resumes the connection, which is paused again
+        # if the data buffered by Twisted already filled the stream
+        body._update_production()
+        return Response(
+            code=response.code,
+            headers=response.headers,
+            body=body,
+            reason=response.phrase,
+            json_decoder=json_decoder,
+            timings=timings,
+        )
+
+    metrics = get_metrics()
+    key = None
+    if limiter is not None or breaker is not None or metrics is not None:
+        key = _host_key(url)
+    # what the breaker returned when letting the request through
+    admitted = []
+    # when the request was sent, if reported to the metrics
+    sent_at = []
+
+    def request():
+        if breaker is not None:
+            admitted.append(breaker.acquire(reactor, key))
+        if metrics is not None:
+            sent_at.append(now())
+            length = getattr(bodyProducer, 'length', None)
+            request_sent(
+                metrics,
+                key,
+                length if isinstance(length, six.integer_types) else None,
+            )
+        agent_request = functools.partial(
+            agent.request,
+            method=method,
+            uri=url,
+            headers=headers,
+            bodyProducer=bodyProducer,
+        )
+        if timings is None:
+            deferred = agent_request()
+        else:
+            timings.sent = now()
+            # the connection pool records the connection phases
+            with recording(timings):
+                deferred = agent_request()
+        if stream:
+            deferred.addCallback(stream_response_callback)
+        else:
+            deferred.addCallback(response_callback)
+        return deferred
+
+    if limiter is None:
+        deferred = maybeDeferred(request)
+    else:
+        def release(result):
+            """Free the slot once the whole body was received"""
+            if stream and isinstance(result, Response):
+                result.body._finished.addCallback(
+                    lambda _: limiter.release(reactor, key))
+            else:
+                limiter.release(reactor, key)
+            return result
+
+        def send(_):
+            deferred = maybeDeferred(request)
+            deferred.addBoth(release)
+            return deferred
+
+        deferred = limiter.acquire(reactor, key)
+        deferred.addCallback(send)
 
     def handle_timeout_errors(error):
         """
@@ -263,13 +1065,28 @@ def fetch_inner(
 
         if error.check(_twisted_web_client().ResponseNeverReceived):
             if error.value.reasons[0].check(CancelledError):
+                if metrics is not None:
+                    metrics.increment(
+                        TIMEOUTS, tags={'host': key, 'phase': 'response'})
                 raise HTTPTimeoutError(
                     "Connection was closed by fido because the server took "
                     "more than timeout={timeout} seconds to "
                     "send the response".format(timeout=timeout)
                 )
 
+        elif error.check(CancelledWhileQueued):
+            if metrics is not None:
+                metrics.increment(
+                    TIMEOUTS, tags={'host': key, 'phase': 'queue'})
+            raise HTTPTimeoutError(
+                "Request was cancelled by fido because it waited more than "
+                "timeout={timeout} seconds for a free slot to the "
+                "server".format(timeout=timeout)
+            )
+
         elif error.check(ConnectError):
+            if metrics is not None:
+                metrics.increment(CONNECT_ERRORS, tags={'host': key})
             raise TCPConnectionError(
                 "Connection was closed by Twisted Agent because there was "
                 "a problem establishing the connection or the "
@@ -281,48 +1098,346 @@ def fetch_inner(
     deferred.addErrback(handle_timeout_errors)
 
     # sets timeout if it is not None
-    _set_deferred_timeout(reactor, deferred, timeout)
+    timer = _set_deferred_timeout(reactor, deferred, timeout)
+
+    def record_outcome(result):
+        """Tell the breaker whether the request failed"""
+        if not admitted:
+            # failed by the breaker or never sent
+            return result
+
+        if not isinstance(result, Failure):
+            failed = result.code in breaker.failure_status_codes
+        elif timer is not None and timer.called:
+            # timed out
+            failed = True
+        elif result.check(HTTPTimeoutError, CancelledError):
+            # cancelled by the caller
+            failed = None
+        elif result.check(
+            TCPConnectionError,
+            _twisted_web_client().ResponseFailed,
+            _twisted_web_client().ResponseNeverReceived,
+        ):
+            failed = True
+        else:
+            failed = None
+
+        breaker.release(reactor, key, admitted[0], failed)
+        return result
+
+    if breaker is not None:
+        deferred.addBoth(record_outcome)
+
+    def record_metrics(result):
+        """Report the response or the error of the request sent"""
+        if not sent_at:
+            return result
+
+        if isinstance(result, Failure):
+            status = result.type.__name__
+        else:
+            status = result.code
+        request_completed(
+            metrics,
+            key,
+            method.decode('ascii'),
+            status,
+            now() - sent_at[0],
+        )
+        return result
+
+    if metrics is not None:
+        deferred.addBoth(record_metrics)
+
+    # added after the timeout, which only applies to the request
+    if parse_json and not stream:
+        deferred.addCallback(_parse_json_in_thread, reactor)
+
+    if timings is not None:
+        deferred.addBoth(_attach_timings, timings)
 
     return deferred
 
 
-def get_agent(reactor, connect_timeout=None, tcp_nodelay=False):
-    """Return appropriate agent based on whether an http_proxy is used or not.
+def _coalesced_request(reactor, coalescer, method, url, headers, send,
+                       options, timeout, timings=None):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Send the request through `coalescer`, waiting at most `timeout` seconds
+    for its response. The request in flight is sent without a timeout: it is
+    shared by callers with different timeouts, each of them only stops
+    waiting for it on its own timeout.
+
+    :return: a twisted.internet.defer.Deferred firing with a Response
+    """
+
+    deferred = coalescer.request(
+        method, url, headers, send, options, timings)
+    timer = _set_deferred_timeout(reactor, deferred, timeout)
+    if timer is None:
+        return deferred
+
+    def handle_timeout_error(error):
+        if timer.called and error.check(CancelledError):
+            raise HTTPTimeoutError(
+                "Request was cancelled by fido because the server took "
+                "more than timeout={timeout} seconds to "
+                "send the response".format(timeout=timeout)
+            )
+        return error
+
+    deferred.addErrback(handle_timeout_error)
+    return deferred
+
+
+def _attach_timings(result, timings):
+    """Record the end of a request, attaching its timings to the exception
+    it failed with."""
+
+    timings.end = now()
+    if isinstance(result, Failure):
+        result.value.timings = timings
+    return result
+
+
+def _parse_json_in_thread(response, reactor):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Parse the JSON body of `response` in the reactor threadpool, so that
+    large documents don't block the reactor, then fire with the response.
+    A body that is not valid JSON is left unparsed: Response.json() raises
+    the error when called.
+    """
+
+    deferred = deferToThreadPool(
+        reactor, reactor.getThreadPool(), response.json)
+    deferred.addErrback(lambda _: None)
+    deferred.addCallback(lambda _: response)
+    return deferred
+
+
+def _host_key(url):
+    """Return the 'host:port' string identifying the server of `url`."""
+    uri = _twisted_web_client().URI.fromBytes(url)
+    return '{host}:{port}'.format(
+        host=uri.host.decode('ascii'),
+        port=uri.port,
+    )
+
+
+def _build_pool(reactor, tcp_nodelay, persistent):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Return a new connection pool, setting TCP_NODELAY on its connections if
+    `tcp_nodelay` is enabled.
+    """
+
+    if tcp_nodelay:
+        from fido._client import HTTPConnectionPoolOverride
+        return HTTPConnectionPoolOverride(
+            reactor=reactor,
+            persistent=persistent,
+        )
+
+    from fido._client import HTTPConnectionPool
+    return HTTPConnectionPool(reactor=reactor, persistent=persistent)
+
+
+def _get_persistent_pool(reactor, http_proxy, tcp_nodelay, https_proxy=None):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API and the process-wide pool cache.
+
+    Return the persistent connection pool shared by all the requests made with
+    the same proxies and tcp_nodelay option, creating it on first use. The
+    connect_timeout only applies to opening connections, so idle connections
+    are shared whatever the connect_timeout of the requests.
+    """
+
+    key = (http_proxy, https_proxy, tcp_nodelay)
+    pool = _persistent_pools.get(key)
+    if pool is not None:
+        return pool
+
+    pool = _build_pool(reactor, tcp_nodelay, persistent=True)
+
+    # close idle keep-alive connections cleanly when the reactor stops
+    reactor.addSystemEventTrigger(
+        'before', 'shutdown', pool.closeCachedConnections,
+    )
+    _persistent_pools[key] = pool
+    return pool
+
+
+def get_agent(reactor, connect_timeout=None, tcp_nodelay=False,
+              persistent=False, resolver=None):
+    """Return appropriate agent based on the proxy configuration.
 
     :param connect_timeout: connection timeout in seconds
     :type connect_timeout: float
     :param tcp_nodelay: flag to enable tcp_nodelay for request
     :type tcp_nodelay: boolean
+    :param persistent: flag to reuse keep-alive connections from a
+        process-wide pool shared by agents with the same options
+    :type persistent: boolean
+    :param resolver: resolves the hostnames instead of the reactor resolver
+    :type resolver: :class:`fido.dns.CachingResolver`
     :returns: :class:`twisted.web.client.ProxyAgent` when an http_proxy
-        environment variable is present, :class:`twisted.web.client.Agent`
-        otherwise.
+        is configured, :class:`twisted.web.client.Agent` otherwise. Requests
+        to the no_proxy hosts are routed to a direct agent.
     """
 
-    # TODO: Would be nice to have https_proxy support too.
-    http_proxy = os.environ.get('http_proxy')
+    config = get_proxy_config()
 
-    pool = None
+    if persistent:
+        # keyed by the proxy URLs rather than by the configuration, which is
+        # a new object every time it is refreshed
+        key = (
+            reactor,
+            config.http_proxy,
+            config.https_proxy,
+            config.no_proxy,
+            connect_timeout,
+            tcp_nodelay,
+            resolver,
+        )
+        agent = _persistent_agents.pop(key, None)
+        if agent is None:
+            agent = _build_routing_agent(
+                reactor,
+                config,
+                connect_timeout,
+                resolver,
+                lambda http_proxy, https_proxy: _get_persistent_pool(
+                    reactor, http_proxy, tcp_nodelay, https_proxy,
+                ),
+            )
+            if len(_persistent_agents) >= MAX_PERSISTENT_AGENTS:
+                _persistent_agents.popitem(last=False)
+        # the most recently used agent goes last
+        _persistent_agents[key] = agent
+        return agent
 
-    if tcp_nodelay:
-        from fido._client import HTTPConnectionPoolOverride
-        pool = HTTPConnectionPoolOverride(reactor=reactor, persistent=False)
+    # fido's pool records the connection timings
+    pool = _build_pool(reactor, tcp_nodelay, persistent=False)
+
+    return _build_routing_agent(
+        reactor, config, connect_timeout, resolver, lambda *_: pool,
+    )
+
+
+def _build_routing_agent(reactor, config, connect_timeout, resolver,
+                         get_pool):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
 
-    if http_proxy is None:
-        return _twisted_web_client().Agent(
+    Return an agent sending the requests through the proxies of `config`,
+    except for the no_proxy hosts.
+
+    :param config: a :class:`fido.proxy.ProxyConfig`.
+    :param get_pool: returns the connection pool to use given the http and
+        https proxies of the agent.
+    """
+
+    def build(http_proxy, https_proxy):
+        return _build_agent(
             reactor,
-            connectTimeout=connect_timeout,
+            http_proxy,
+            connect_timeout,
+            get_pool(http_proxy, https_proxy),
+            resolver,
+            https_proxy,
+        )
+
+    if not config.proxied:
+        return build(None, None)
+
+    proxied = build(config.http_proxy, config.https_proxy)
+    if not config.matcher:
+        return proxied
+
+    return ProxyRoutingAgent(config, build(None, None), proxied)
+
+
+def _build_agent(reactor, http_proxy, connect_timeout, pool, resolver=None,
+                 https_proxy=None):
+    """
+    NOTE: Make sure to call this only from the reactor thread as it is
+    accessing twisted API.
+
+    Return a :class:`twisted.web.client.ProxyAgent` going through `http_proxy`
+    or a :class:`twisted.web.client.Agent` if no proxy is given. Hostnames
+    are resolved through `resolver` if given.
+
+    If `https_proxy` is given, https requests are tunneled through it with
+    CONNECT and the tunnels are kept in `pool`.
+    """
+
+    if https_proxy:
+        https_agent = _twisted_web_client().Agent.usingEndpointFactory(
+            reactor,
+            ProxyEndpointFactory(
+                reactor,
+                _proxy_endpoint(reactor, https_proxy, connect_timeout,
+                                resolver),
+                proxy_authorization(https_proxy),
+                connect_timeout,
+                resolver,
+            ),
+            pool=pool,
+        )
+        if not http_proxy:
+            return https_agent
+        return SchemeDispatchAgent(
+            _build_agent(reactor, http_proxy, connect_timeout, pool, resolver),
+            https_agent,
+        )
+
+    if not http_proxy:
+        if resolver is None:
+            return _twisted_web_client().Agent(
+                reactor,
+                connectTimeout=connect_timeout,
+                pool=pool,
+            )
+        return _twisted_web_client().Agent.usingEndpointFactory(
+            reactor,
+            ResolvingEndpointFactory(reactor, resolver, connect_timeout),
             pool=pool,
         )
 
-    parse_result = urlparse(http_proxy)
-    http_proxy_endpoint = TCP4ClientEndpoint(
+    http_proxy_endpoint = _proxy_endpoint(
+        reactor, http_proxy, connect_timeout, resolver,
+    )
+    return _twisted_web_client().ProxyAgent(http_proxy_endpoint, pool=pool)
+
+
+def _proxy_endpoint(reactor, proxy, connect_timeout, resolver=None):
+    """Return the endpoint to connect to the `proxy` URL."""
+
+    parse_result = urlparse(proxy)
+    if resolver is None:
+        return TCP4ClientEndpoint(
+            reactor,
+            parse_result.hostname,
+            parse_result.port or 80,
+            timeout=connect_timeout)
+
+    return ResolvingEndpoint(
         reactor,
+        resolver,
         parse_result.hostname,
         parse_result.port or 80,
         timeout=connect_timeout)
 
-    return _twisted_web_client().ProxyAgent(http_proxy_endpoint, pool=pool)
-
 
 def fetch(
     url,
@@ -333,6 +1448,23 @@ def fetch(
     connect_timeout=DEFAULT_CONNECT_TIMEOUT,
     tcp_nodelay=False,
     decompress_gzip=False,
+    persistent=True,
+    limiter=None,
+    stream=False,
+    max_body_size=None,
+    max_decompressed_size=None,
+    compress_body=False,
+    compress_level=DEFAULT_COMPRESS_LEVEL,
+    compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+    resolver=None,
+    json_decoder=None,
+    parse_json=False,
+    retry=None,
+    hedge=None,
+    breaker=None,
+    timings=False,
+    cache=None,
+    coalescer=None,
 ):
     """
     Make an HTTP request.
@@ -346,14 +1478,89 @@ def fetch(
                 'X-Foo': ['Bar'],
                 'X-Baz': ['Quux'],
             }
-    :param body: the request body (must be of bytes type).
+    :param body: the request body. Besides bytes, large bodies can be
+        streamed in constant memory from a bytearray or memoryview (not
+        copied), a file object (closed once sent), a path to a file (a
+        twisted FilePath or os.PathLike object, memory-mapped) or an
+        iterable of bytes chunks. Bodies of unknown length (iterables,
+        unseekable files) are sent with the chunked transfer encoding. Note
+        that files and iterables are read from the reactor thread.
     :param timeout: maximum allowed request time in seconds.
     :param connect_timeout: maximum time allowed to establish a connection
         in seconds.
     :param tcp_nodelay: flag to enable tcp_nodelay for request
-    :param decompress_gzip: flag to enable decompressing gzipped responses.
-        Note that the content-encoding response header will still
+    :param decompress_gzip: flag to enable decompressing gzipped (or
+        deflated) responses. The body is decompressed incrementally as it is
+        received. Note that the content-encoding response header will still
         reflect the encoding of the original response (i.e gzip).
+    :param persistent: flag to reuse keep-alive connections across requests.
+        Connections are kept in a process-wide pool shared by all the requests
+        with the same proxy and tcp_nodelay options. Set it to False to open a
+        new connection for this request only.
+    :param limiter: a :class:`fido.limits.ConcurrencyLimiter` bounding the
+        number of in-flight requests per host and overall. The request waits
+        in the limiter queue until a slot is available, this waiting time is
+        part of `timeout`.
+    :param stream: flag to get the response as soon as its headers are
+        received instead of waiting for the whole body. The body of the
+        response is then a :class:`fido.streaming.BodyStream` to iterate over
+        from the calling thread, and `timeout` only applies to receiving the
+        headers.
+    :param max_body_size: maximum size in bytes of the response body as
+        received from the server. A response announcing a larger
+        Content-Length fails right away, otherwise the connection is dropped
+        as soon as the limit is crossed. The request then fails with
+        :class:`fido.exceptions.ResponseTooLargeError`.
+    :param max_decompressed_size: maximum size in bytes of the response body
+        once decompressed (see `decompress_gzip`). Decompression stops as
+        soon as the limit is crossed, which protects against decompression
+        bombs. The request then fails with
+        :class:`fido.exceptions.ResponseTooLargeError`.
+    :param compress_body: flag to gzip the request body, for servers
+        accepting gzipped requests. The content-encoding request header is
+        set accordingly. Bodies that already have a content-encoding header
+        are sent as they are.
+    :param compress_level: the zlib compression level, from 1 (fastest) to 9
+        (smallest).
+    :param compress_min_size: bodies smaller than this number of bytes are
+        sent uncompressed.
+    :param resolver: a :class:`fido.dns.CachingResolver` caching the hostname
+        resolutions, shared across requests.
+    :param json_decoder: the function parsing the bytes body in
+        Response.json(), e.g. orjson.loads or ujson.loads for faster
+        parsing. Defaults to the standard json module.
+    :param parse_json: flag to parse the JSON body in the reactor
+        threadpool before the response is delivered, so that Response.json()
+        returns at once and large documents block neither the reactor nor
+        the calling thread. A body that is not valid JSON does not fail the
+        request: Response.json() raises the error when called. Ignored with
+        `stream`.
+    :param retry: a :class:`fido.retry.RetryPolicy` sending the request
+        again from the reactor thread when it fails with a retryable error
+        or status code. Requests whose body is a file object or an iterable
+        are never retried, as their body can only be sent once.
+    :param hedge: a :class:`fido.hedge.HedgePolicy` sending a second
+        identical request when the response is slow to come, the first
+        response winning. Like `retry`, it only applies to requests whose
+        body can be sent again. Each retry is hedged.
+    :param breaker: a :class:`fido.breaker.CircuitBreaker` shared by the
+        requests to the same hosts. While the circuit of the host is open,
+        the request fails right away with
+        :class:`fido.exceptions.CircuitOpenError` instead of waiting for the
+        connect_timeout or timeout of an unhealthy host.
+    :param timings: flag to record when each phase of the request happened,
+        from the call to fetch to the delivery of the response, in a
+        :class:`fido.timings.Timings` set as the `timings` attribute of the
+        Response, or of the exception the request fails with.
+    :param cache: a :class:`fido.cache.ResponseCache` shared by the
+        requests. Fresh responses to GET requests are returned from the cache
+        without sending the request, stale ones are revalidated with a
+        conditional request. Ignored with `stream`.
+    :param coalescer: a :class:`fido.coalesce.RequestCoalescer` shared by
+        the requests. A GET or HEAD request identical to a request already in
+        flight (same URL, headers and options, no body) is not sent: it gets
+        the response of the request in flight, waiting for it at most
+        `timeout` seconds. Ignored with `stream`.
 
     :returns: a crochet EventualResult object which behaves as a future,
         .wait() can be called on it to retrieve the fido.fido.Response object.
@@ -363,25 +1570,109 @@ def fetch(
 
     """
 
-    # Twisted requires the method, url, headers to be bytes
-    url = to_bytes(url)
-    method = to_bytes(method)
-
-    # Make a copy to avoid mutating the original value
-    headers = dict(headers or {})
-
-    if not any(header.lower() == 'user-agent' for header in headers):
-        headers['User-Agent'] = [DEFAULT_USER_AGENT]
-
-    # initializes twisted reactor in a different thread
-    crochet.setup()
-    return fetch_inner(
+    args = _prepare_fetch_args(
         url,
         method,
         headers,
         body,
-        timeout,
-        connect_timeout,
-        tcp_nodelay,
-        decompress_gzip,
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        tcp_nodelay=tcp_nodelay,
+        decompress_gzip=decompress_gzip,
+        persistent=persistent,
+        limiter=limiter,
+        stream=stream,
+        max_body_size=max_body_size,
+        max_decompressed_size=max_decompressed_size,
+        compress_body=compress_body,
+        compress_level=compress_level,
+        compress_min_size=compress_min_size,
+        resolver=resolver,
+        json_decoder=json_decoder,
+        parse_json=parse_json,
+        retry=retry,
+        hedge=hedge,
+        breaker=breaker,
+        timings=timings,
+        cache=cache,
+        coalescer=coalescer,
+    )
+
+    # initializes twisted reactor in a different thread
+    crochet.setup()
+    return _fetch_inner(*args)
+
+
+def _prepare_fetch_args(
+    url,
+    method='GET',
+    headers=None,
+    body='',
+    timeout=DEFAULT_TIMEOUT,
+    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+    tcp_nodelay=False,
+    decompress_gzip=False,
+    persistent=True,
+    limiter=None,
+    stream=False,
+    max_body_size=None,
+    max_decompressed_size=None,
+    compress_body=False,
+    compress_level=DEFAULT_COMPRESS_LEVEL,
+    compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+    resolver=None,
+    json_decoder=None,
+    parse_json=False,
+    retry=None,
+    hedge=None,
+    breaker=None,
+    timings=False,
+    cache=None,
+    coalescer=None,
+):
+    """
+    Normalize the arguments of :func:`fetch` into the (url, method, headers,
+    body, options) arguments expected by `_fetch_in_reactor`: the url and
+    method as bytes, the headers as twisted Headers and the other options as
+    a :class:`_FetchOptions`.
+    """
+
+    # the request starts in the calling thread
+    if timings:
+        timings = Timings()
+    else:
+        timings = None
+
+    # Twisted requires the method, url, headers to be bytes
+    url = to_bytes(url)
+    method = to_bytes(method)
+
+    headers = _with_default_user_agent(headers)
+
+    # compressing large bodies is CPU bound: do it in the calling thread
+    # rather than blocking the reactor
+    if compress_body:
+        body, headers = _compress_body(
+            body, headers, compress_level, compress_min_size)
+
+    options = _FetchOptions(
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        tcp_nodelay=tcp_nodelay,
+        decompress_gzip=decompress_gzip,
+        persistent=persistent,
+        limiter=limiter,
+        stream=stream,
+        max_body_size=max_body_size,
+        max_decompressed_size=max_decompressed_size,
+        resolver=resolver,
+        json_decoder=json_decoder,
+        parse_json=parse_json,
+        retry=retry,
+        hedge=hedge,
+        breaker=breaker,
+        timings=timings,
+        cache=cache,
+        coalescer=coalescer,
     )
+    return url, method, listify_headers(headers), body, options
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+concurrent.futures flavour of :func:`fido.fetch`. The returned futures are
+resolved straight from the reactor thread, so any number of requests can be
+multiplexed with concurrent.futures.wait or as_completed without a thread
+waiting on each of them.
+
+On Python 2 this module requires the futures backport.
+"""
+from __future__ import absolute_import
+from concurrent.futures import Future
+
+import crochet
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from .fido import _fetch_in_reactor
+from .fido import _import_reactor
+from .fido import _prepare_fetch_args
+
+
+def _call_in_reactor(reactor, function, *args):
+    """
+    Call `function` in the reactor thread and return a
+    concurrent.futures.Future resolved with the result of the Deferred it
+    returns. Cancelling the future cancels the Deferred.
+    """
+
+    future = Future()
+    # the Deferred, only accessed from the reactor thread
+    pending = []
+
+    def resolve(result):
+        # False if the future was cancelled meanwhile
+        if not future.set_running_or_notify_cancel():
+            return
+        if isinstance(result, Failure):
+            future.set_exception(result.value)
+        else:
+            future.set_result(result)
+
+    def start():
+        deferred = maybeDeferred(function, *args)
+        pending.append(deferred)
+        deferred.addBoth(resolve)
+
+    def cancel():
+        for deferred in pending:
+            deferred.cancel()
+
+    def on_done(future):
+        if future.cancelled():
+            reactor.callFromThread(cancel)
+
+    future.add_done_callback(on_done)
+    reactor.callFromThread(start)
+    return future
+
+
+def fetch(url, **kwargs):
+    """
+    Make an HTTP request.
+
+    :param url: the URL to fetch.
+    :param kwargs: the other :func:`fido.fetch` arguments.
+
+    :returns: a concurrent.futures.Future resolved with the
+        fido.fido.Response object or failing with the same exceptions as
+        :func:`fido.fetch`. Cancelling the future before it is resolved
+        cancels the request.
+    """
+
+    args = _prepare_fetch_args(url, **kwargs)
+
+    # initializes twisted reactor in a different thread
+    crochet.setup()
+    return _call_in_reactor(_import_reactor(), _fetch_in_reactor, *args)
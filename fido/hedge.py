@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from fido.retry import IDEMPOTENT_METHODS
+from fido.retry import RetryBudget
+
+
+DEFAULT_MAX_RATIO = 0.1
+DEFAULT_MIN_SAMPLES = 100
+DEFAULT_WINDOW = 1000
+
+
+class HedgePolicy(object):
+    """Cuts the tail latency of slow replicas by sending a second identical
+    request when the first one is slow to respond. The first response wins
+    and the other request is cancelled, closing its connection.
+
+    The hedge is sent after `delay` seconds or, with `percentile`, after the
+    given percentile of the latencies observed by the policy. Until
+    `min_samples` latencies are observed, `delay` is used if given,
+    otherwise requests are not hedged.
+
+    A failure of the first request before the hedge is sent is surfaced
+    right away (see :class:`fido.retry.RetryPolicy` to retry it). Once both
+    requests are in flight, the request only fails if both fail.
+
+    Only the requests with one of `methods` are hedged, and only if their
+    body can be sent again (bytes, a bytearray or memoryview, or a path to a
+    file; not a file object or an iterable).
+
+    A policy is meant to be shared by the requests to a service, which share
+    its latency samples and hedging budget. Its state is only ever modified
+    from the reactor thread.
+
+    :param delay: seconds to wait for a response before hedging.
+    :param percentile: the percentile (e.g. 95) of the observed latencies to
+        wait for before hedging.
+    :param max_ratio: maximum fraction of the requests that are hedged,
+        over a sliding window of 10 seconds.
+    :param methods: the HTTP methods, as bytes, of the requests to hedge.
+        Defaults to the idempotent methods.
+    :param min_samples: number of latencies to observe before using
+        `percentile`.
+    :param window: number of most recent latencies `percentile` is computed
+        over.
+
+    :ivar requests: number of requests sent through the policy.
+    :ivar hedges: number of hedges sent.
+    :ivar wins: number of hedges that responded first.
+    :ivar denied: number of hedges not sent because of `max_ratio`.
+    """
+
+    def __init__(
+        self,
+        delay=None,
+        percentile=None,
+        max_ratio=DEFAULT_MAX_RATIO,
+        methods=IDEMPOTENT_METHODS,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        window=DEFAULT_WINDOW,
+    ):
+        if delay is None and percentile is None:
+            raise ValueError('Either delay or percentile is required')
+
+        self.delay = delay
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.methods = frozenset(methods)
+        self.min_samples = min_samples
+        self.window = window
+
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self.denied = 0
+
+        self._budget = RetryBudget(ratio=max_ratio, min_per_second=0)
+        self._latencies = collections.deque(maxlen=window)
+        # the percentile latency, recomputed every window // 10 samples
+        self._threshold = None
+        self._new_samples = 0
+
+    def hedge_delay(self):
+        """
+        :returns: the delay in seconds before hedging a request, None not to
+            hedge it.
+        """
+
+        if self.percentile is not None and self._threshold is not None:
+            return self._threshold
+        return self.delay
+
+    def _observe(self, latency):
+        self._latencies.append(latency)
+        self._new_samples += 1
+
+        if self.percentile is None or len(self._latencies) < self.min_samples:
+            return
+        if (
+            self._threshold is None or
+            self._new_samples >= max(1, self.window // 10)
+        ):
+            latencies = sorted(self._latencies)
+            index = int(len(latencies) * self.percentile / 100.0)
+            self._threshold = latencies[min(index, len(latencies) - 1)]
+            self._new_samples = 0
+
+    def run(self, reactor, method, send):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Send a request with `send`, and hedge it as allowed by the policy.
+
+        :param method: the HTTP method of the request, as bytes.
+        :param send: a function sending the request, returning a Deferred
+            firing with a fido Response.
+        :returns: a Deferred firing with the first response. Cancelling it
+            cancels the requests in flight.
+        """
+
+        if method not in self.methods:
+            return send()
+
+        self.requests += 1
+        now = reactor.seconds()
+        self._budget.deposit(now)
+
+        # the requests in flight and the delayed call of the hedge
+        in_flight = []
+        timer = []
+
+        def cancel(_):
+            for call in timer:
+                if call.active():
+                    call.cancel()
+            for deferred in list(in_flight):
+                deferred.cancel()
+
+        result = Deferred(cancel)
+
+        def finish(outcome):
+            if isinstance(outcome, Failure):
+                result.errback(outcome)
+            else:
+                result.callback(outcome)
+            # once the result is fired, the losers are ignored
+            cancel(None)
+
+        def launch(hedged):
+            deferred = maybeDeferred(send)
+            in_flight.append(deferred)
+            deferred.addBoth(completed, deferred, hedged)
+
+        def completed(outcome, deferred, hedged):
+            in_flight.remove(deferred)
+
+            if result.called:
+                # the loser, possibly a streamed response
+                close = getattr(getattr(outcome, 'body', None), 'close', None)
+                if close is not None:
+                    close()
+                return None
+
+            if isinstance(outcome, Failure):
+                # wait for the other request if any, but not for the hedge
+                if not in_flight:
+                    finish(outcome)
+                return None
+
+            self._observe(reactor.seconds() - now)
+            if hedged:
+                self.wins += 1
+            finish(outcome)
+
+        def hedge():
+            if not self._budget.withdraw(reactor.seconds()):
+                self.denied += 1
+                return
+            self.hedges += 1
+            launch(True)
+
+        delay = self.hedge_delay()
+        launch(False)
+        if delay is not None and not result.called:
+            timer.append(reactor.callLater(delay, hedge))
+        return result
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+import itertools
+
+from twisted.internet.defer import CancelledError
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import succeed
+
+from fido.exceptions import QueueTimeoutError
+
+
+class CancelledWhileQueued(CancelledError):
+    """The request was cancelled before a slot was available to send it."""
+
+
+class _Waiter(object):
+    """A request queued waiting for a free slot."""
+
+    def __init__(self, key, sequence, enqueued_at):
+        self.key = key
+        self.sequence = sequence
+        self.enqueued_at = enqueued_at
+        self.deferred = None
+        self.timer = None
+        self.queued = True
+
+
+class ConcurrencyLimiter(object):
+    """Bounds the number of in-flight requests, per host and overall.
+
+    Requests over the limits wait in a FIFO queue until a slot is released by
+    a completed request. A limiter can be shared by any number of
+    :func:`fido.fetch` calls and sessions; its state is only ever modified
+    from the reactor thread.
+
+    Hosts are identified by a ``'host:port'`` string.
+
+    :param max_per_host: maximum number of in-flight requests to the same
+        host, None for no limit.
+    :param max_total: maximum number of in-flight requests overall, None for
+        no limit.
+    :param queue_timeout: maximum time in seconds a request can wait for a
+        slot before failing with :class:`fido.exceptions.QueueTimeoutError`,
+        None to wait indefinitely.
+
+    :ivar wait_count: number of requests that had to wait for a slot.
+    :ivar total_wait_time: total time in seconds spent by requests waiting
+        for a slot.
+    :ivar max_wait_time: longest time in seconds a request waited for a slot.
+    """
+
+    def __init__(self, max_per_host=None, max_total=None, queue_timeout=None):
+        self.max_per_host = max_per_host
+        self.max_total = max_total
+        self.queue_timeout = queue_timeout
+
+        self.wait_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self._in_flight = collections.defaultdict(int)
+        self._in_flight_total = 0
+        self._waiters = {}
+        self._queued = collections.defaultdict(int)
+        self._queued_total = 0
+        self._sequence = itertools.count()
+
+    def in_flight(self, key=None):
+        """Number of in-flight requests to `key`, or overall if None."""
+        if key is None:
+            return self._in_flight_total
+        return self._in_flight.get(key, 0)
+
+    def queue_length(self, key=None):
+        """Number of requests waiting for `key`, or overall if None."""
+        if key is None:
+            return self._queued_total
+        return self._queued.get(key, 0)
+
+    def run(self, reactor, key, function):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Call `function` as soon as there is a free slot for `key` and hold
+        the slot until the Deferred it returns fires.
+
+        :return: a twisted.internet.defer.Deferred firing with the result of
+            `function`.
+        """
+
+        def call_and_release(_):
+            deferred = maybeDeferred(function)
+            deferred.addBoth(release)
+            return deferred
+
+        def release(result):
+            self.release(reactor, key)
+            return result
+
+        deferred = self.acquire(reactor, key)
+        deferred.addCallback(call_and_release)
+        return deferred
+
+    def _has_capacity(self, key):
+        return (
+            (self.max_total is None or
+                self._in_flight_total < self.max_total) and
+            (self.max_per_host is None or
+                self._in_flight.get(key, 0) < self.max_per_host)
+        )
+
+    def _take(self, key):
+        self._in_flight[key] += 1
+        self._in_flight_total += 1
+
+    def acquire(self, reactor, key):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Take a slot for `key`, waiting for one to be released if needed.
+        The slot must be given back with :meth:`release`.
+
+        :return: a twisted.internet.defer.Deferred firing once the slot is
+            taken.
+        """
+
+        if self._has_capacity(key):
+            self._take(key)
+            return succeed(None)
+
+        waiter = _Waiter(key, next(self._sequence), reactor.seconds())
+        waiter.deferred = Deferred(lambda d: self._cancel(waiter))
+        if self.queue_timeout is not None:
+            waiter.timer = reactor.callLater(
+                self.queue_timeout, self._expire, waiter,
+            )
+
+        self._waiters.setdefault(key, collections.deque()).append(waiter)
+        self._queued[key] += 1
+        self._queued_total += 1
+        return waiter.deferred
+
+    def _dequeue(self, waiter):
+        """Update the bookkeeping for a waiter leaving the queue."""
+        waiter.queued = False
+        self._queued[waiter.key] -= 1
+        if not self._queued[waiter.key]:
+            del self._queued[waiter.key]
+        self._queued_total -= 1
+        if waiter.timer is not None and waiter.timer.active():
+            waiter.timer.cancel()
+
+    def _cancel(self, waiter):
+        # the waiter is dropped lazily from its deque by _grant
+        self._dequeue(waiter)
+        waiter.deferred.errback(CancelledWhileQueued())
+
+    def _expire(self, waiter):
+        self._dequeue(waiter)
+        waiter.deferred.errback(QueueTimeoutError(
+            "Request waited more than queue_timeout={queue_timeout} seconds "
+            "for a free slot to {key}".format(
+                queue_timeout=self.queue_timeout,
+                key=waiter.key,
+            )
+        ))
+
+    def release(self, reactor, key):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Give back a slot taken with :meth:`acquire`.
+        """
+
+        self._in_flight[key] -= 1
+        if not self._in_flight[key]:
+            del self._in_flight[key]
+        self._in_flight_total -= 1
+        self._grant(reactor)
+
+    def _next_waiter(self):
+        """Return the oldest waiter for which there is a free slot."""
+        best = None
+        for key in list(self._waiters):
+            waiters = self._waiters[key]
+            while waiters and not waiters[0].queued:
+                waiters.popleft()
+            if not waiters:
+                del self._waiters[key]
+            elif self._has_capacity(key) and (
+                    best is None or waiters[0].sequence < best.sequence):
+                best = waiters[0]
+        return best
+
+    def _grant(self, reactor):
+        while self._queued_total:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            self._waiters[waiter.key].popleft()
+            self._dequeue(waiter)
+
+            wait_time = reactor.seconds() - waiter.enqueued_at
+            self.wait_count += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+            self._take(waiter.key)
+            waiter.deferred.callback(None)
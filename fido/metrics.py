@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of the requests made by fido and of its connection pools.
+
+fido reports to the process-wide metrics set with :func:`set_metrics`, a
+no-op :class:`Metrics` by default. Implement :class:`Metrics` to forward
+them to a metrics library (statsd, prometheus...).
+
+Counters:
+
+- ``fido.requests``: the completed requests, tagged by `host`, `method` and
+  `status`, the response code or the name of the exception.
+- ``fido.bytes_sent``: the bytes of the request bodies of known length,
+  tagged by `host`.
+- ``fido.bytes_received``: the bytes of the response bodies as received
+  (before decompression), tagged by `host`.
+- ``fido.timeouts``: the requests timed out, tagged by `host` and `phase`:
+  'response' while waiting for the response, 'queue' while waiting for a
+  limiter slot.
+- ``fido.connect_errors``: the connections that failed, tagged by `host`.
+- ``fido.pool.hits``, ``fido.pool.misses``: the connections reused from a
+  pool, and the new connections opened.
+
+Histograms:
+
+- ``fido.latency``: the seconds from sending a request to receiving its
+  response (its headers for a streamed response), tagged by `host` and
+  `status`.
+
+Gauges:
+
+- ``fido.in_flight``: the number of requests sent and waiting for their
+  response.
+"""
+from __future__ import absolute_import
+import collections
+
+
+REQUESTS = 'fido.requests'
+BYTES_SENT = 'fido.bytes_sent'
+BYTES_RECEIVED = 'fido.bytes_received'
+TIMEOUTS = 'fido.timeouts'
+CONNECT_ERRORS = 'fido.connect_errors'
+POOL_HITS = 'fido.pool.hits'
+POOL_MISSES = 'fido.pool.misses'
+LATENCY = 'fido.latency'
+IN_FLIGHT = 'fido.in_flight'
+
+
+class Metrics(object):
+    """The metrics interface, which discards the metrics.
+
+    Its methods are only ever called from the reactor thread and must not
+    block it. `tags` is a dictionary of strings, or None.
+    """
+
+    def increment(self, name, value=1, tags=None):
+        """Add `value` to the counter `name`."""
+
+    def observe(self, name, value, tags=None):
+        """Add `value` to the histogram `name`."""
+
+    def gauge(self, name, value, tags=None):
+        """Set the gauge `name` to `value`."""
+
+
+def _tags_key(tags):
+    return tuple(sorted((tags or {}).items()))
+
+
+def _matching(values, name, tags):
+    """Yield the values of `name` recorded with at least `tags`."""
+    wanted = set(_tags_key(tags))
+    for (value_name, value_tags), value in values.items():
+        if value_name == name and wanted.issubset(value_tags):
+            yield value
+
+
+class InMemoryMetrics(Metrics):
+    """Keeps the metrics in memory, for tests.
+
+    :ivar counters: the counters, by (name, sorted tags tuple).
+    :ivar histograms: the lists of observed values, by (name, sorted tags
+        tuple).
+    :ivar gauges: the last value of the gauges, by (name, sorted tags
+        tuple).
+    """
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = collections.defaultdict(list)
+        self.gauges = {}
+
+    def increment(self, name, value=1, tags=None):
+        self.counters[name, _tags_key(tags)] += value
+
+    def observe(self, name, value, tags=None):
+        self.histograms[name, _tags_key(tags)].append(value)
+
+    def gauge(self, name, value, tags=None):
+        self.gauges[name, _tags_key(tags)] = value
+
+    def counter_value(self, name, tags=None):
+        """
+        :returns: the sum of the counters `name` recorded with at least
+            `tags`.
+        """
+        return sum(_matching(self.counters, name, tags))
+
+    def histogram_values(self, name, tags=None):
+        """
+        :returns: the values of the histograms `name` recorded with at least
+            `tags`.
+        """
+        return [
+            value
+            for values in _matching(self.histograms, name, tags)
+            for value in values
+        ]
+
+    def gauge_value(self, name, tags=None):
+        """:returns: the value of the gauge `name`, None if never set."""
+        return self.gauges.get((name, _tags_key(tags)))
+
+
+_NO_METRICS = Metrics()
+
+# The process-wide metrics, see set_metrics.
+_metrics = _NO_METRICS
+
+# The number of requests in flight, only accessed from the reactor thread.
+_in_flight = 0
+
+
+def set_metrics(metrics):
+    """
+    Set the process-wide metrics fido reports to.
+
+    :param metrics: a :class:`Metrics`, None to discard the metrics.
+    """
+
+    global _metrics
+    _metrics = _NO_METRICS if metrics is None else metrics
+
+
+def get_metrics():
+    """
+    :returns: the process-wide metrics, None if they are discarded so that
+        callers can skip computing them.
+    """
+
+    if _metrics is _NO_METRICS:
+        return None
+    return _metrics
+
+
+def request_sent(metrics, host, body_length):
+    """
+    NOTE: Make sure to call this only from the reactor thread.
+
+    Report a request handed to the Twisted Agent.
+
+    :param body_length: the length of the request body, None if unknown.
+    """
+
+    global _in_flight
+    _in_flight += 1
+    metrics.gauge(IN_FLIGHT, _in_flight)
+    if body_length:
+        metrics.increment(BYTES_SENT, body_length, {'host': host})
+
+
+def request_completed(metrics, host, method, status, latency):
+    """
+    NOTE: Make sure to call this only from the reactor thread.
+
+    Report the response, or the error, of a request reported as sent.
+
+    :param status: the response code, or the name of the exception.
+    :param latency: the seconds since the request was sent.
+    """
+
+    global _in_flight
+    _in_flight -= 1
+    metrics.gauge(IN_FLIGHT, _in_flight)
+
+    status = str(status)
+    metrics.increment(REQUESTS, tags={
+        'host': host,
+        'method': method,
+        'status': status,
+    })
+    metrics.observe(LATENCY, latency, {'host': host, 'status': status})
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Prepared requests: the url, method and headers of a request are converted
+to the bytes and Twisted Headers expected by the Twisted Agent once, so that
+hot endpoints fired many times with the same headers skip that work on every
+call.
+"""
+from __future__ import absolute_import
+
+import crochet
+
+from .body import is_reusable
+from .common import merge_headers
+from .fido import DEFAULT_COMPRESS_LEVEL
+from .fido import DEFAULT_COMPRESS_MIN_SIZE
+from .fido import _compress_body
+from .fido import _fetch_inner
+from .fido import _prepare_fetch_args
+from .timings import Timings
+
+
+# Marks the fetch() arguments that fall back to the prepared values, as None
+# is a meaningful value for timeouts.
+_PREPARED_DEFAULT = object()
+
+
+class PreparedRequest(object):
+    """An immutable request template, fired with :meth:`fetch`.
+
+    Use :func:`fido.prepare` to create one. Prepared requests are thread
+    safe and can be fired any number of times, concurrently.
+
+    :ivar url: the URL, as bytes.
+    :ivar method: the HTTP method, as bytes.
+    """
+
+    __slots__ = (
+        '_url', '_method', '_headers', '_body', '_body_headers', '_options',
+        '_compress_body', '_compress_level', '_compress_min_size',
+    )
+
+    def __init__(self, url, method, headers, body, body_headers, options,
+                 compress_body, compress_level, compress_min_size):
+        self._url = url
+        self._method = method
+        self._headers = headers
+        self._body = body
+        self._body_headers = body_headers
+        self._options = options
+        self._compress_body = compress_body
+        self._compress_level = compress_level
+        self._compress_min_size = compress_min_size
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def method(self):
+        return self._method
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(
+            type(self).__name__, self._method, self._url)
+
+    def _fetch_args(
+        self,
+        headers=None,
+        body=_PREPARED_DEFAULT,
+        timeout=_PREPARED_DEFAULT,
+        decompress_gzip=_PREPARED_DEFAULT,
+        stream=_PREPARED_DEFAULT,
+        max_body_size=_PREPARED_DEFAULT,
+        max_decompressed_size=_PREPARED_DEFAULT,
+        parse_json=_PREPARED_DEFAULT,
+        timings=_PREPARED_DEFAULT,
+    ):
+        """
+        Return the arguments of `fido.fido._fetch_in_reactor` for one
+        request, applying the per-call overrides.
+        """
+
+        if timings is _PREPARED_DEFAULT:
+            # the timings of prepare() only enable them
+            timings = self._options.timings is not None
+        # the request starts in the calling thread
+        timings = Timings() if timings else None
+
+        if body is _PREPARED_DEFAULT:
+            body = self._body
+            if self._body_headers:
+                body_headers = dict(self._body_headers)
+                body_headers.update(headers or {})
+                headers = body_headers
+        elif self._compress_body:
+            body, headers = _compress_body(
+                body, dict(headers or {}),
+                self._compress_level, self._compress_min_size,
+            )
+
+        overrides = dict(
+            (name, value) for name, value in (
+                ('timeout', timeout),
+                ('decompress_gzip', decompress_gzip),
+                ('stream', stream),
+                ('max_body_size', max_body_size),
+                ('max_decompressed_size', max_decompressed_size),
+                ('parse_json', parse_json),
+            )
+            if value is not _PREPARED_DEFAULT
+        )
+
+        return (
+            self._url,
+            self._method,
+            # shared by the requests, which copy it before sending
+            merge_headers(self._headers, headers),
+            body,
+            self._options._replace(timings=timings, **overrides),
+        )
+
+    def fetch(
+        self,
+        headers=None,
+        body=_PREPARED_DEFAULT,
+        timeout=_PREPARED_DEFAULT,
+        decompress_gzip=_PREPARED_DEFAULT,
+        stream=_PREPARED_DEFAULT,
+        max_body_size=_PREPARED_DEFAULT,
+        max_decompressed_size=_PREPARED_DEFAULT,
+        parse_json=_PREPARED_DEFAULT,
+        timings=_PREPARED_DEFAULT,
+    ):
+        """
+        Make the prepared HTTP request. The arguments override the prepared
+        values for this request only, see :func:`fido.fetch`.
+
+        :param headers: a dictionary mapping from string keys to lists of
+            string values, merged on top of the prepared headers.
+        :param body: the request body, replacing the prepared body. It is
+            gzipped if the request was prepared with `compress_body`.
+
+        :returns: a crochet EventualResult object, as returned by
+            :func:`fido.fetch`.
+        """
+
+        args = self._fetch_args(
+            headers,
+            body,
+            timeout,
+            decompress_gzip,
+            stream,
+            max_body_size,
+            max_decompressed_size,
+            parse_json,
+            timings,
+        )
+
+        # initializes twisted reactor in a different thread
+        crochet.setup()
+        return _fetch_inner(*args)
+
+
+def prepare(
+    url,
+    method='GET',
+    headers=None,
+    body='',
+    compress_body=False,
+    compress_level=DEFAULT_COMPRESS_LEVEL,
+    compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+    **kwargs
+):
+    """
+    Prepare an HTTP request to fire many times. The url, method and headers
+    are converted once, instead of on every :func:`fido.fetch` call, and the
+    body is compressed once if `compress_body` is set.
+
+    :param url: the URL to fetch.
+    :param method: the HTTP method.
+    :param headers: a dictionary mapping from string keys to lists of string
+        values.
+    :param body: the request body. It is sent by every request, so it must be
+        bytes, text, a bytearray, a memoryview or a path to a file: files and
+        iterables can only be read once and must be passed to
+        :meth:`PreparedRequest.fetch` instead.
+    :param kwargs: the other :func:`fido.fetch` arguments.
+
+    :returns: a :class:`fido.prepared.PreparedRequest`.
+    """
+
+    if not is_reusable(body):
+        raise ValueError(
+            'A prepared body must be reusable, pass files and iterables to '
+            'PreparedRequest.fetch instead'
+        )
+
+    url, method, headers, body, options = _prepare_fetch_args(
+        url, method, headers, body, **kwargs)
+
+    # the headers set by the compression only apply to the prepared body
+    compress_body = (
+        compress_body and not headers.hasHeader(b'content-encoding')
+    )
+    body_headers = None
+    if compress_body:
+        body, body_headers = _compress_body(
+            body, {}, compress_level, compress_min_size)
+
+    return PreparedRequest(
+        url=url,
+        method=method,
+        headers=headers,
+        body=body,
+        body_headers=body_headers,
+        options=options,
+        compress_body=compress_body,
+        compress_level=compress_level,
+        compress_min_size=compress_min_size,
+    )
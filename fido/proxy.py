@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""
+https_proxy support: https requests are tunneled through the proxy with the
+CONNECT method and TLS is negotiated with the target inside the tunnel.
+
+A tunnel is an ordinary connection for the Agent, so it is kept alive in the
+connection pool and reused by the next requests to the same target.
+"""
+from __future__ import absolute_import
+import base64
+import binascii
+import os
+import socket
+import warnings
+
+import six
+from six.moves.urllib_parse import unquote
+from six.moves.urllib_parse import urlparse
+from twisted.internet.defer import Deferred
+from twisted.internet.endpoints import HostnameEndpoint
+from twisted.internet.endpoints import wrapClientTLS
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.protocol import Factory
+from twisted.internet.protocol import Protocol
+from twisted.web.error import SchemeNotSupported
+from twisted.web.iweb import IAgent
+from twisted.web.iweb import IAgentEndpointFactory
+from yelp_bytes import to_bytes
+from zope.interface import implementer
+
+from fido.dns import ResolvingEndpoint
+from fido.exceptions import ProxyTunnelError
+
+
+# Maximum size of the proxy response to a CONNECT request.
+MAX_TUNNEL_RESPONSE_SIZE = 64 * 1024
+
+# Process-wide proxy configuration, parsed from the environment on first use.
+_proxy_config = None
+
+
+def _parse_ip(host):
+    """
+    :returns: a (number of bits, integer value) tuple for an IPv4 or IPv6
+        address, None if `host` is not an IP address.
+    """
+
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, host)
+        except (socket.error, ValueError):
+            continue
+        return bits, int(binascii.hexlify(packed), 16)
+    return None
+
+
+def _normalize_host(host):
+    host = host.strip().lower()
+    if host.startswith('['):
+        # [IPv6] with an optional port
+        return host[1:].split(']', 1)[0]
+    if host.count(':') == 1:
+        # drop the port
+        host = host.split(':', 1)[0]
+    return host.rstrip('.')
+
+
+class NoProxyMatcher(object):
+    """Matches hostnames against a no_proxy value, precompiled so that a
+    lookup costs one set lookup per label of the hostname (or per prefix
+    length of the networks for IP addresses).
+
+    The no_proxy value is a comma separated list of:
+
+    - ``*``, matching every host;
+    - domains such as ``example.com`` (or ``.example.com``), matching the
+      domain and all its subdomains;
+    - IP addresses and CIDR networks such as ``10.0.0.0/8`` or ``fd00::/8``.
+
+    Networks with an invalid prefix length are ignored with a warning rather
+    than failing every request.
+    """
+
+    def __init__(self, no_proxy):
+        self.match_all = False
+        self._domains = set()
+        # (number of bits, prefix length) -> set of network prefixes
+        self._networks = {}
+
+        for pattern in (no_proxy or '').split(','):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            if pattern == '*':
+                self.match_all = True
+                continue
+
+            address, _, prefix_length = pattern.partition('/')
+            ip = _parse_ip(_normalize_host(address))
+            if ip is None:
+                self._domains.add(_normalize_host(pattern).lstrip('*.'))
+                continue
+
+            bits, value = ip
+            try:
+                prefix_length = int(prefix_length) if prefix_length else bits
+            except ValueError:
+                prefix_length = None
+            if prefix_length is None or not 0 <= prefix_length <= bits:
+                warnings.warn(
+                    'Ignoring the invalid no_proxy network {0!r}'.format(
+                        pattern),
+                    RuntimeWarning,
+                )
+                continue
+            self._networks.setdefault((bits, prefix_length), set()).add(
+                value >> (bits - prefix_length))
+
+    def __bool__(self):
+        return self.match_all or bool(self._domains or self._networks)
+
+    __nonzero__ = __bool__
+
+    def matches(self, host):
+        """Whether requests to `host` must not go through the proxy."""
+
+        if self.match_all:
+            return True
+
+        host = _normalize_host(host)
+        ip = _parse_ip(host)
+        if ip is not None:
+            bits, value = ip
+            return any(
+                value >> (bits - prefix_length) in prefixes
+                for (network_bits, prefix_length), prefixes
+                in six.iteritems(self._networks)
+                if network_bits == bits
+            )
+
+        while True:
+            if host in self._domains:
+                return True
+            dot = host.find('.')
+            if dot < 0:
+                return False
+            host = host[dot + 1:]
+
+
+class ProxyConfig(object):
+    """The proxies to send requests through.
+
+    :param http_proxy: URL of the proxy for http requests.
+    :param https_proxy: URL of the proxy to tunnel https requests through.
+    :param no_proxy: comma separated hosts, domains and networks to connect
+        to directly, see :class:`NoProxyMatcher`.
+    """
+
+    def __init__(self, http_proxy=None, https_proxy=None, no_proxy=None):
+        self.http_proxy = http_proxy or None
+        self.https_proxy = https_proxy or None
+        self.no_proxy = no_proxy or None
+        self.matcher = NoProxyMatcher(no_proxy)
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        """
+        Read the http_proxy, https_proxy and no_proxy (or NO_PROXY)
+        environment variables.
+        """
+
+        if environ is None:
+            environ = os.environ
+        return cls(
+            http_proxy=environ.get('http_proxy'),
+            https_proxy=environ.get('https_proxy'),
+            no_proxy=environ.get('no_proxy', environ.get('NO_PROXY')),
+        )
+
+    @property
+    def proxied(self):
+        """Whether any request may go through a proxy."""
+        return bool(self.http_proxy or self.https_proxy) and \
+            not self.matcher.match_all
+
+    def bypass(self, host):
+        """Whether requests to `host` must be sent directly."""
+        return self.matcher.matches(host)
+
+
+def get_proxy_config():
+    """
+    :returns: the process-wide :class:`ProxyConfig`, read from the
+        environment the first time it is needed.
+    """
+
+    global _proxy_config
+    config = _proxy_config
+    if config is None:
+        config = _proxy_config = ProxyConfig.from_environ()
+    return config
+
+
+def set_proxy_config(config):
+    """
+    Override the process-wide proxy configuration used by :func:`fido.fetch`
+    and by the sessions created afterwards.
+
+    :param config: a :class:`ProxyConfig`, or None to read the environment
+        again the next time the configuration is needed.
+    """
+
+    global _proxy_config
+    _proxy_config = config
+
+
+def refresh_proxy_config():
+    """Read the proxy configuration from the environment again."""
+    set_proxy_config(ProxyConfig.from_environ())
+
+
+def proxy_authorization(proxy_url):
+    """
+    :returns: the Proxy-Authorization header value for the credentials in
+        `proxy_url`, or None if there are none.
+    """
+
+    parse_result = urlparse(proxy_url)
+    if parse_result.username is None:
+        return None
+
+    credentials = '{username}:{password}'.format(
+        username=unquote(parse_result.username),
+        password=unquote(parse_result.password or ''),
+    )
+    return b'Basic ' + base64.b64encode(to_bytes(credentials))
+
+
+class _TunnelProtocol(Protocol):
+    """
+    Asks the proxy for a tunnel to the target, then hands the connection
+    over to the protocol built by the wrapped factory and passes the data
+    through.
+    """
+
+    def __init__(self):
+        self.wrappedProtocol = None
+        self._buffer = b''
+
+    def connectionMade(self):
+        target = self.factory.target
+        lines = [
+            b'CONNECT ' + target + b' HTTP/1.1',
+            b'Host: ' + target,
+        ]
+        if self.factory.authorization is not None:
+            lines.append(b'Proxy-Authorization: ' + self.factory.authorization)
+        self.transport.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+
+    def dataReceived(self, data):
+        if self.wrappedProtocol is not None:
+            self.wrappedProtocol.dataReceived(data)
+            return
+
+        self._buffer += data
+        if b'\r\n\r\n' not in self._buffer:
+            if len(self._buffer) > MAX_TUNNEL_RESPONSE_SIZE:
+                self._fail("Proxy response to CONNECT is too large")
+            return
+
+        head, rest = self._buffer.split(b'\r\n\r\n', 1)
+        self._buffer = b''
+        status_line = head.split(b'\r\n', 1)[0]
+        parts = status_line.split(None, 2)
+        # any 2xx response establishes the tunnel, see RFC 7231 section 4.3.6
+        if (
+            len(parts) < 2 or
+            len(parts[1]) != 3 or
+            not parts[1].isdigit() or
+            not parts[1].startswith(b'2')
+        ):
+            self._fail(
+                "Proxy refused to open a tunnel to {target}: {status}".format(
+                    target=self.factory.target.decode('ascii'),
+                    status=status_line.decode('latin-1'),
+                )
+            )
+            return
+
+        self.wrappedProtocol = self.factory.wrappedFactory.buildProtocol(
+            self.transport.getPeer())
+        self.wrappedProtocol.makeConnection(self.transport)
+        self.factory.established(self.wrappedProtocol)
+        if rest:
+            self.wrappedProtocol.dataReceived(rest)
+
+    def _fail(self, message):
+        self.factory.failed(ProxyTunnelError(message))
+        self.transport.abortConnection()
+
+    def connectionLost(self, reason):
+        if self.wrappedProtocol is not None:
+            self.wrappedProtocol.connectionLost(reason)
+        else:
+            self.factory.failed(ProxyTunnelError(
+                "Proxy closed the connection before opening a tunnel to "
+                "{target}".format(target=self.factory.target.decode('ascii'))
+            ))
+
+
+class _TunnelFactory(Factory):
+    protocol = _TunnelProtocol
+
+    def __init__(self, wrappedFactory, target, authorization, deferred):
+        self.wrappedFactory = wrappedFactory
+        self.target = target
+        self.authorization = authorization
+        self._deferred = deferred
+
+    def established(self, protocol):
+        deferred, self._deferred = self._deferred, None
+        # the deferred was cancelled meanwhile
+        if deferred is not None and not deferred.called:
+            deferred.callback(protocol)
+
+    def failed(self, error):
+        deferred, self._deferred = self._deferred, None
+        if deferred is not None and not deferred.called:
+            deferred.errback(error)
+
+
+@implementer(IStreamClientEndpoint)
+class TunnelingEndpoint(object):
+    """An endpoint connecting to host:port through a CONNECT tunnel.
+
+    :param proxy_endpoint: the endpoint of the proxy.
+    :param authorization: the Proxy-Authorization header value, if any.
+    :param reactor: the reactor to schedule the timeout with, required if
+        `timeout` is given.
+    :param timeout: maximum time in seconds to connect to the proxy and have
+        it open the tunnel, None for no limit.
+    """
+
+    def __init__(self, proxy_endpoint, host, port, authorization=None,
+                 reactor=None, timeout=None):
+        self._proxy_endpoint = proxy_endpoint
+        self._target = to_bytes('{host}:{port}'.format(host=host, port=port))
+        self._authorization = authorization
+        self._reactor = reactor
+        self._timeout = timeout
+
+    def connect(self, protocolFactory):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+        """
+
+        def abort():
+            if not connection.called:
+                connection.cancel()
+            for protocol in tunnel:
+                protocol.transport.abortConnection()
+
+        def cancel(deferred):
+            abort()
+
+        deferred = Deferred(cancel)
+        factory = _TunnelFactory(
+            protocolFactory, self._target, self._authorization, deferred,
+        )
+
+        if self._timeout is not None:
+            def timed_out():
+                factory.failed(ProxyTunnelError(
+                    "Proxy did not open a tunnel to {target} within "
+                    "connect_timeout={timeout} seconds".format(
+                        target=self._target.decode('ascii'),
+                        timeout=self._timeout,
+                    )
+                ))
+                abort()
+
+            timer = self._reactor.callLater(self._timeout, timed_out)
+
+            def stop_timer(result):
+                if timer.active():
+                    timer.cancel()
+                return result
+
+            deferred.addBoth(stop_timer)
+
+        # the protocol of the connection to the proxy, once connected
+        tunnel = []
+        connection = self._proxy_endpoint.connect(factory)
+        connection.addCallbacks(tunnel.append, factory.failed)
+        return deferred
+
+
+@implementer(IAgentEndpointFactory)
+class ProxyEndpointFactory(object):
+    """
+    NOTE: Make sure to only use this from the reactor thread as it is
+    accessing twisted API.
+
+    Agent endpoint factory tunneling https requests through a proxy, http
+    requests being sent directly.
+
+    :param proxy_endpoint: the endpoint of the https proxy.
+    :param authorization: the Proxy-Authorization header value, if any.
+    :param connect_timeout: maximum time in seconds to open a connection,
+        through the tunnel for https requests.
+    :param resolver: an optional :class:`fido.dns.CachingResolver` resolving
+        the hostnames of the direct http connections.
+    """
+
+    def __init__(self, reactor, proxy_endpoint, authorization=None,
+                 connect_timeout=None, resolver=None):
+        from twisted.web.client import BrowserLikePolicyForHTTPS
+        self._reactor = reactor
+        self._proxy_endpoint = proxy_endpoint
+        self._authorization = authorization
+        self._connect_timeout = connect_timeout
+        self._resolver = resolver
+        self._policy = BrowserLikePolicyForHTTPS()
+
+    def endpointForURI(self, uri):
+        host = uri.host.decode('ascii')
+
+        if uri.scheme == b'https':
+            tunnel = TunnelingEndpoint(
+                self._proxy_endpoint, host, uri.port, self._authorization,
+                self._reactor, self._connect_timeout,
+            )
+            creator = self._policy.creatorForNetloc(uri.host, uri.port)
+            return wrapClientTLS(creator, tunnel)
+
+        if uri.scheme != b'http':
+            raise SchemeNotSupported(
+                "Unsupported scheme: {scheme!r}".format(scheme=uri.scheme))
+
+        if self._resolver is not None:
+            return ResolvingEndpoint(
+                self._reactor, self._resolver, host, uri.port,
+                self._connect_timeout,
+            )
+
+        kwargs = {}
+        if self._connect_timeout is not None:
+            kwargs['timeout'] = self._connect_timeout
+        return HostnameEndpoint(self._reactor, host, uri.port, **kwargs)
+
+
+@implementer(IAgent)
+class SchemeDispatchAgent(object):
+    """Sends the http requests through `http_agent` and the https requests
+    through `https_agent`."""
+
+    def __init__(self, http_agent, https_agent):
+        self._http_agent = http_agent
+        self._https_agent = https_agent
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        if uri.lower().startswith(b'https:'):
+            agent = self._https_agent
+        else:
+            agent = self._http_agent
+        return agent.request(method, uri, headers, bodyProducer)
+
+
+@implementer(IAgent)
+class ProxyRoutingAgent(object):
+    """Sends the requests to the hosts matching the no_proxy configuration
+    through `direct_agent` and the other ones through `proxied_agent`."""
+
+    def __init__(self, config, direct_agent, proxied_agent):
+        self._config = config
+        self._direct_agent = direct_agent
+        self._proxied_agent = proxied_agent
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        host = urlparse(uri).hostname or b''
+        if self._config.bypass(host.decode('ascii')):
+            agent = self._direct_agent
+        else:
+            agent = self._proxied_agent
+        return agent.request(method, uri, headers, bodyProducer)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+import random
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.python.failure import Failure
+
+from fido.exceptions import HTTPTimeoutError
+from fido.exceptions import TCPConnectionError
+
+
+# Methods that can be sent twice without changing the result (RFC 7231).
+IDEMPOTENT_METHODS = frozenset((
+    b'GET', b'HEAD', b'OPTIONS', b'TRACE', b'PUT', b'DELETE',
+))
+RETRYABLE_STATUS_CODES = frozenset((502, 503, 504))
+RETRYABLE_EXCEPTIONS = (TCPConnectionError, HTTPTimeoutError)
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.1
+DEFAULT_BACKOFF_MAX = 10.0
+
+
+class RetryBudget(object):
+    """Bounds the retries to a ratio of the requests, to avoid retry storms
+    when a service is down: once the budget is spent, failures are surfaced
+    right away instead of multiplying the load.
+
+    Requests and retries are counted over a sliding window of `ttl` seconds,
+    in one second buckets.
+
+    :param ratio: retries allowed per request, e.g. 0.2 allows 1 retry for 5
+        requests.
+    :param min_per_second: retries always allowed per second, so that
+        services with little traffic can still retry.
+    :param ttl: seconds a request or retry is accounted for.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=10, ttl=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.ttl = ttl
+        # [second, requests, retries], oldest first
+        self._buckets = collections.deque()
+
+    def _bucket(self, now):
+        second = int(now)
+        while self._buckets and self._buckets[0][0] <= second - self.ttl:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        return self._buckets[-1]
+
+    def deposit(self, now):
+        """Account for a request sent at `now`."""
+        self._bucket(now)[1] += 1
+
+    def withdraw(self, now):
+        """
+        Account for a retry at `now` if the budget allows it.
+
+        :returns: whether the retry is allowed.
+        """
+
+        bucket = self._bucket(now)
+        requests = sum(b[1] for b in self._buckets)
+        retries = sum(b[2] for b in self._buckets)
+        if retries >= self.min_per_second * self.ttl + self.ratio * requests:
+            return False
+        bucket[2] += 1
+        return True
+
+
+class RetryPolicy(object):
+    """Retries the failed requests from the reactor thread, without sending
+    them back to the calling thread.
+
+    A request is retried when it fails with one of `exceptions` or gets a
+    response with one of `status_codes`, after a backoff delay growing
+    exponentially with the number of attempts. Each attempt gets the full
+    `timeout` of the request.
+
+    Only the requests with one of `methods` are retried, and only if their
+    body can be sent again (bytes, a bytearray or memoryview, or a path to a
+    file; not a file object or an iterable).
+
+    A policy is meant to be shared by the requests to a service, which share
+    its retry budget. Its state is only ever modified from the reactor
+    thread.
+
+    :param max_retries: maximum number of retries of a request.
+    :param methods: the HTTP methods, as bytes, of the requests to retry.
+        Defaults to the idempotent methods.
+    :param status_codes: the response codes to retry.
+    :param exceptions: the exception classes to retry.
+    :param backoff_base: delay in seconds before the first retry, doubled
+        for each following retry.
+    :param backoff_max: maximum delay in seconds before a retry.
+    :param jitter: flag to wait a random delay between 0 and the backoff
+        ("full jitter"), so that clients failing together don't retry
+        together.
+    :param budget: a :class:`RetryBudget`, None for no budget.
+    :param retry_after: flag to wait for the delay in seconds of the
+        Retry-After header of the responses that have one, up to
+        `backoff_max`.
+
+    :ivar retries: number of retries sent.
+    :ivar exhausted: number of retries denied by the budget.
+    """
+
+    def __init__(
+        self,
+        max_retries=DEFAULT_MAX_RETRIES,
+        methods=IDEMPOTENT_METHODS,
+        status_codes=RETRYABLE_STATUS_CODES,
+        exceptions=RETRYABLE_EXCEPTIONS,
+        backoff_base=DEFAULT_BACKOFF_BASE,
+        backoff_max=DEFAULT_BACKOFF_MAX,
+        jitter=True,
+        budget=None,
+        retry_after=True,
+    ):
+        self.max_retries = max_retries
+        self.methods = frozenset(methods)
+        self.status_codes = frozenset(status_codes)
+        self.exceptions = tuple(exceptions)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.budget = budget
+        self.retry_after = retry_after
+
+        self.retries = 0
+        self.exhausted = 0
+
+    def backoff(self, retry, response=None):
+        """
+        :param retry: the number of the retry, starting at 0.
+        :param response: the response being retried, if any.
+        :returns: the delay in seconds before the retry.
+        """
+
+        if self.retry_after and response is not None:
+            delay = _retry_after(response)
+            if delay is not None:
+                return min(delay, self.backoff_max)
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** retry)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def _allow(self, reactor, retry):
+        if retry >= self.max_retries:
+            return False
+        if self.budget is not None and not self.budget.withdraw(
+                reactor.seconds()):
+            self.exhausted += 1
+            return False
+        self.retries += 1
+        return True
+
+    def run(self, reactor, method, send):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+
+        Send a request with `send` and send it again as allowed by the
+        policy.
+
+        :param method: the HTTP method of the request, as bytes.
+        :param send: a function sending the request, returning a Deferred
+            firing with a fido Response.
+        :returns: a Deferred firing with the last response or failing with
+            the last error. Cancelling it cancels the attempt in progress or
+            the pending retry.
+        """
+
+        if method not in self.methods:
+            return send()
+
+        if self.budget is not None:
+            self.budget.deposit(reactor.seconds())
+
+        # the attempt in progress or the delayed call of the next one
+        pending = [None]
+        cancelled = []
+
+        def cancel(_):
+            cancelled.append(True)
+            if isinstance(pending[0], Deferred):
+                pending[0].cancel()
+            elif pending[0] is not None and pending[0].active():
+                pending[0].cancel()
+
+        result = Deferred(cancel)
+
+        def attempt(retry):
+            pending[0] = deferred = maybeDeferred(send)
+            deferred.addBoth(completed, retry)
+
+        def completed(response, retry):
+            if result.called:
+                return
+            if cancelled:
+                # the attempt was cancelled along with the result
+                if isinstance(response, Failure):
+                    result.errback(response)
+                else:
+                    result.callback(response)
+                return
+
+            if isinstance(response, Failure):
+                if (
+                    response.check(*self.exceptions) and
+                    self._allow(reactor, retry)
+                ):
+                    schedule(retry, None)
+                else:
+                    result.errback(response)
+                return
+
+            if response.code in self.status_codes and self._allow(
+                    reactor, retry):
+                close = getattr(response.body, 'close', None)
+                if close is not None:
+                    # a streamed response
+                    close()
+                schedule(retry, response)
+            else:
+                result.callback(response)
+
+        def schedule(retry, response):
+            pending[0] = reactor.callLater(
+                self.backoff(retry, response), attempt, retry + 1)
+
+        attempt(0)
+        return result
+
+
+def _retry_after(response):
+    """The Retry-After delay in seconds of `response`, None if unknown."""
+    # only the delay-seconds form is supported, not HTTP dates
+    values = response.headers.get(b'Retry-After')
+    if not values:
+        return None
+    try:
+        return max(0, int(values[0]))
+    except ValueError:
+        return None
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import crochet
+from yelp_bytes import to_bytes
+
+from .common import listify_headers
+from .common import merge_headers
+from .fido import DEFAULT_COMPRESS_LEVEL
+from .fido import DEFAULT_COMPRESS_MIN_SIZE
+from .fido import DEFAULT_CONNECT_TIMEOUT
+from .fido import DEFAULT_TIMEOUT
+from .fido import _build_pool
+from .fido import _build_routing_agent
+from .fido import _compress_body
+from .fido import _fetch_in_reactor
+from .fido import _FetchOptions
+from .fido import _import_reactor
+from .fido import _with_default_user_agent
+from .proxy import ProxyConfig
+from .proxy import get_proxy_config
+from .timings import Timings
+
+
+# Marks the fetch() arguments that fall back to the session defaults, as None
+# is a meaningful value for timeouts.
+_SESSION_DEFAULT = object()
+
+
+class Session(object):
+    """A long-lived HTTP client.
+
+    A session owns its own agent and connection pool and holds default
+    options, so the per-request setup done by :func:`fido.fetch` (proxy
+    lookup, agent creation, default headers conversion) is only paid once.
+
+    Sessions are meant to be created once and shared: connections are kept
+    alive across requests until :meth:`close` is called.
+
+    :param headers: default headers sent with every request, in the same
+        format accepted by :func:`fido.fetch`. Headers passed to
+        :meth:`fetch` override the defaults with the same name.
+    :param timeout: default maximum allowed request time in seconds.
+    :param connect_timeout: maximum time allowed to establish a connection
+        in seconds.
+    :param tcp_nodelay: flag to enable tcp_nodelay on the connections.
+    :param decompress_gzip: default flag to enable decompressing gzipped
+        responses.
+    :param http_proxy: URL of the http proxy to use. Defaults to the
+        process-wide proxy configuration (see
+        :func:`fido.proxy.set_proxy_config`) as set when the session is
+        created, an empty string disables the proxy.
+    :param https_proxy: URL of the proxy to tunnel https requests through,
+        with the same default as `http_proxy`.
+    :param no_proxy: comma separated hosts, domains and networks to connect
+        to directly (see :class:`fido.proxy.NoProxyMatcher`), with the same
+        default as `http_proxy`.
+    :param persistent: flag to keep connections alive across requests.
+    :param max_persistent_per_host: maximum number of idle connections kept
+        per host, defaults to the Twisted default.
+    :param cached_connection_timeout: seconds an idle connection stays open,
+        defaults to the Twisted default.
+    :param limiter: a :class:`fido.limits.ConcurrencyLimiter` bounding the
+        number of in-flight requests of the session.
+    :param max_body_size: default maximum size in bytes of the response
+        bodies as received, see :func:`fido.fetch`.
+    :param max_decompressed_size: default maximum size in bytes of the
+        response bodies once decompressed, see :func:`fido.fetch`.
+    :param compress_body: default flag to gzip the request bodies, see
+        :func:`fido.fetch`.
+    :param compress_level: the zlib compression level of the request bodies.
+    :param compress_min_size: request bodies smaller than this number of
+        bytes are sent uncompressed.
+    :param resolver: a :class:`fido.dns.CachingResolver` caching the hostname
+        resolutions of the session.
+    :param json_decoder: the function parsing Response.json(), see
+        :func:`fido.fetch`.
+    :param parse_json: default flag to parse the JSON bodies in the reactor
+        threadpool, see :func:`fido.fetch`.
+    :param retry: default :class:`fido.retry.RetryPolicy` of the requests,
+        see :func:`fido.fetch`.
+    :param hedge: default :class:`fido.hedge.HedgePolicy` of the requests,
+        see :func:`fido.fetch`.
+    :param breaker: a :class:`fido.breaker.CircuitBreaker` failing the
+        requests to unhealthy hosts right away, see :func:`fido.fetch`.
+    :param timings: default flag to record the timings of the requests, see
+        :func:`fido.fetch`.
+    :param cache: a :class:`fido.cache.ResponseCache` storing the responses
+        of the session, see :func:`fido.fetch`.
+    :param coalescer: a :class:`fido.coalesce.RequestCoalescer` sharing the
+        responses of identical requests in flight, see :func:`fido.fetch`.
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        timeout=DEFAULT_TIMEOUT,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        tcp_nodelay=False,
+        decompress_gzip=False,
+        http_proxy=None,
+        https_proxy=None,
+        no_proxy=None,
+        persistent=True,
+        max_persistent_per_host=None,
+        cached_connection_timeout=None,
+        limiter=None,
+        max_body_size=None,
+        max_decompressed_size=None,
+        compress_body=False,
+        compress_level=DEFAULT_COMPRESS_LEVEL,
+        compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+        resolver=None,
+        json_decoder=None,
+        parse_json=False,
+        retry=None,
+        hedge=None,
+        breaker=None,
+        timings=False,
+        cache=None,
+        coalescer=None,
+    ):
+        proxy_config = get_proxy_config()
+        if http_proxy is None:
+            http_proxy = proxy_config.http_proxy
+        if https_proxy is None:
+            https_proxy = proxy_config.https_proxy
+        if no_proxy is None:
+            no_proxy = proxy_config.no_proxy
+
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.tcp_nodelay = tcp_nodelay
+        self.decompress_gzip = decompress_gzip
+        self.http_proxy = http_proxy
+        self.https_proxy = https_proxy
+        self.no_proxy = no_proxy
+        self.persistent = persistent
+        self.max_persistent_per_host = max_persistent_per_host
+        self.cached_connection_timeout = cached_connection_timeout
+        self.limiter = limiter
+        self.max_body_size = max_body_size
+        self.max_decompressed_size = max_decompressed_size
+        self.compress_body = compress_body
+        self.compress_level = compress_level
+        self.compress_min_size = compress_min_size
+        self.resolver = resolver
+        self.json_decoder = json_decoder
+        self.parse_json = parse_json
+        self.retry = retry
+        self.hedge = hedge
+        self.breaker = breaker
+        self.timings = timings
+        self.cache = cache
+        self.coalescer = coalescer
+
+        self._headers = listify_headers(_with_default_user_agent(headers))
+
+        # Agent and pool are created lazily in the reactor thread
+        self._agent = None
+        self._pool = None
+        self._shutdown_trigger = None
+
+    def _get_agent(self, reactor):
+        """
+        NOTE: Make sure to call this only from the reactor thread as it is
+        accessing twisted API.
+        """
+
+        if self._agent is not None:
+            return self._agent
+
+        pool = _build_pool(reactor, self.tcp_nodelay, self.persistent)
+        if self.max_persistent_per_host is not None:
+            pool.maxPersistentPerHost = self.max_persistent_per_host
+        if self.cached_connection_timeout is not None:
+            pool.cachedConnectionTimeout = self.cached_connection_timeout
+
+        self._shutdown_trigger = reactor.addSystemEventTrigger(
+            'before', 'shutdown', pool.closeCachedConnections,
+        )
+        self._pool = pool
+        self._agent = _build_routing_agent(
+            reactor,
+            ProxyConfig(self.http_proxy, self.https_proxy, self.no_proxy),
+            self.connect_timeout,
+            self.resolver,
+            lambda *_: pool,
+        )
+        return self._agent
+
+    @crochet.run_in_reactor
+    def _fetch_inner(self, url, method, headers, body, options):
+        """
+        This method must be run in the reactor thread because it is calling
+        twisted API which is not thread safe.
+
+        :return: a crochet EventualResult wrapping a
+            twisted.internet.defer.Deferred object
+        """
+
+        return _fetch_in_reactor(
+            url, method, headers, body, options,
+            agent=self._get_agent(_import_reactor()),
+        )
+
+    def fetch(
+        self,
+        url,
+        method='GET',
+        headers=None,
+        body='',
+        timeout=_SESSION_DEFAULT,
+        decompress_gzip=_SESSION_DEFAULT,
+        stream=False,
+        max_body_size=_SESSION_DEFAULT,
+        max_decompressed_size=_SESSION_DEFAULT,
+        compress_body=_SESSION_DEFAULT,
+        parse_json=_SESSION_DEFAULT,
+        retry=_SESSION_DEFAULT,
+        hedge=_SESSION_DEFAULT,
+        timings=_SESSION_DEFAULT,
+    ):
+        """
+        Make an HTTP request through the session.
+
+        :param url: the URL to fetch.
+        :param method: the HTTP method.
+        :param headers: a dictionary mapping from string keys to lists of
+            string values, merged on top of the session default headers.
+        :param body: the request body, in any of the forms accepted by
+            :func:`fido.fetch`.
+        :param timeout: maximum allowed request time in seconds, defaults to
+            the session timeout.
+        :param decompress_gzip: flag to enable decompressing gzipped
+            responses, defaults to the session setting.
+        :param stream: flag to get the response as soon as its headers are
+            received, see :func:`fido.fetch`.
+        :param max_body_size: maximum size in bytes of the response body as
+            received, defaults to the session setting.
+        :param max_decompressed_size: maximum size in bytes of the response
+            body once decompressed, defaults to the session setting.
+        :param compress_body: flag to gzip the request body, defaults to the
+            session setting.
+        :param parse_json: flag to parse the JSON body in the reactor
+            threadpool, defaults to the session setting.
+        :param retry: the :class:`fido.retry.RetryPolicy` of the request,
+            defaults to the session policy. None disables retries.
+        :param hedge: the :class:`fido.hedge.HedgePolicy` of the request,
+            defaults to the session policy. None disables hedging.
+        :param timings: flag to record the timings of the request, defaults
+            to the session setting.
+
+        :returns: a crochet EventualResult object, as returned by
+            :func:`fido.fetch`.
+        """
+
+        if timeout is _SESSION_DEFAULT:
+            timeout = self.timeout
+        if decompress_gzip is _SESSION_DEFAULT:
+            decompress_gzip = self.decompress_gzip
+        if max_body_size is _SESSION_DEFAULT:
+            max_body_size = self.max_body_size
+        if max_decompressed_size is _SESSION_DEFAULT:
+            max_decompressed_size = self.max_decompressed_size
+        if compress_body is _SESSION_DEFAULT:
+            compress_body = self.compress_body
+        if parse_json is _SESSION_DEFAULT:
+            parse_json = self.parse_json
+        if retry is _SESSION_DEFAULT:
+            retry = self.retry
+        if hedge is _SESSION_DEFAULT:
+            hedge = self.hedge
+        if timings is _SESSION_DEFAULT:
+            timings = self.timings
+
+        # the request starts in the calling thread
+        timings = Timings() if timings else None
+
+        headers = dict(headers or {})
+        if compress_body:
+            body, headers = _compress_body(
+                body, headers, self.compress_level, self.compress_min_size)
+
+        options = _FetchOptions(
+            timeout=timeout,
+            connect_timeout=self.connect_timeout,
+            tcp_nodelay=self.tcp_nodelay,
+            decompress_gzip=decompress_gzip,
+            persistent=self.persistent,
+            limiter=self.limiter,
+            stream=stream,
+            max_body_size=max_body_size,
+            max_decompressed_size=max_decompressed_size,
+            resolver=self.resolver,
+            json_decoder=self.json_decoder,
+            parse_json=parse_json,
+            retry=retry,
+            hedge=hedge,
+            breaker=self.breaker,
+            timings=timings,
+            cache=self.cache,
+            coalescer=self.coalescer,
+        )
+
+        # initializes twisted reactor in a different thread
+        crochet.setup()
+        return self._fetch_inner(
+            to_bytes(url),
+            to_bytes(method),
+            merge_headers(self._headers, headers),
+            body,
+            options,
+        )
+
+    @crochet.run_in_reactor
+    def close(self):
+        """
+        Close the connections kept alive by the session. The session can
+        still be used afterwards, new connections are then opened.
+
+        :returns: a crochet EventualResult object firing once the connections
+            are closed.
+        """
+
+        pool, self._pool, self._agent = self._pool, None, None
+        if pool is None:
+            return None
+
+        _import_reactor().removeSystemEventTrigger(self._shutdown_trigger)
+        self._shutdown_trigger = None
+        return pool.closeCachedConnections()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pool is not None:
+            self.close().wait(timeout=None)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from twisted.internet.defer import Deferred
+
+from fido.exceptions import HTTPTimeoutError
+
+
+# Maximum number of bytes buffered in memory for a streamed response body
+# before fido stops reading from the connection until the caller consumes
+# some of them.
+DEFAULT_STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+class BodyStream(object):
+    """The body of a response fetched with ``stream=True``.
+
+    The body chunks are pushed from the reactor thread as they are received
+    and consumed by iterating the stream from the calling thread. At most
+    `max_buffer_size` bytes are buffered: reading from the connection is
+    paused when the buffer is full and resumed once the caller has consumed
+    half of it.
+
+    A stream can only be iterated once. Use :meth:`close` (or the stream as
+    a context manager) to drop the connection without reading the rest of the
+    body.
+    """
+
+    def __init__(self, reactor, max_buffer_size=DEFAULT_STREAM_BUFFER_SIZE):
+        self.max_buffer_size = max_buffer_size
+
+        self._reactor = reactor
+        self._condition = threading.Condition()
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._failure = None
+        self._done = False
+        self._closed = False
+        self._paused = False
+
+        # reactor-side state
+        self._transport = None
+        # fires in the reactor thread once the whole body was received
+        self._finished = Deferred()
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def iter_chunks(self, timeout=None):
+        """
+        Iterate over the body chunks as they are received.
+
+        :param timeout: maximum time in seconds to wait for each chunk.
+        :raises fido.exceptions.HTTPTimeoutError: if no data was received
+            within timeout seconds.
+        :raises: any error occurred while receiving the body, once all the
+            chunks received before it have been consumed.
+        """
+
+        while True:
+            with self._condition:
+                deadline = None if timeout is None else time.time() + timeout
+                while not (self._chunks or self._done or self._closed):
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise HTTPTimeoutError(
+                                "No data was received from the server in "
+                                "{timeout} seconds".format(timeout=timeout)
+                            )
+                    self._condition.wait(remaining)
+
+                if self._closed:
+                    return
+                if not self._chunks:
+                    if self._failure is not None:
+                        self._failure.raiseException()
+                    return
+
+                chunk = self._chunks.popleft()
+                self._buffered -= len(chunk)
+                resume = (
+                    self._paused and
+                    self._buffered <= self.max_buffer_size // 2
+                )
+                if resume:
+                    self._paused = False
+
+            if resume:
+                self._reactor.callFromThread(self._resume_producing)
+            yield chunk
+
+    def read(self, timeout=None):
+        """
+        Read the rest of the body.
+
+        :param timeout: maximum time in seconds to wait for each chunk.
+        :returns: the body bytes not consumed yet.
+        """
+        return b''.join(self.iter_chunks(timeout))
+
+    def close(self):
+        """Stop receiving the body and drop the buffered chunks."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._chunks.clear()
+            self._buffered = 0
+            self._condition.notify_all()
+            done = self._done
+
+        if not done:
+            self._reactor.callFromThread(self._stop_producing)
+
+    # The methods below must only be called from the reactor thread.
+
+    def _connect(self, transport):
+        self._transport = transport
+
+    def _write(self, data):
+        with self._condition:
+            if self._closed:
+                return
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self._condition.notify_all()
+
+    def _update_production(self):
+        """Pause reading from the connection if the buffer is full."""
+        with self._condition:
+            pause = (
+                not self._paused and not self._done and
+                self._buffered >= self.max_buffer_size
+            )
+            if pause:
+                self._paused = True
+
+        if pause:
+            self._transport.pauseProducing()
+
+    def _finish(self, failure=None):
+        with self._condition:
+            self._done = True
+            self._failure = failure
+            self._condition.notify_all()
+
+        self._transport = None
+        self._finished.callback(None)
+
+    def _resume_producing(self):
+        with self._condition:
+            # the buffer filled up again since the resume was scheduled
+            if self._paused:
+                return
+
+        if self._transport is not None:
+            self._transport.resumeProducing()
+
+    def _stop_producing(self):
+        if self._transport is not None:
+            self._transport.stopProducing()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import contextlib
+from timeit import default_timer
+
+
+# The clock of the timings: a monotonic, high resolution clock on python 3.
+now = default_timer
+
+# The timings of the request being handed to the Twisted Agent. The agent
+# asks its connection pool for a connection synchronously, which records the
+# connection phases of the request through it. Only accessed from the reactor
+# thread.
+_current = None
+
+
+@contextlib.contextmanager
+def recording(timings):
+    """
+    NOTE: Make sure to call this only from the reactor thread.
+
+    Make `timings` the timings recorded by the connection pool and the
+    endpoints while in the context.
+    """
+
+    global _current
+    _current = timings
+    try:
+        yield
+    finally:
+        _current = None
+
+
+def current():
+    """Return the timings of the request being sent, None if disabled."""
+    return _current
+
+
+def _elapsed(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+class Timings(object):
+    """The timestamps of the phases of a request, enabled with the `timings`
+    flag of :func:`fido.fetch`.
+
+    Timestamps are in seconds from an arbitrary origin (see
+    :data:`fido.timings.now`), None if the request failed or returned before
+    reaching the phase. The durations are computed from them. Each attempt of
+    a retried or hedged request has its own timings, sharing `start` and
+    `scheduled`.
+
+    :ivar start: fetch was called.
+    :ivar scheduled: the reactor thread started handling the request.
+    :ivar sent: the request was handed to the Twisted Agent, after waiting
+        for a limiter slot.
+    :ivar resolved: the hostname was resolved. Only recorded for the new
+        connections of a :class:`fido.dns.CachingResolver`, other lookups
+        are part of `connect_time`.
+    :ivar connected: a connection was established or taken from the pool.
+    :ivar reused: whether the connection was taken from the pool.
+    :ivar headers: the response headers were received.
+    :ivar body: the response body was received and decompressed.
+    :ivar end: the response or the error was delivered, after parsing the
+        JSON body with `parse_json`.
+    :ivar decompress_time: seconds spent decompressing the response body.
+    :ivar attempt: the number of the attempt, from 1.
+    """
+
+    __slots__ = (
+        'start', 'scheduled', 'sent', 'resolved', 'connected', 'reused',
+        'headers', 'body', 'end', 'decompress_time', 'attempt', '_attempts',
+    )
+
+    def __init__(self, start=None):
+        self.start = now() if start is None else start
+        self.scheduled = None
+        self.sent = None
+        self.resolved = None
+        self.connected = None
+        self.reused = None
+        self.headers = None
+        self.body = None
+        self.end = None
+        self.decompress_time = 0.0
+        self.attempt = 0
+        self._attempts = 0
+
+    def _next_attempt(self):
+        """
+        NOTE: Make sure to call this only from the reactor thread.
+
+        Return the timings of a new attempt of the request.
+        """
+
+        self._attempts += 1
+        timings = Timings(self.start)
+        timings.scheduled = self.scheduled
+        timings.attempt = self._attempts
+        return timings
+
+    @property
+    def reactor_delay(self):
+        """Seconds waited for the reactor thread to handle the request."""
+        return _elapsed(self.start, self.scheduled)
+
+    @property
+    def queue_time(self):
+        """Seconds waited for a limiter slot, and for the previous attempts
+        of a retried request."""
+        return _elapsed(self.scheduled, self.sent)
+
+    @property
+    def dns_time(self):
+        """Seconds spent resolving the hostname, see `resolved`."""
+        return _elapsed(self.sent, self.resolved)
+
+    @property
+    def connect_time(self):
+        """Seconds spent getting a connection, 0 for a reused one."""
+        return _elapsed(self.resolved or self.sent, self.connected)
+
+    @property
+    def ttfb(self):
+        """Seconds from the connection to the response headers (time to
+        first byte), including the TLS handshake of https connections."""
+        return _elapsed(self.connected or self.sent, self.headers)
+
+    @property
+    def download_time(self):
+        """Seconds spent receiving and decompressing the body."""
+        return _elapsed(self.headers, self.body)
+
+    @property
+    def total_time(self):
+        """Seconds from fetch to the delivery of the result."""
+        return _elapsed(self.start, self.end)
+
+    def __repr__(self):
+        return (
+            '{name}(total_time={total!r}, reactor_delay={reactor!r}, '
+            'queue_time={queue!r}, dns_time={dns!r}, '
+            'connect_time={connect!r}, ttfb={ttfb!r}, '
+            'download_time={download!r}, decompress_time={decompress!r}, '
+            'reused={reused!r}, attempt={attempt!r})'
+        ).format(
+            name=type(self).__name__,
+            total=self.total_time,
+            reactor=self.reactor_delay,
+            queue=self.queue_time,
+            dns=self.dns_time,
+            connect=self.connect_time,
+            ttfb=self.ttfb,
+            download=self.download_time,
+            decompress=self.decompress_time,
+            reused=self.reused,
+            attempt=self.attempt,
+        )
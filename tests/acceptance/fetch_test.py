@@ -1,22 +1,52 @@
 # -*- coding: utf-8 -*-
+import collections
+import json
 import logging
+import select
+import socket
 import time
 
 import zlib
 from multiprocessing import Process
 
 import crochet
+import mock
 import pytest
 from six.moves import BaseHTTPServer
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.python.filepath import FilePath
 from six.moves import socketserver as SocketServer
+from six.moves.urllib_parse import urlparse
 from yelp_bytes import to_bytes
 
 import fido
 from fido.fido import DEFAULT_USER_AGENT
 from fido.fido import GZIP_WINDOW_SIZE
+from fido.breaker import CircuitBreaker
+from fido.cache import ResponseCache
+from fido.coalesce import RequestCoalescer
+from fido.exceptions import CircuitOpenError
 from fido.exceptions import TCPConnectionError
 from fido.exceptions import HTTPTimeoutError
 from fido.exceptions import GzipDecompressionError
+from fido.exceptions import QueueTimeoutError
+from fido.exceptions import ResponseTooLargeError
+from fido.dns import CachingResolver
+from fido.fido import _build_pool
+from fido.fido import _import_reactor
+from fido.fido import _twisted_web_client
+from fido.limits import ConcurrencyLimiter
+from fido.metrics import BYTES_RECEIVED
+from fido.metrics import LATENCY
+from fido.metrics import POOL_HITS
+from fido.metrics import POOL_MISSES
+from fido.metrics import REQUESTS
+from fido.metrics import InMemoryMetrics
+from fido.metrics import set_metrics
+from fido.hedge import HedgePolicy
+from fido.proxy import TunnelingEndpoint
+from fido.retry import RetryPolicy
+from fido.streaming import BodyStream
 
 
 SERVER_OVERHEAD_TIME = 2.0
@@ -24,13 +54,20 @@ TIMEOUT_TEST = 1.0
 
 ECHO_URL = '/echo'
 GZIP_URL = '/gzip'
+LARGE_URL = '/large'
+DEFLATE_URL = '/deflate'
+BOMB_URL = '/bomb'
+UPLOAD_URL = '/upload'
+FLAKY_URL = '/flaky'
+SLOW_ONCE_URL = '/slow_once'
+CACHED_URL = '/cached'
 
 
-def _compress_gzip(buffer):
+def _compress_gzip(buffer, wbits=GZIP_WINDOW_SIZE):
     compress_gzip = zlib.compressobj(
         zlib.Z_DEFAULT_COMPRESSION,
         zlib.DEFLATED,
-        GZIP_WINDOW_SIZE,
+        wbits,
     )
     return compress_gzip.compress(buffer) + compress_gzip.flush()
 
@@ -42,14 +79,36 @@ def tcp_nodelay(request):
     return request.param
 
 
-@pytest.yield_fixture(scope="module")
-def server_url():
-    """Spin up a localhost web server for testing."""
+def _serve(handler):
+    """Run a multithreaded web server for `handler` in another process."""
 
     # Surpress 'No handlers could be found for logger "twisted"' messages
     logging.basicConfig()
     logging.getLogger('twisted').setLevel(logging.CRITICAL)
 
+    class MultiThreadedHTTPServer(
+        SocketServer.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer
+    ):
+        request_queue_size = 1000
+
+    httpd = MultiThreadedHTTPServer(('localhost', 0), handler)
+    web_service_process = Process(target=httpd.serve_forever)
+    try:
+        web_service_process.start()
+        server_address = 'http://{host}:{port}'.format(
+            host=httpd.server_address[0],
+            port=httpd.server_address[1],
+        )
+        yield server_address
+    finally:
+        web_service_process.terminate()
+
+
+@pytest.yield_fixture(scope="module")
+def server_url():
+    """Spin up a localhost web server for testing."""
+
     class TestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         def echo(self):
             if 'slow' in self.path:
@@ -84,6 +143,16 @@ def server_url():
                 self.wfile.write(_compress_gzip(
                     self.rfile.read(content_length)))
 
+        def deflate(self):
+            """Send back the body deflated, in raw format if asked to."""
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'deflate')
+            self.end_headers()
+            wbits = -zlib.MAX_WBITS if 'raw' in self.path else zlib.MAX_WBITS
+            content_length = int(self.headers.get('Content-Length', 0))
+            self.wfile.write(_compress_gzip(
+                self.rfile.read(content_length), wbits))
+
         def content_length(self):
             """Send back the content-length number as the response."""
             self.send_response(200)
@@ -95,35 +164,187 @@ def server_url():
 
             self.wfile.write(response)
 
+        def large(self):
+            """Send back as many bytes as the number ending the path."""
+            size = int(self.path.rsplit('/', 1)[1])
+            self.send_response(200)
+            self.send_header('Content-Length', size)
+            self.end_headers()
+
+            chunk = b'x' * 65536
+            while size > 0:
+                self.wfile.write(chunk[:size])
+                size -= len(chunk)
+
+        def bomb(self):
+            """Send back as many gzipped zeros as the number ending the path,
+            without content-length."""
+            size = int(self.path.rsplit('/', 1)[1])
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            self.wfile.write(_compress_gzip(b'\0' * size))
+
         def do_GET(self):
             if ECHO_URL in self.path:
                 self.echo()
             elif GZIP_URL in self.path:
                 self.gzip()
+            elif LARGE_URL in self.path:
+                self.large()
+            elif DEFLATE_URL in self.path:
+                self.deflate()
+            elif BOMB_URL in self.path:
+                self.bomb()
+            elif FLAKY_URL in self.path:
+                self.flaky()
+            elif SLOW_ONCE_URL in self.path:
+                self.slow_once()
+            elif CACHED_URL in self.path:
+                self.cached()
+
+        # attempts per key of the flaky endpoint
+        attempts = collections.Counter()
+
+        def flaky(self):
+            """
+            /flaky/<key>/<failures>: fail with a 503 the first <failures>
+            requests for <key>, then send back the number of attempts.
+            """
+            _, _, key, failures = self.path.split('/')
+            self.attempts[key] += 1
+            attempts = self.attempts[key]
+            if attempts <= int(failures):
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+
+            response = to_bytes(str(attempts))
+            self.send_response(200)
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def slow_once(self):
+            """
+            /slow_once/<key>: the first request for <key> is slow, send back
+            the number of attempts.
+            """
+            _, _, key = self.path.split('/')
+            self.attempts[key] += 1
+            attempts = self.attempts[key]
+            if attempts == 1:
+                time.sleep(SERVER_OVERHEAD_TIME)
+
+            response = to_bytes(str(attempts))
+            self.send_response(200)
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def cached(self):
+            """
+            /cached/<key>/<max_age>: send back the number of attempts for
+            <key> with an etag, or a 304 if the request has the etag.
+            """
+            _, _, key, max_age = self.path.split('/')
+            self.attempts[key] += 1
+            etag = '"{0}"'.format(key)
+
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                response = b''
+            else:
+                self.send_response(200)
+                response = to_bytes(str(self.attempts[key]))
+            self.send_header('Cache-Control', 'max-age=' + max_age)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def upload(self):
+            """Send back the request body, which may be chunked."""
+            if self.headers.get('Transfer-Encoding') == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                    if not size:
+                        break
+                body = b''.join(chunks)
+            else:
+                body = self.rfile.read(int(self.headers['Content-Length']))
+
+            self.send_response(200)
+            self.send_header('Content-Length', len(body))
+            self.send_header(
+                'X-Chunked',
+                self.headers.get('Transfer-Encoding') == 'chunked',
+            )
+            self.end_headers()
+            self.wfile.write(body)
 
         def do_POST(self):
             if 'content_length' in self.path:
                 self.content_length()
+            elif UPLOAD_URL in self.path:
+                self.upload()
             elif ECHO_URL in self.path:
                 self.echo()
 
-    class MultiThreadedHTTPServer(
-        SocketServer.ThreadingMixIn,
-        BaseHTTPServer.HTTPServer
-    ):
-        request_queue_size = 1000
+    for server_address in _serve(TestHandler):
+        yield server_address
 
-    httpd = MultiThreadedHTTPServer(('localhost', 0), TestHandler)
-    web_service_process = Process(target=httpd.serve_forever)
-    try:
-        web_service_process.start()
-        server_address = 'http://{host}:{port}'.format(
-            host=httpd.server_address[0],
-            port=httpd.server_address[1],
-        )
+
+@pytest.yield_fixture(scope="module")
+def keepalive_server_url():
+    """Spin up a localhost HTTP/1.1 web server keeping connections alive."""
+
+    class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            """Send back the client port, which identifies the connection."""
+            response = to_bytes(str(self.client_address[1]))
+            self.send_response(200)
+            self.send_header('Content-Length', len(response))
+            self.end_headers()
+            self.wfile.write(response)
+
+    for server_address in _serve(KeepAliveHandler):
+        yield server_address
+
+
+@pytest.yield_fixture(scope="module")
+def tunnel_proxy_url():
+    """Spin up a localhost proxy supporting the CONNECT method only."""
+
+    class ConnectHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_CONNECT(self):
+            host, port = self.path.rsplit(':', 1)
+            target = socket.create_connection((host, int(port)))
+            self.send_response(200, 'Connection established')
+            self.end_headers()
+            self.wfile.flush()
+
+            sockets = [self.connection, target]
+            while True:
+                readable, _, _ = select.select(sockets, [], [])
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        target.close()
+                        return
+                    other = target if sock is self.connection else \
+                        self.connection
+                    other.sendall(data)
+
+    for server_address in _serve(ConnectHandler):
         yield server_address
-    finally:
-        web_service_process.terminate()
 
 
 def test_fetch_basic(server_url):
@@ -181,6 +402,27 @@ def test_agent_timeout(server_url, tcp_nodelay):
     )
 
 
+def test_circuit_breaker_fails_fast(tcp_nodelay):
+    # a port nobody listens on: connections are refused
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    url = 'http://localhost:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+
+    breaker = CircuitBreaker(consecutive_failures=2)
+    for _ in range(2):
+        with pytest.raises(TCPConnectionError):
+            fido.fetch(
+                url, tcp_nodelay=tcp_nodelay, breaker=breaker,
+            ).wait(timeout=TIMEOUT_TEST)
+
+    with pytest.raises(CircuitOpenError):
+        fido.fetch(
+            url, tcp_nodelay=tcp_nodelay, breaker=breaker,
+        ).wait(timeout=TIMEOUT_TEST)
+    assert breaker.rejected == 1
+
+
 def test_agent_connect_timeout(tcp_nodelay):
     """
     Testing that we don't wait more than connect_timeout to establish a http
@@ -234,6 +476,133 @@ def test_json_body(server_url, tcp_nodelay):
     assert eventual_result.wait(timeout=1).json()['some_json_data'] == 30
 
 
+def test_json_body_parsed_in_thread(server_url, tcp_nodelay):
+    decoder = mock.Mock(side_effect=json.loads)
+    response = fido.fetch(
+        server_url + ECHO_URL,
+        method='POST',
+        body=b'{"some_json_data": 30}',
+        tcp_nodelay=tcp_nodelay,
+        json_decoder=decoder,
+        parse_json=True,
+    ).wait(timeout=1)
+
+    # parsed before the response was delivered
+    decoder.assert_called_once_with(b'{"some_json_data": 30}')
+    assert response.json() == {'some_json_data': 30}
+    assert decoder.call_count == 1
+
+
+def test_invalid_json_body_parsed_in_thread(server_url, tcp_nodelay):
+    response = fido.fetch(
+        server_url + ECHO_URL,
+        method='POST',
+        body=b'not json',
+        tcp_nodelay=tcp_nodelay,
+        parse_json=True,
+    ).wait(timeout=1)
+
+    assert response.body == b'not json'
+    with pytest.raises(ValueError):
+        response.json()
+
+
+def test_prepared_request(server_url, tcp_nodelay):
+    prepared = fido.prepare(
+        server_url + ECHO_URL,
+        method='POST',
+        headers={'Foo': 'bar'},
+        body=b'prepared',
+        tcp_nodelay=tcp_nodelay,
+    )
+
+    responses = [prepared.fetch() for _ in range(3)]
+    responses.append(prepared.fetch(headers={'Foo': 'baz'}, body=b'other'))
+    responses = [response.wait(timeout=1) for response in responses]
+
+    assert [response.body for response in responses] == [
+        b'prepared', b'prepared', b'prepared', b'other',
+    ]
+    assert responses[0].headers[b'Foo'] == [b'bar']
+    assert responses[3].headers[b'Foo'] == [b'baz']
+
+
+def test_retry_policy(server_url, tcp_nodelay):
+    retry = RetryPolicy(max_retries=2, backoff_base=0.01)
+
+    response = fido.fetch(
+        server_url + FLAKY_URL + '/recovers-{0}/2'.format(tcp_nodelay),
+        tcp_nodelay=tcp_nodelay,
+        retry=retry,
+    ).wait(timeout=TIMEOUT_TEST)
+    assert response.code == 200
+    assert response.body == b'3'
+
+    response = fido.fetch(
+        server_url + FLAKY_URL + '/down-{0}/5'.format(tcp_nodelay),
+        tcp_nodelay=tcp_nodelay,
+        retry=retry,
+    ).wait(timeout=TIMEOUT_TEST)
+    assert response.code == 503
+    assert retry.retries == 4
+
+
+def test_hedge_policy(server_url, tcp_nodelay):
+    hedge = HedgePolicy(delay=0.1, max_ratio=1)
+
+    response = fido.fetch(
+        server_url + SLOW_ONCE_URL + '/hedged-{0}'.format(tcp_nodelay),
+        tcp_nodelay=tcp_nodelay,
+        hedge=hedge,
+    ).wait(timeout=TIMEOUT_TEST)
+
+    # the hedge got the fast response
+    assert response.body == b'2'
+    assert hedge.hedges == 1
+    assert hedge.wins == 1
+
+
+def test_response_cache(server_url, tcp_nodelay):
+    cache = ResponseCache()
+
+    def fetch(max_age):
+        return fido.fetch(
+            server_url + CACHED_URL + '/cached-{0}-{1}'.format(
+                tcp_nodelay, max_age) + '/' + str(max_age),
+            tcp_nodelay=tcp_nodelay,
+            cache=cache,
+        ).wait(timeout=TIMEOUT_TEST)
+
+    for _ in range(2):
+        assert fetch(60).body == b'1'
+    assert cache.hits == 1
+
+    # revalidated with a 304
+    for _ in range(2):
+        response = fetch(0)
+        assert response.code == 200
+        assert response.body == b'1'
+    assert cache.revalidated == 1
+
+
+def test_request_coalescer(server_url):
+    coalescer = RequestCoalescer()
+
+    # the first request is slow, the others wait for it
+    results = [
+        fido.fetch(
+            server_url + SLOW_ONCE_URL + '/coalesced', coalescer=coalescer)
+        for _ in range(3)
+    ]
+    bodies = [
+        result.wait(timeout=SERVER_OVERHEAD_TIME + 1).body
+        for result in results
+    ]
+
+    assert bodies == [b'1'] * 3
+    assert coalescer.coalesced == 2
+
+
 def test_content_length_readded_by_twisted(server_url, tcp_nodelay):
     headers = {'Content-Length': '250'}
     body = b'{"some_json_data": 30}'
@@ -348,3 +717,461 @@ def test_fido_request_gzip_disabled(server_url):
     actual_body = response.body
     assert response.code == 200
     assert _compress_gzip(expected_body) == actual_body
+
+
+def test_persistent_connection_reused(keepalive_server_url, tcp_nodelay):
+    client_ports = [
+        fido.fetch(
+            keepalive_server_url,
+            tcp_nodelay=tcp_nodelay,
+        ).wait(timeout=1).body
+        for _ in range(3)
+    ]
+    assert len(set(client_ports)) == 1
+
+
+def test_persistent_connection_opt_out(keepalive_server_url, tcp_nodelay):
+    client_ports = [
+        fido.fetch(
+            keepalive_server_url,
+            tcp_nodelay=tcp_nodelay,
+            persistent=False,
+        ).wait(timeout=1).body
+        for _ in range(3)
+    ]
+    assert len(set(client_ports)) == 3
+
+
+def test_persistent_http10_connections_not_reused(server_url, tcp_nodelay):
+    # the HTTP/1.0 server closes every connection: POSTs, which twisted does
+    # not retry, must not be sent on them
+    for _ in range(5):
+        responses = [
+            fido.fetch(
+                server_url + UPLOAD_URL,
+                method='POST',
+                body=b'corpus',
+                tcp_nodelay=tcp_nodelay,
+            )
+            for _ in range(20)
+        ]
+        for response in responses:
+            assert response.wait(timeout=5).body == b'corpus'
+
+
+def test_session_fetch(server_url, tcp_nodelay):
+    with fido.Session(
+        headers={'foo': 'bar'},
+        tcp_nodelay=tcp_nodelay,
+    ) as session:
+        response = session.fetch(
+            server_url + ECHO_URL,
+            headers={'baz': ['qux']},
+            body=b'corpus',
+        ).wait(timeout=1)
+
+    assert response.code == 200
+    assert response.body == b'corpus'
+    assert response.headers.get(b'Foo') == [b'bar']
+    assert response.headers.get(b'Baz') == [b'qux']
+    assert response.headers.get(b'User-Agent') == [
+        to_bytes(DEFAULT_USER_AGENT),
+    ]
+
+
+def test_session_reuses_connections(keepalive_server_url, tcp_nodelay):
+    with fido.Session(tcp_nodelay=tcp_nodelay) as session:
+        client_ports = [
+            session.fetch(keepalive_server_url).wait(timeout=1).body
+            for _ in range(3)
+        ]
+        assert len(set(client_ports)) == 1
+
+        session.close().wait(timeout=1)
+        assert session.fetch(
+            keepalive_server_url,
+        ).wait(timeout=1).body not in client_ports
+
+
+def test_timings(keepalive_server_url, tcp_nodelay):
+    with fido.Session(tcp_nodelay=tcp_nodelay, timings=True) as session:
+        first, second = [
+            session.fetch(keepalive_server_url).wait(timeout=1).timings
+            for _ in range(2)
+        ]
+
+    for timings in (first, second):
+        phases = [
+            timings.start, timings.scheduled, timings.sent,
+            timings.connected, timings.headers, timings.body, timings.end,
+        ]
+        assert None not in phases
+        assert phases == sorted(phases)
+        assert timings.resolved is None
+        assert timings.attempt == 1
+    assert first.reused is False
+    assert second.reused is True
+
+
+def test_timings_disabled(server_url):
+    assert fido.fetch(server_url + ECHO_URL).wait(timeout=1).timings is None
+
+
+def test_timings_caching_resolver(server_url):
+    url = server_url.replace('127.0.0.1', 'localhost') + ECHO_URL
+    timings = fido.fetch(
+        url, resolver=CachingResolver(), persistent=False, timings=True,
+    ).wait(timeout=1).timings
+
+    assert timings.sent <= timings.resolved <= timings.connected
+    assert timings.reused is False
+
+
+def test_timings_attached_to_exception():
+    # a port nobody listens on: connections are refused
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    url = 'http://localhost:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+
+    with pytest.raises(TCPConnectionError) as excinfo:
+        fido.fetch(url, timings=True).wait(timeout=TIMEOUT_TEST)
+
+    timings = excinfo.value.timings
+    assert timings.sent is not None
+    assert timings.connected is None
+    assert timings.end >= timings.sent
+
+
+def test_metrics(keepalive_server_url):
+    metrics = InMemoryMetrics()
+    set_metrics(metrics)
+    try:
+        with fido.Session() as session:
+            for _ in range(2):
+                session.fetch(keepalive_server_url).wait(timeout=1)
+    finally:
+        set_metrics(None)
+
+    host = {'host': urlparse(keepalive_server_url).netloc}
+    assert metrics.counter_value(
+        REQUESTS, dict(host, method='GET', status='200')) == 2
+    assert len(metrics.histogram_values(LATENCY, host)) == 2
+    assert metrics.counter_value(BYTES_RECEIVED, host) > 0
+    assert metrics.counter_value(POOL_MISSES) == 1
+    assert metrics.counter_value(POOL_HITS) == 1
+
+
+def test_fetch_many(server_url, tcp_nodelay):
+    bodies = [to_bytes(str(i)) for i in range(50)]
+    batch = fido.fetch_many(
+        {
+            'url': server_url + ECHO_URL,
+            'method': 'POST',
+            'body': body,
+            'tcp_nodelay': tcp_nodelay,
+        }
+        for body in bodies
+    )
+
+    responses = batch.wait_all(timeout=5)
+    assert [response.body for response in responses] == bodies
+    assert sorted(
+        result.wait(timeout=0).body for result in batch.as_completed()
+    ) == sorted(bodies)
+
+
+def test_fetch_concurrency_limiter(server_url):
+    limiter = ConcurrencyLimiter(max_per_host=2)
+    batch = fido.fetch_many(
+        {'url': server_url + ECHO_URL, 'limiter': limiter}
+        for _ in range(6)
+    )
+
+    assert all(
+        response.code == 200 for response in batch.wait_all(timeout=5)
+    )
+    assert limiter.wait_count == 4
+    assert limiter.in_flight() == 0
+
+
+def test_fetch_concurrency_limiter_queue_timeout(server_url):
+    limiter = ConcurrencyLimiter(max_per_host=1, queue_timeout=TIMEOUT_TEST)
+    slow = fido.fetch(server_url + ECHO_URL + '/slow', limiter=limiter)
+    queued = fido.fetch(server_url + ECHO_URL, limiter=limiter)
+
+    with pytest.raises(QueueTimeoutError):
+        queued.wait(timeout=2 * TIMEOUT_TEST)
+    assert slow.wait(timeout=SERVER_OVERHEAD_TIME).code == 200
+
+
+def test_fetch_concurrency_limiter_timeout_while_queued(server_url):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    slow = fido.fetch(server_url + ECHO_URL + '/slow', limiter=limiter)
+    queued = fido.fetch(
+        server_url + ECHO_URL,
+        timeout=TIMEOUT_TEST,
+        limiter=limiter,
+    )
+
+    with pytest.raises(HTTPTimeoutError):
+        queued.wait(timeout=2 * TIMEOUT_TEST)
+    assert limiter.queue_length() == 0
+    assert slow.wait(timeout=SERVER_OVERHEAD_TIME).code == 200
+
+
+def test_fetch_stream(server_url, tcp_nodelay):
+    expected_body = b'x' * (3 * 1024 * 1024)
+    response = fido.fetch(
+        server_url + LARGE_URL + '/' + str(len(expected_body)),
+        tcp_nodelay=tcp_nodelay,
+        stream=True,
+    ).wait(timeout=1)
+
+    assert response.code == 200
+    assert isinstance(response.body, BodyStream)
+    chunks = list(response.body.iter_chunks(timeout=1))
+    assert len(chunks) > 1
+    assert b''.join(chunks) == expected_body
+
+
+def test_fetch_stream_decompress_gzip(server_url):
+    expected_body = b'hello world' * 1000
+    response = fido.fetch(
+        server_url + GZIP_URL,
+        body=expected_body,
+        decompress_gzip=True,
+        stream=True,
+    ).wait(timeout=1)
+
+    assert response.body.read(timeout=1) == expected_body
+
+    response = fido.fetch(
+        server_url + ECHO_URL,
+        headers={'Content-Encoding': 'gzip'},
+        body=expected_body,
+        decompress_gzip=True,
+        stream=True,
+    ).wait(timeout=1)
+
+    with pytest.raises(GzipDecompressionError):
+        response.body.read(timeout=1)
+
+
+def test_fetch_stream_close_releases_limiter(server_url):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    response = fido.fetch(
+        server_url + LARGE_URL + '/' + str(3 * 1024 * 1024),
+        limiter=limiter,
+        stream=True,
+    ).wait(timeout=1)
+    assert limiter.in_flight() == 1
+
+    response.body.close()
+    assert fido.fetch(
+        server_url + ECHO_URL,
+        limiter=limiter,
+    ).wait(timeout=1).code == 200
+
+
+@pytest.mark.parametrize('path', (DEFLATE_URL, DEFLATE_URL + '/raw'))
+def test_fido_request_decompress_deflate(server_url, path):
+    expected_body = b'hello world' * 1000
+    response = fido.fetch(
+        server_url + path,
+        body=expected_body,
+        decompress_gzip=True,
+    ).wait(timeout=1)
+    assert response.code == 200
+    assert response.body == expected_body
+
+
+def test_fetch_compress_body(server_url):
+    expected_body = b'hello world' * 1000
+    response = fido.fetch(
+        server_url + ECHO_URL,
+        method='POST',
+        body=expected_body,
+        compress_body=True,
+    ).wait(timeout=1)
+
+    # the echoed request is sent back gzipped as it was received
+    assert response.headers[b'Content-Encoding'] == [b'gzip']
+    assert len(response.body) < len(expected_body)
+    assert zlib.decompress(response.body, GZIP_WINDOW_SIZE) == expected_body
+
+
+def test_fetch_body_file_path(server_url, tmpdir):
+    expected_body = b'hello world' * 100000
+    path = tmpdir.join('body')
+    path.write_binary(expected_body)
+
+    response = fido.fetch(
+        server_url + UPLOAD_URL,
+        method='POST',
+        body=FilePath(str(path)),
+    ).wait(timeout=1)
+    assert response.headers[b'X-Chunked'] == [b'False']
+    assert response.body == expected_body
+
+
+def test_fetch_body_memoryview(server_url):
+    expected_body = b'hello world' * 100000
+    response = fido.fetch(
+        server_url + UPLOAD_URL,
+        method='POST',
+        body=memoryview(expected_body),
+    ).wait(timeout=1)
+    assert response.body == expected_body
+
+
+def test_fetch_body_generator_chunked(server_url):
+    chunks = [b'hello world' * 1000] * 100
+    response = fido.fetch(
+        server_url + UPLOAD_URL,
+        method='POST',
+        body=(chunk for chunk in chunks),
+    ).wait(timeout=1)
+    assert response.headers[b'X-Chunked'] == [b'True']
+    assert response.body == b''.join(chunks)
+
+
+def test_max_body_size_content_length(server_url):
+    with pytest.raises(ResponseTooLargeError):
+        fido.fetch(
+            server_url + LARGE_URL + '/' + str(1024 * 1024),
+            max_body_size=1024,
+        ).wait(timeout=1)
+
+    response = fido.fetch(
+        server_url + LARGE_URL + '/1024',
+        max_body_size=1024,
+    ).wait(timeout=1)
+    assert response.body == b'x' * 1024
+
+
+def test_max_body_size_while_receiving(server_url):
+    compressed_size = len(_compress_gzip(b'\0' * (10 * 1024 * 1024)))
+    with pytest.raises(ResponseTooLargeError):
+        fido.fetch(
+            server_url + BOMB_URL + '/' + str(10 * 1024 * 1024),
+            max_body_size=compressed_size // 2,
+        ).wait(timeout=1)
+
+
+def test_max_decompressed_size(server_url):
+    with pytest.raises(ResponseTooLargeError):
+        fido.fetch(
+            server_url + BOMB_URL + '/' + str(10 * 1024 * 1024),
+            decompress_gzip=True,
+            max_decompressed_size=1024 * 1024,
+        ).wait(timeout=1)
+
+    response = fido.fetch(
+        server_url + BOMB_URL + '/1024',
+        decompress_gzip=True,
+        max_decompressed_size=1024,
+    ).wait(timeout=1)
+    assert response.body == b'\0' * 1024
+
+
+def test_max_decompressed_size_stream(server_url):
+    response = fido.fetch(
+        server_url + BOMB_URL + '/' + str(10 * 1024 * 1024),
+        decompress_gzip=True,
+        max_decompressed_size=1024 * 1024,
+        stream=True,
+    ).wait(timeout=1)
+    with pytest.raises(ResponseTooLargeError):
+        response.body.read(timeout=1)
+
+
+def test_aio_fetch_concurrent(server_url):
+    asyncio = pytest.importorskip('asyncio')
+    aio = pytest.importorskip('fido.aio')
+    limiter = ConcurrencyLimiter(max_per_host=50)
+    loop = asyncio.new_event_loop()
+
+    def fetch_all():
+        asyncio.set_event_loop(loop)
+        return asyncio.gather(*[
+            aio.fetch(server_url + ECHO_URL, limiter=limiter)
+            for _ in range(2000)
+        ])
+
+    try:
+        responses = loop.run_until_complete(
+            asyncio.wait_for(fetch_all(), 30))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    assert len(responses) == 2000
+    assert all(response.code == 200 for response in responses)
+
+
+def test_futures_fetch_as_completed(server_url):
+    futures = pytest.importorskip('concurrent.futures')
+    fido_futures = pytest.importorskip('fido.futures')
+
+    pending = [
+        fido_futures.fetch(server_url + ECHO_URL)
+        for _ in range(200)
+    ]
+    responses = [
+        future.result()
+        for future in futures.as_completed(pending, timeout=10)
+    ]
+
+    assert len(responses) == 200
+    assert all(response.code == 200 for response in responses)
+
+
+def test_fetch_caching_resolver(server_url):
+    resolver = CachingResolver()
+    url = server_url.replace('127.0.0.1', 'localhost') + ECHO_URL
+    for _ in range(3):
+        assert fido.fetch(url, resolver=resolver).wait(timeout=1).code == 200
+
+    assert resolver.misses == 1
+    assert resolver.hits == 2
+
+
+def test_tunnels_reused(tunnel_proxy_url, keepalive_server_url):
+    class TunnelingEndpointFactory(object):
+        """Tunnels plain http as TLS is an optional extra."""
+
+        def __init__(self, reactor):
+            proxy = urlparse(tunnel_proxy_url)
+            self._proxy_endpoint = TCP4ClientEndpoint(
+                reactor, proxy.hostname, proxy.port)
+
+        def endpointForURI(self, uri):
+            return TunnelingEndpoint(
+                self._proxy_endpoint, uri.host.decode('ascii'), uri.port)
+
+    @crochet.wait_for(timeout=2)
+    def fetch_client_ports():
+        reactor = _import_reactor()
+        agent = _twisted_web_client().Agent.usingEndpointFactory(
+            reactor,
+            TunnelingEndpointFactory(reactor),
+            pool=_build_pool(reactor, tcp_nodelay=False, persistent=True),
+        )
+
+        def fetch(_=None):
+            deferred = agent.request(b'GET', to_bytes(keepalive_server_url))
+            deferred.addCallback(_twisted_web_client().readBody)
+            return deferred
+
+        ports = []
+        deferred = fetch()
+        for _ in range(2):
+            deferred.addCallback(ports.append)
+            deferred.addCallback(fetch)
+        deferred.addCallback(ports.append)
+        deferred.addCallback(lambda _: ports)
+        return deferred
+
+    # the target sees the requests coming from the same tunnel
+    assert len(set(fetch_client_ports())) == 1
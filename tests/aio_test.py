@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import crochet
+import mock
+import pytest
+from twisted.internet.defer import Deferred
+
+from fido.exceptions import HTTPTimeoutError
+
+asyncio = pytest.importorskip('asyncio')
+aio = pytest.importorskip('fido.aio')
+
+
+TIMEOUT_TEST = 1.0
+
+
+@pytest.yield_fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.yield_fixture
+def deferreds():
+    """Patch the requests sent by fido.aio with manual Deferreds."""
+    deferreds = []
+
+    def fetch_in_reactor(*args):
+        deferreds.append(Deferred())
+        return deferreds[-1]
+
+    # careful while patching _fetch_in_reactor cause it's being accessed
+    # by the reactor thread
+    with mock.patch(
+        'fido.aio._fetch_in_reactor',
+        side_effect=fetch_in_reactor,
+    ):
+        yield deferreds
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fire(deferred, result):
+    deferred.callback(result)
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fail(deferred, exception):
+    deferred.errback(exception)
+
+
+def _wait_sent(loop, deferreds, count=1):
+    """Run the loop until the requests were sent by the reactor."""
+    while len(deferreds) < count:
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+
+def test_fetch_result(loop, deferreds):
+    future = aio.fetch('http://some_url')
+    _wait_sent(loop, deferreds)
+
+    fire(deferreds[0], 'response')
+    result = loop.run_until_complete(
+        asyncio.wait_for(future, TIMEOUT_TEST))
+    assert result == 'response'
+
+
+def test_fetch_exception(loop, deferreds):
+    future = aio.fetch('http://some_url')
+    _wait_sent(loop, deferreds)
+
+    fail(deferreds[0], HTTPTimeoutError('timeout'))
+    with pytest.raises(HTTPTimeoutError):
+        loop.run_until_complete(asyncio.wait_for(future, TIMEOUT_TEST))
+
+
+def test_fetch_cancel(loop, deferreds):
+    future = aio.fetch('http://some_url')
+    _wait_sent(loop, deferreds)
+
+    future.cancel()
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert deferreds[0].called
+
+
+def test_fetch_stream_not_supported(loop):
+    with pytest.raises(ValueError):
+        aio.fetch('http://some_url', stream=True)
+
+
+def test_runs_on_loop(loop):
+    reactor = mock.Mock(_asyncioEventloop=loop, running=True)
+    assert aio._runs_on_loop(reactor, loop)
+    reactor.running = False
+    assert not aio._runs_on_loop(reactor, loop)
+    assert not aio._runs_on_loop(mock.Mock(spec=['running']), loop)
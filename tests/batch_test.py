@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import crochet
+import mock
+from crochet._eventloop import ResultRegistry
+import pytest
+from twisted.internet.defer import Deferred
+from twisted.web.http_headers import Headers
+
+import fido
+from fido.batch import Batch
+from fido.fido import DEFAULT_USER_AGENT
+
+
+TIMEOUT_TEST = 1.0
+ERROR_MESSAGE = 'I failed :('
+
+
+@pytest.yield_fixture
+def mock_fetch():
+    """Patch the requests started by fetch_many with manual Deferreds."""
+    deferreds = []
+
+    def fetch_in_reactor(*args):
+        deferreds.append(Deferred())
+        return deferreds[-1]
+
+    # careful while patching _fetch_in_reactor cause it's being accessed
+    # by the reactor thread
+    with mock.patch(
+        'fido.batch._fetch_in_reactor',
+        side_effect=fetch_in_reactor,
+    ) as mock_fetch:
+        mock_fetch.deferreds = deferreds
+        yield mock_fetch
+
+
+@pytest.fixture
+def deferreds(mock_fetch):
+    return mock_fetch.deferreds
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fire(deferred, result):
+    deferred.callback(result)
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fail(deferred, exception):
+    deferred.errback(exception)
+
+
+def test_fetch_many_prepares_requests(mock_fetch):
+    batch = fido.fetch_many([
+        'http://some_url',
+        {'url': u'http://other_url', 'method': 'POST', 'timeout': 3},
+    ])
+
+    assert isinstance(batch, Batch)
+    assert len(batch) == 2
+
+    first, second = [c[0] for c in mock_fetch.call_args_list]
+    assert first[:4] == (
+        b'http://some_url',
+        b'GET',
+        Headers({b'User-Agent': [DEFAULT_USER_AGENT.encode('ascii')]}),
+        '',
+    )
+    assert second[:2] == (b'http://other_url', b'POST')
+    assert second[4].timeout == 3
+
+
+def test_fetch_many_results_registered(deferreds):
+    # registered results fail with ReactorStopped at reactor shutdown
+    with mock.patch.object(
+        ResultRegistry, 'register', autospec=True,
+    ) as register:
+        batch = fido.fetch_many(['http://a', 'http://b'])
+
+    registered = [call[0][1] for call in register.call_args_list]
+    assert all(result in registered for result in batch)
+    assert len(deferreds) == 2
+
+
+def test_fetch_many_results_in_order(deferreds):
+    batch = fido.fetch_many(['http://a', 'http://b', 'http://c'])
+
+    for index in (2, 0, 1):
+        fire(deferreds[index], index)
+
+    assert [result.wait(timeout=TIMEOUT_TEST) for result in batch] == [
+        0, 1, 2,
+    ]
+    assert batch.wait_all(timeout=TIMEOUT_TEST) == [0, 1, 2]
+
+
+def test_fetch_many_as_completed(deferreds):
+    batch = fido.fetch_many(['http://a', 'http://b', 'http://c'])
+    completed = batch.as_completed(timeout=TIMEOUT_TEST)
+
+    fire(deferreds[1], 1)
+    assert next(completed) is batch[1]
+
+    fire(deferreds[2], 2)
+    fire(deferreds[0], 0)
+    assert list(completed) == [batch[2], batch[0]]
+
+    # completion order is remembered for later iterations
+    assert list(batch.as_completed()) == [batch[1], batch[2], batch[0]]
+
+
+def test_fetch_many_as_completed_timeout(deferreds):
+    batch = fido.fetch_many(['http://a', 'http://b'])
+    fire(deferreds[0], 0)
+
+    completed = batch.as_completed(timeout=0.1)
+    assert next(completed) is batch[0]
+    with pytest.raises(crochet.TimeoutError):
+        next(completed)
+
+    with pytest.raises(crochet.TimeoutError):
+        batch.wait_all(timeout=0.1)
+
+
+def test_fetch_many_wait_all_raises_first_error(deferreds):
+    batch = fido.fetch_many(['http://a', 'http://b', 'http://c'])
+
+    fire(deferreds[0], 0)
+    fail(deferreds[2], KeyError(ERROR_MESSAGE))
+    fail(deferreds[1], ValueError(ERROR_MESSAGE))
+
+    with pytest.raises(ValueError) as e:
+        batch.wait_all(timeout=TIMEOUT_TEST)
+    assert e.value.args == (ERROR_MESSAGE,)
+
+    with pytest.raises(KeyError):
+        batch[2].wait(timeout=TIMEOUT_TEST)
+
+
+def test_fetch_many_exception_thrown_in_reactor_thread():
+    # careful while patching _build_body_producer cause it's being accessed
+    # by the reactor thread
+    with mock.patch('fido.fido.get_agent'):
+        with mock.patch(
+            'fido.fido._build_body_producer',
+            side_effect=ValueError(ERROR_MESSAGE)
+        ):
+            batch = fido.fetch_many(['http://some_url'])
+
+    with pytest.raises(ValueError) as e:
+        batch.wait_all(timeout=TIMEOUT_TEST)
+    assert e.value.args == (ERROR_MESSAGE,)
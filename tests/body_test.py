@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import array
+import io
+
+import mock
+import pytest
+import six
+from twisted.python.filepath import FilePath
+
+from fido.body import BufferReader
+from fido.body import IteratorReader
+from fido.body import as_byte_view
+from fido.body import is_path
+from fido.body import open_mapped_file
+
+
+@pytest.mark.parametrize('buffer', (
+    bytearray(b'hello world'),
+    memoryview(b'hello world'),
+))
+def test_buffer_reader(buffer):
+    reader = BufferReader(buffer)
+    assert reader.seek(0, io.SEEK_END) == 11
+    reader.seek(0)
+
+    assert reader.read(5) == b'hello'
+    assert reader.tell() == 5
+    assert reader.read() == b' world'
+    assert reader.read(5) == b''
+
+
+@pytest.mark.skipif(six.PY2, reason='memoryview.cast is python 3 only')
+def test_buffer_reader_items_larger_than_bytes():
+    ints = array.array('i', [1, 2, 3, 4])
+    reader = BufferReader(memoryview(ints))
+
+    # lengths and offsets count bytes, not items
+    assert reader.seek(0, io.SEEK_END) == 4 * ints.itemsize
+    reader.seek(0)
+    assert reader.read(ints.itemsize + 1) == ints.tobytes()[:ints.itemsize + 1]
+    assert reader.read() == ints.tobytes()[ints.itemsize + 1:]
+
+
+@pytest.mark.skipif(six.PY2, reason='memoryview.cast is python 3 only')
+def test_as_byte_view():
+    view = memoryview(b'hello')
+    assert as_byte_view(view) is view
+    assert as_byte_view(b'hello') == b'hello'
+
+    ints = array.array('i', [1, 2])
+    assert as_byte_view(memoryview(ints)).tobytes() == ints.tobytes()
+    assert len(as_byte_view(memoryview(ints))) == 2 * ints.itemsize
+
+    # views that are not contiguous are copied
+    strided = memoryview(b'hello')[::2]
+    assert as_byte_view(strided).tobytes() == b'hlo'
+
+
+def test_buffer_reader_close():
+    close = mock.Mock()
+    reader = BufferReader(b'hello', close=close)
+    reader.close()
+    reader.close()
+
+    close.assert_called_once_with()
+    with pytest.raises(ValueError):
+        reader.read()
+
+
+def test_iterator_reader():
+    reader = IteratorReader([b'hello', b'', bytearray(b' '), b'world'])
+    chunks = iter(lambda: reader.read(2), b'')
+    assert list(chunks) == [b'hello', b' ', b'world']
+
+
+def test_iterator_reader_memoryview_chunks():
+    ints = array.array('i', [1, 2])
+    reader = IteratorReader([
+        memoryview(b'hello'), memoryview(b''), memoryview(ints),
+    ])
+    chunks = iter(lambda: reader.read(), b'')
+    assert list(chunks) == [b'hello', ints.tobytes()]
+
+
+def test_iterator_reader_close_generator():
+    def chunks():
+        try:
+            yield b'hello'
+            yield b'world'
+        finally:
+            closed.append(True)
+
+    closed = []
+    reader = IteratorReader(chunks())
+    assert reader.read() == b'hello'
+    reader.close()
+    assert closed == [True]
+
+
+def test_open_mapped_file(tmpdir):
+    path = tmpdir.join('body')
+    path.write_binary(b'hello world')
+
+    assert is_path(FilePath(str(path)))
+    reader = open_mapped_file(FilePath(str(path)))
+    assert reader.read() == b'hello world'
+    reader.close()
+
+
+def test_open_mapped_file_empty(tmpdir):
+    path = tmpdir.join('body')
+    path.write_binary(b'')
+    assert open_mapped_file(FilePath(str(path))).read() == b''
+
+
+def test_is_path():
+    assert not is_path(b'/tmp/body')
+    assert not is_path(u'/tmp/body')
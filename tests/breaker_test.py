@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import pytest
+from twisted.internet.task import Clock
+
+from fido.breaker import CLOSED
+from fido.breaker import HALF_OPEN
+from fido.breaker import OPEN
+from fido.breaker import CircuitBreaker
+from fido.exceptions import CircuitOpenError
+from fido.exceptions import NetworkError
+
+
+KEY = 'localhost:8080'
+
+
+def _requests(breaker, clock, outcomes, key=KEY):
+    for failed in outcomes:
+        probe = breaker.acquire(clock, key)
+        breaker.release(clock, key, probe, failed)
+
+
+def test_circuit_open_error_is_network_error():
+    assert issubclass(CircuitOpenError, NetworkError)
+
+
+def test_opens_after_consecutive_failures():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=3, error_rate=None)
+
+    _requests(breaker, clock, [True, True, False, True, True])
+    assert breaker.state(clock, KEY) == CLOSED
+
+    _requests(breaker, clock, [True])
+    assert breaker.state(clock, KEY) == OPEN
+    assert breaker.opened == 1
+
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire(clock, KEY)
+    assert breaker.rejected == 1
+
+    # other hosts are not affected
+    assert breaker.state(clock, 'other:80') == CLOSED
+    breaker.acquire(clock, 'other:80')
+
+
+def test_opens_on_error_rate():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        consecutive_failures=None, error_rate=0.5, min_requests=10, window=10)
+
+    _requests(breaker, clock, [True, False] * 4 + [True])
+    assert breaker.state(clock, KEY) == CLOSED
+
+    _requests(breaker, clock, [False])
+    assert breaker.state(clock, KEY) == CLOSED
+
+    _requests(breaker, clock, [True])
+    assert breaker.state(clock, KEY) == OPEN
+
+
+def test_error_rate_sliding_window():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        consecutive_failures=None, error_rate=0.5, min_requests=4, window=10)
+
+    _requests(breaker, clock, [True, True, False])
+    clock.advance(10)
+    # the first requests are no longer accounted for
+    _requests(breaker, clock, [False, False, True])
+    assert breaker.state(clock, KEY) == CLOSED
+
+
+def test_cancelled_requests_not_accounted_for():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=2)
+
+    _requests(breaker, clock, [True, None, None, False, True, None])
+    assert breaker.state(clock, KEY) == CLOSED
+
+
+def test_half_open_probe_success_closes():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1, reset_timeout=30)
+
+    _requests(breaker, clock, [True])
+    clock.advance(30)
+    assert breaker.state(clock, KEY) == HALF_OPEN
+
+    probe = breaker.acquire(clock, KEY)
+    assert probe is True
+    # a single probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire(clock, KEY)
+
+    breaker.release(clock, KEY, probe, False)
+    assert breaker.state(clock, KEY) == CLOSED
+    assert breaker.acquire(clock, KEY) is False
+
+
+def test_half_open_probe_failure_reopens():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1, reset_timeout=30)
+
+    _requests(breaker, clock, [True])
+    clock.advance(30)
+    probe = breaker.acquire(clock, KEY)
+    breaker.release(clock, KEY, probe, True)
+
+    assert breaker.state(clock, KEY) == OPEN
+    assert breaker.opened == 2
+    clock.advance(29)
+    assert breaker.state(clock, KEY) == OPEN
+    clock.advance(1)
+    assert breaker.state(clock, KEY) == HALF_OPEN
+
+
+def test_cancelled_probe_frees_its_slot():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1, reset_timeout=30)
+
+    _requests(breaker, clock, [True])
+    clock.advance(30)
+    breaker.release(clock, KEY, breaker.acquire(clock, KEY), None)
+
+    assert breaker.state(clock, KEY) == HALF_OPEN
+    assert breaker.acquire(clock, KEY) is True
+
+
+def test_requests_sent_before_opening_ignored():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1, reset_timeout=30)
+
+    late = breaker.acquire(clock, KEY)
+    _requests(breaker, clock, [True])
+    clock.advance(30)
+    probe = breaker.acquire(clock, KEY)
+
+    # the late failure neither reopens the circuit nor frees the probe
+    breaker.release(clock, KEY, late, True)
+    assert breaker.state(clock, KEY) == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire(clock, KEY)
+
+    breaker.release(clock, KEY, probe, False)
+    assert breaker.state(clock, KEY) == CLOSED
+
+
+def test_only_failing_hosts_tracked():
+    clock = Clock()
+    breaker = CircuitBreaker(window=10)
+
+    for port in range(100):
+        _requests(breaker, clock, [False], key='host:{0}'.format(port))
+    assert len(breaker) == 0
+
+    _requests(breaker, clock, [True])
+    _requests(breaker, clock, [True], key='other:80')
+    assert len(breaker) == 2
+
+    # dropped once the failure left the window: on the next success of the
+    # host, or by the sweep of the other hosts
+    clock.advance(10)
+    _requests(breaker, clock, [False])
+    assert len(breaker) == 0
+    assert breaker.state(clock, KEY) == CLOSED
+
+
+def test_open_circuits_not_dropped():
+    clock = Clock()
+    breaker = CircuitBreaker(
+        consecutive_failures=1, window=10, reset_timeout=30)
+
+    _requests(breaker, clock, [True])
+    clock.advance(20)
+    _requests(breaker, clock, [False], key='other:80')
+    assert breaker.state(clock, KEY) == OPEN
+    assert len(breaker) == 1
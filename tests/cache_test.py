@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.web.http_headers import Headers
+
+from fido.cache import ResponseCache
+from fido.fido import Response
+from fido.timings import Timings
+
+
+URL = b'http://some_url/config'
+
+
+def _response(code=200, body=b'body', **headers):
+    return Response(
+        code=code,
+        headers=Headers(dict(
+            (name.replace('_', '-').encode('ascii'), [value])
+            for name, value in headers.items()
+        )),
+        body=body,
+        reason=b'',
+    )
+
+
+class Server(object):
+    """A fake request, answering with the given responses in order."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, headers):
+        def send():
+            self.requests.append(headers.copy())
+            response = self.responses.pop(0)
+            if isinstance(response, Deferred):
+                return response
+            return succeed(response)
+        return send
+
+
+def _get(cache, clock, server, headers=None, method=b'GET', **kwargs):
+    headers = Headers(headers or {})
+    deferred = cache.request(
+        clock, method, URL, headers, server.send(headers), **kwargs)
+    return deferred.result
+
+
+def test_fresh_response_returned_from_cache():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(_response(cache_control=b'max-age=60'))
+
+    first = _get(cache, clock, server)
+    clock.advance(59)
+    second = _get(cache, clock, server)
+
+    assert len(server.requests) == 1
+    assert second is not first
+    assert second.body == b'body'
+    assert second.headers[b'Cache-Control'] == [b'max-age=60']
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_expires_header():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(
+            date=b'Wed, 21 Oct 2015 07:28:00 GMT',
+            expires=b'Wed, 21 Oct 2015 07:29:00 GMT',
+        ),
+        _response(),
+    )
+
+    _get(cache, clock, server)
+    clock.advance(59)
+    _get(cache, clock, server)
+    assert len(server.requests) == 1
+
+    # stale without validators: sent again
+    clock.advance(1)
+    _get(cache, clock, server)
+    assert len(server.requests) == 2
+
+
+def test_stale_response_revalidated():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(cache_control=b'max-age=10', etag=b'"v1"'),
+        _response(304, b'', cache_control=b'max-age=20', etag=b'"v1"'),
+    )
+
+    _get(cache, clock, server)
+    clock.advance(10)
+    response = _get(cache, clock, server)
+
+    assert server.requests[1].getRawHeaders(b'If-None-Match') == [b'"v1"']
+    assert response.code == 200
+    assert response.body == b'body'
+    assert response.headers[b'Cache-Control'] == [b'max-age=20']
+    assert cache.revalidated == 1
+
+    # fresh again for the new max-age
+    clock.advance(19)
+    _get(cache, clock, server)
+    assert len(server.requests) == 2
+
+
+def test_revalidation_with_new_response():
+    clock = Clock()
+    cache = ResponseCache()
+    last_modified = b'Wed, 21 Oct 2015 07:28:00 GMT'
+    server = Server(
+        _response(last_modified=last_modified),
+        _response(body=b'new', cache_control=b'max-age=60'),
+    )
+
+    _get(cache, clock, server)
+    response = _get(cache, clock, server)
+
+    assert server.requests[1].getRawHeaders(b'If-Modified-Since') == [
+        last_modified,
+    ]
+    assert response.body == b'new'
+    assert _get(cache, clock, server).body == b'new'
+    assert cache.misses == 2
+
+
+def test_stale_while_revalidate():
+    clock = Clock()
+    cache = ResponseCache()
+    revalidation = Deferred()
+    server = Server(
+        _response(
+            cache_control=b'max-age=10, stale-while-revalidate=30',
+            etag=b'"v1"',
+        ),
+        revalidation,
+    )
+
+    _get(cache, clock, server)
+    clock.advance(20)
+
+    # stale responses are returned at once, revalidated once
+    assert _get(cache, clock, server).body == b'body'
+    assert _get(cache, clock, server).body == b'body'
+    assert len(server.requests) == 2
+    assert cache.stale_hits == 2
+
+    revalidation.callback(_response(
+        304, b'', cache_control=b'max-age=10, stale-while-revalidate=30'))
+    _get(cache, clock, server)
+    assert cache.hits == 1
+
+
+def test_hits_have_timings():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(
+            cache_control=b'max-age=10, stale-while-revalidate=30',
+            etag=b'"v1"',
+        ),
+        Deferred(),
+    )
+
+    _get(cache, clock, server)
+    assert _get(cache, clock, server).timings is None
+
+    timings = Timings()
+    fresh = _get(cache, clock, server, timings=timings)
+    clock.advance(20)
+    stale = _get(cache, clock, server, timings=timings)
+
+    for response in (fresh, stale):
+        assert response.timings.start == timings.start
+        assert response.timings.end >= timings.start
+        assert response.timings.total_time >= 0
+    assert fresh.timings is not stale.timings
+    assert cache.hits == 2
+    assert cache.stale_hits == 1
+
+
+def test_revalidated_response_has_timings():
+    clock = Clock()
+    cache = ResponseCache()
+    timings = Timings()
+    not_modified = _response(304, b'', cache_control=b'max-age=10')
+    not_modified.timings = timings
+    server = Server(
+        _response(cache_control=b'max-age=10', etag=b'"v1"'),
+        not_modified,
+    )
+
+    _get(cache, clock, server)
+    clock.advance(10)
+    response = _get(cache, clock, server, timings=Timings())
+
+    assert response.code == 200
+    assert response.timings is timings
+
+
+def test_must_revalidate_not_served_stale():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(
+            cache_control=(
+                b'max-age=10, stale-while-revalidate=30, must-revalidate'),
+            etag=b'"v1"',
+        ),
+        _response(304, b''),
+    )
+
+    _get(cache, clock, server)
+    clock.advance(20)
+    _get(cache, clock, server)
+
+    assert cache.stale_hits == 0
+    assert cache.revalidated == 1
+
+
+def test_vary():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(body=b'en', cache_control=b'max-age=60',
+                  vary=b'Accept-Language'),
+        _response(body=b'fr', cache_control=b'max-age=60',
+                  vary=b'Accept-Language'),
+    )
+
+    english = {b'Accept-Language': [b'en']}
+    french = {b'Accept-Language': [b'fr']}
+    assert _get(cache, clock, server, english).body == b'en'
+    assert _get(cache, clock, server, french).body == b'fr'
+    assert _get(cache, clock, server, english).body == b'en'
+    assert _get(cache, clock, server, french).body == b'fr'
+    assert len(server.requests) == 2
+
+
+def test_not_stored():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(cache_control=b'max-age=60', vary=b'*'),
+        _response(cache_control=b'no-store, max-age=60'),
+        _response(500, cache_control=b'max-age=60'),
+        _response(),
+    )
+
+    for _ in range(4):
+        _get(cache, clock, server)
+    assert len(cache) == 0
+
+
+def test_request_bypassing_cache():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(cache_control=b'max-age=60'),
+        _response(),
+        _response(),
+        _response(),
+    )
+
+    _get(cache, clock, server)
+    _get(cache, clock, server, {b'Cache-Control': [b'no-cache']})
+    _get(cache, clock, server, {b'If-None-Match': [b'"v1"']})
+    _get(cache, clock, server, method=b'HEAD')
+
+    assert len(server.requests) == 4
+    assert cache.hits == 0
+
+
+def test_unsafe_method_invalidates():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(cache_control=b'max-age=60'),
+        _response(201),
+        _response(cache_control=b'max-age=60'),
+    )
+
+    _get(cache, clock, server)
+    _get(cache, clock, server, method=b'POST')
+    assert len(cache) == 0
+    assert cache.size == 0
+
+    _get(cache, clock, server)
+    assert len(server.requests) == 3
+
+
+def test_decompressed_stored_separately():
+    clock = Clock()
+    cache = ResponseCache()
+    server = Server(
+        _response(body=b'gzipped', cache_control=b'max-age=60'),
+        _response(body=b'plain', cache_control=b'max-age=60'),
+    )
+
+    assert _get(cache, clock, server).body == b'gzipped'
+    assert _get(cache, clock, server, decompressed=True).body == b'plain'
+    assert len(cache) == 2
+
+
+def test_lru_eviction_by_size():
+    clock = Clock()
+    server = Server(*[
+        _response(body=b'x' * 100, cache_control=b'max-age=60')
+        for _ in range(3)
+    ])
+    entry_size = 100 + len(b'Cache-Control') + len(b'max-age=60')
+    cache = ResponseCache(max_bytes=2 * entry_size)
+
+    for url in (b'http://a', b'http://b', b'http://a', b'http://c'):
+        headers = Headers()
+        cache.request(clock, b'GET', url, headers, server.send(headers))
+
+    # b was the least recently used
+    assert cache.evictions == 1
+    assert cache.size == 2 * entry_size
+    assert sorted(key[0] for key in cache._entries) == [
+        b'http://a', b'http://c',
+    ]
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import mock
+from twisted.internet.defer import CancelledError
+from twisted.internet.defer import succeed
+from twisted.web.http_headers import Headers
+
+from fido.coalesce import RequestCoalescer
+from fido.exceptions import TCPConnectionError
+from fido.timings import Timings
+from tests.helpers import Attempts
+from tests.helpers import failure_of
+from tests.helpers import make_response
+
+
+URL = b'http://some_url/config'
+
+
+def _request(coalescer, send, method=b'GET', headers=None, options=(),
+             timings=None):
+    return coalescer.request(
+        method, URL, Headers(headers or {}), send, options, timings)
+
+
+def test_identical_requests_sent_once():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+
+    results = [_request(coalescer, send) for _ in range(3)]
+    assert len(send.deferreds) == 1
+    assert len(coalescer) == 1
+
+    send.deferreds[0].callback(make_response(body=b'body'))
+
+    responses = [result.result for result in results]
+    # each caller gets its own response
+    assert len(set(id(response) for response in responses)) == 3
+    assert all(response.body == b'body' for response in responses)
+    assert (coalescer.requests, coalescer.coalesced) == (3, 2)
+    assert len(coalescer) == 0
+
+    # the next request is sent anew
+    _request(coalescer, send)
+    assert len(send.deferreds) == 2
+
+
+def test_different_requests_not_coalesced():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+
+    _request(coalescer, send)
+    _request(coalescer, send, headers={b'X-Foo': [b'bar']})
+    _request(coalescer, send, options=(True,))
+    _request(coalescer, send, method=b'DELETE')
+    _request(coalescer, send, method=b'DELETE')
+
+    assert len(send.deferreds) == 5
+    assert coalescer.coalesced == 0
+
+
+def test_failure_fanned_out():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+
+    results = [_request(coalescer, send) for _ in range(2)]
+    send.deferreds[0].errback(TCPConnectionError())
+
+    for result in results:
+        assert isinstance(failure_of(result), TCPConnectionError)
+
+
+def test_cancel_does_not_affect_others():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+
+    first, second = [_request(coalescer, send) for _ in range(2)]
+    first.cancel()
+
+    assert isinstance(failure_of(first), CancelledError)
+    assert send.cancelled == []
+
+    send.deferreds[0].callback(make_response(body=b'body'))
+    assert second.result.body == b'body'
+
+
+def test_cancelled_by_all_callers():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+
+    results = [_request(coalescer, send) for _ in range(2)]
+    for result in results:
+        result.cancel()
+        failure_of(result)
+
+    assert send.cancelled == [0]
+    assert len(coalescer) == 0
+
+
+def test_synchronous_result():
+    coalescer = RequestCoalescer()
+    response = make_response(body=b'body')
+    send = mock.Mock(side_effect=lambda: succeed(response))
+
+    assert _request(coalescer, send).result is response
+    assert _request(coalescer, send).result is response
+    assert send.call_count == 2
+    assert len(coalescer) == 0
+
+
+def test_timings_per_caller():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+    owner_timings, joined_timings = Timings(), Timings()
+
+    owner = _request(coalescer, send, timings=owner_timings)
+    joined = _request(coalescer, send, timings=joined_timings)
+    untimed = _request(coalescer, send)
+
+    response = make_response()
+    response.timings = owner_timings._next_attempt()
+    send.deferreds[0].callback(response)
+
+    # the response of the request in flight carries the timings of its sender
+    assert owner.result.timings is response.timings
+    assert joined.result.timings.start == joined_timings.start
+    assert joined.result.timings.end is not None
+    assert untimed.result.timings is None
+
+
+def test_parsed_json_shared():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+    results = [_request(coalescer, send) for _ in range(2)]
+
+    response = make_response(body=b'{"key": "value"}')
+    parsed = response.json()
+    send.deferreds[0].callback(response)
+
+    assert [result.result.json() for result in results] == [parsed] * 2
+    assert results[1].result.json() is parsed
+
+
+def test_failure_copied_per_caller():
+    coalescer = RequestCoalescer()
+    send = Attempts()
+    owner_timings, joined_timings = Timings(), Timings()
+
+    owner = _request(coalescer, send, timings=owner_timings)
+    joined = _request(coalescer, send, timings=joined_timings)
+    untimed = _request(coalescer, send)
+
+    error = TCPConnectionError('refused')
+    error.timings = owner_timings._next_attempt()
+    send.deferreds[0].errback(error)
+
+    owner_error = failure_of(owner)
+    joined_error = failure_of(joined)
+    untimed_error = failure_of(untimed)
+    assert owner_error is error
+    assert len(set(map(id, (owner_error, joined_error, untimed_error)))) == 3
+    assert isinstance(joined_error, TCPConnectionError)
+    assert joined_error.args == ('refused',)
+    assert joined_error.timings.start == joined_timings.start
+    assert not hasattr(untimed_error, 'timings')
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+from twisted.internet.abstract import isIPv6Address
+from twisted.internet.address import IPv4Address
+from twisted.internet.address import IPv6Address
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import succeed
+from twisted.internet.error import ConnectError
+from twisted.internet.error import DNSLookupError
+from twisted.internet.protocol import Factory
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import Clock
+from twisted.internet.testing import MemoryReactorClock
+from twisted.web.client import URI
+
+from fido.dns import CachingResolver
+from fido.dns import ResolvingEndpoint
+from fido.dns import ResolvingEndpointFactory
+
+
+class Lookups(object):
+    """A name resolver whose lookups are completed by the tests."""
+
+    def __init__(self):
+        self.pending = []
+        self.error = None
+
+    def resolveHostName(self, receiver, hostName, portNumber=0,
+                        addressTypes=None, transportSemantics='TCP'):
+        if self.error is not None:
+            raise self.error
+        self.pending.append((hostName, receiver))
+
+    def complete(self, *addresses):
+        _, receiver = self.pending.pop(0)
+        for address in addresses:
+            if isIPv6Address(address):
+                receiver.addressResolved(IPv6Address('TCP', address, 0))
+            else:
+                receiver.addressResolved(IPv4Address('TCP', address, 0))
+        receiver.resolutionComplete()
+
+    def fail(self):
+        self.complete()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def lookups():
+    return Lookups()
+
+
+def _result(deferred):
+    results = []
+    deferred.addBoth(results.append)
+    return results[0] if results else None
+
+
+def test_resolve_caches_address(clock, lookups):
+    resolver = CachingResolver(resolver=lookups)
+    first = resolver.resolve(clock, 'example.com')
+    second = resolver.resolve(clock, 'example.com')
+    assert len(lookups.pending) == 1
+
+    lookups.complete('10.0.0.1')
+    assert _result(first) == _result(second) == ('10.0.0.1',)
+    assert _result(resolver.resolve(clock, 'example.com')) == ('10.0.0.1',)
+    assert (resolver.hits, resolver.misses) == (1, 2)
+
+
+def test_resolve_expires(clock, lookups):
+    resolver = CachingResolver(ttl=60, refresh_before=None, resolver=lookups)
+    resolver.resolve(clock, 'example.com')
+    lookups.complete('10.0.0.1')
+
+    clock.advance(60)
+    deferred = resolver.resolve(clock, 'example.com')
+    assert not deferred.called
+    lookups.complete('10.0.0.2')
+    assert _result(deferred) == ('10.0.0.2',)
+    assert resolver.misses == 2
+
+
+def test_resolve_refreshes_before_expiry(clock, lookups):
+    resolver = CachingResolver(ttl=60, refresh_before=10, resolver=lookups)
+    resolver.resolve(clock, 'example.com')
+    lookups.complete('10.0.0.1')
+
+    clock.advance(55)
+    assert _result(resolver.resolve(clock, 'example.com')) == ('10.0.0.1',)
+    assert _result(resolver.resolve(clock, 'example.com')) == ('10.0.0.1',)
+    assert resolver.refreshes == 1
+    lookups.complete('10.0.0.2')
+
+    clock.advance(55)
+    assert _result(resolver.resolve(clock, 'example.com')) == ('10.0.0.2',)
+    assert resolver.misses == 1
+
+
+def test_resolve_failed_refresh_keeps_address(clock, lookups):
+    resolver = CachingResolver(ttl=60, refresh_before=10, resolver=lookups)
+    resolver.resolve(clock, 'example.com')
+    lookups.complete('10.0.0.1')
+
+    clock.advance(55)
+    resolver.resolve(clock, 'example.com')
+    lookups.fail()
+    assert _result(resolver.resolve(clock, 'example.com')) == ('10.0.0.1',)
+
+
+def test_resolve_negative_caching(clock, lookups):
+    resolver = CachingResolver(negative_ttl=5, resolver=lookups)
+    first = resolver.resolve(clock, 'unknown')
+    lookups.fail()
+    assert _result(first).check(DNSLookupError)
+
+    assert _result(resolver.resolve(clock, 'unknown')).check(DNSLookupError)
+    assert not lookups.pending
+
+    clock.advance(5)
+    resolver.resolve(clock, 'unknown')
+    assert len(lookups.pending) == 1
+
+
+def test_resolve_does_not_cache_other_errors(clock, lookups):
+    resolver = CachingResolver(resolver=lookups)
+    lookups.error = ValueError()
+    first = resolver.resolve(clock, 'example.com')
+    assert _result(first).check(ValueError)
+
+    lookups.error = None
+    resolver.resolve(clock, 'example.com')
+    assert len(lookups.pending) == 1
+
+
+def test_resolve_lru_eviction(clock, lookups):
+    resolver = CachingResolver(max_entries=2, resolver=lookups)
+    for host in ('a', 'b'):
+        resolver.resolve(clock, host)
+        lookups.complete('10.0.0.1')
+
+    # 'a' becomes the most recently used
+    resolver.resolve(clock, 'a')
+    resolver.resolve(clock, 'c')
+    lookups.complete('10.0.0.3')
+
+    assert resolver.evictions == 1
+    assert len(resolver) == 2
+    resolver.resolve(clock, 'b')
+    assert len(lookups.pending) == 1
+
+
+def test_resolve_cancelled_waiter(clock, lookups):
+    resolver = CachingResolver(resolver=lookups)
+    first = resolver.resolve(clock, 'example.com')
+    second = resolver.resolve(clock, 'example.com')
+
+    first.cancel()
+    lookups.complete('10.0.0.1')
+    assert _result(second) == ('10.0.0.1',)
+
+
+def test_resolve_all_addresses(clock, lookups):
+    resolver = CachingResolver(resolver=lookups)
+    deferred = resolver.resolve(clock, 'example.com')
+    lookups.complete('10.0.0.1', '::1', '10.0.0.1')
+    assert _result(deferred) == ('10.0.0.1', '::1')
+
+
+@pytest.mark.parametrize('address', ('127.0.0.1', '::1', 'fe80::1'))
+def test_resolve_ip_address(clock, address):
+    resolver = CachingResolver(resolver=mock.Mock())
+    assert _result(resolver.resolve(clock, address)) == (address,)
+    assert resolver.misses == 0
+
+
+def _resolving_endpoint(reactor, addresses, host='example.com', **kwargs):
+    resolver = mock.Mock()
+    resolver.resolve.return_value = succeed(addresses)
+    return ResolvingEndpoint(reactor, resolver, host, 80, **kwargs)
+
+
+def test_resolving_endpoint_lookup_failed():
+    reactor = MemoryReactorClock()
+    resolver = mock.Mock()
+    resolver.resolve.return_value = Deferred()
+    endpoint = ResolvingEndpoint(reactor, resolver, 'example.com', 80)
+
+    deferred = endpoint.connect(Factory.forProtocol(Protocol))
+    resolver.resolve.assert_called_once_with(reactor, 'example.com')
+    resolver.resolve.return_value.errback(DNSLookupError())
+    assert _result(deferred).check(DNSLookupError)
+    assert not reactor.tcpClients
+
+
+def test_resolving_endpoint_connects_to_addresses():
+    reactor = MemoryReactorClock()
+    endpoint = _resolving_endpoint(reactor, ('::1', '10.0.0.1'))
+
+    endpoint.connect(Factory.forProtocol(Protocol))
+    reactor.advance(0)
+    # like HostnameEndpoint, the next address is tried while the first one
+    # is connecting
+    reactor.advance(0.3)
+    assert [client[:2] for client in reactor.tcpClients] == [
+        ('::1', 80), ('10.0.0.1', 80),
+    ]
+
+
+def test_resolving_endpoint_ipv6_literal():
+    reactor = MemoryReactorClock()
+    resolver = CachingResolver(resolver=mock.Mock())
+    endpoint = ResolvingEndpoint(reactor, resolver, '::1', 8080)
+
+    endpoint.connect(Factory.forProtocol(Protocol))
+    reactor.advance(0)
+    assert [client[:2] for client in reactor.tcpClients] == [('::1', 8080)]
+    assert not resolver.resolver.resolveHostName.called
+
+
+def test_resolving_endpoint_without_pluggable_name_resolver():
+    reactor = MemoryReactorClock()
+    endpoint = _resolving_endpoint(reactor, ('::1', '10.0.0.1'))
+
+    # twisted < 17.1 connects to the first address
+    with mock.patch('fido.dns._PLUGGABLE_NAME_RESOLVER', False):
+        endpoint.connect(Factory.forProtocol(Protocol))
+    assert [client[:2] for client in reactor.tcpClients] == [('::1', 80)]
+
+
+def test_resolving_endpoint_timeout_covers_resolution():
+    reactor = MemoryReactorClock()
+    resolver = mock.Mock()
+    resolver.resolve.return_value = Deferred()
+    endpoint = ResolvingEndpoint(
+        reactor, resolver, 'example.com', 80, timeout=5)
+
+    deferred = endpoint.connect(Factory.forProtocol(Protocol))
+    reactor.advance(5)
+    assert _result(deferred).check(ConnectError)
+    assert not reactor.getDelayedCalls()
+
+
+def test_resolving_endpoint_timer_cancelled_once_connected():
+    reactor = MemoryReactorClock()
+    endpoint = _resolving_endpoint(reactor, ('10.0.0.1',), timeout=5)
+
+    deferred = endpoint.connect(Factory.forProtocol(Protocol))
+    reactor.advance(0)
+    _, _, factory, _, _ = reactor.tcpClients[0]
+    factory.buildProtocol(None).makeConnection(mock.Mock())
+    assert isinstance(_result(deferred), Protocol)
+    assert not reactor.getDelayedCalls()
+
+
+def test_resolving_endpoint_factory():
+    factory = ResolvingEndpointFactory(mock.Mock(), mock.Mock())
+    endpoint = factory.endpointForURI(URI.fromBytes(b'http://example.com'))
+    assert isinstance(endpoint, ResolvingEndpoint)
+
+
+def test_resolving_endpoint_factory_https():
+    # TLS support is an optional extra
+    pytest.importorskip('OpenSSL')
+    factory = ResolvingEndpointFactory(mock.Mock(), mock.Mock())
+    factory._policy = mock.Mock()
+    endpoint = factory.endpointForURI(URI.fromBytes(b'https://example.com'))
+    assert not isinstance(endpoint, ResolvingEndpoint)
+    factory._policy.creatorForNetloc.assert_called_once_with(
+        b'example.com', 443)
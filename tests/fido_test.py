@@ -1,19 +1,73 @@
 # -*- coding: utf-8 -*-
-import mock
+import array
+import contextlib
+import io
+import itertools
+import zlib
 
+import mock
 import pytest
+import six
 from twisted.internet.defer import Deferred
+from twisted.internet.defer import fail
+from twisted.internet.defer import succeed
+from twisted.internet.error import ConnectError
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.web.http_headers import Headers
 
 import fido
+from fido.fido import ContentDecoder
+from fido.breaker import CircuitBreaker
+from fido.coalesce import RequestCoalescer
+from fido.exceptions import CircuitOpenError
+from fido.exceptions import HTTPTimeoutError
+from fido.exceptions import ResponseTooLargeError
+from fido.exceptions import TCPConnectionError
+from fido.fido import GZIP_WINDOW_SIZE
+from fido.fido import HTTPBodyFetcher
+from fido.fido import Response
 from fido.fido import _build_body_producer
+from fido.fido import _compress_body
+from fido.fido import _parse_json_in_thread
 from fido.fido import _set_deferred_timeout
 from fido.fido import _twisted_web_client
+from fido.metrics import BYTES_RECEIVED
+from fido.metrics import BYTES_SENT
+from fido.metrics import CONNECT_ERRORS
+from fido.metrics import LATENCY
+from fido.metrics import REQUESTS
+from fido.metrics import InMemoryMetrics
+from fido.metrics import set_metrics
+from fido.proxy import refresh_proxy_config
+from fido.proxy import set_proxy_config
+from fido.timings import Timings
+from tests.helpers import failure_of
 
 
 TIMEOUT_TEST = 1.0
 ERROR_MESSAGE = 'I failed :('
 
 
+@contextlib.contextmanager
+def _environ(values=None, clear=False):
+    """Patch the environment the proxy configuration is read from."""
+    with mock.patch.dict('os.environ', values or {}, clear=clear):
+        refresh_proxy_config()
+        try:
+            yield
+        finally:
+            set_proxy_config(None)
+
+
+@contextlib.contextmanager
+def _persistent_cache():
+    """Start from empty persistent pool and agent caches."""
+    with mock.patch.dict('fido.fido._persistent_pools', clear=True):
+        with mock.patch.dict('fido.fido._persistent_agents', clear=True):
+            yield
+
+
 def test_set_deferred_timeout_none():
     mock_reactor = mock.Mock()
     mock_deferred = mock.Mock()
@@ -63,8 +117,193 @@ def test_headers_not_modified_in_place():
     assert headers == {'foo': 'bar', 'Content-Length': '22'}
 
 
+@pytest.mark.parametrize('body, expected_length', (
+    (bytearray(b'hello'), 5),
+    (memoryview(b'hello'), 5),
+    (io.BytesIO(b'hello'), 5),
+    (iter([b'hello']), _twisted_web_client().UNKNOWN_LENGTH),
+))
+def test_build_body_producer_streamed_bodies(body, expected_length):
+    bodyProducer, headers = _build_body_producer(body, {'Content-Length': '5'})
+    assert bodyProducer.length == expected_length
+    assert headers == {}
+
+
+@pytest.mark.skipif(six.PY2, reason='memoryview.cast is python 3 only')
+def test_build_body_producer_memoryview_length_in_bytes():
+    ints = array.array('i', [1, 2, 3, 4])
+    bodyProducer, _ = _build_body_producer(memoryview(ints), {})
+    assert bodyProducer.length == len(ints.tobytes())
+
+
+@pytest.mark.skipif(six.PY2, reason='array is not a buffer on python 2')
+def test_compress_body_memoryview():
+    ints = array.array('i', range(512))
+    compressed, headers = _compress_body(memoryview(ints), {}, 6, 1024)
+
+    assert zlib.decompress(compressed, GZIP_WINDOW_SIZE) == ints.tobytes()
+    assert headers == {'Content-Encoding': 'gzip'}
+
+
+def test_compress_body():
+    body = b'{"some_json_data": 30}' * 100
+    headers = {'Content-Length': str(len(body))}
+    compressed, compressed_headers = _compress_body(body, headers, 6, 1024)
+
+    assert zlib.decompress(compressed, GZIP_WINDOW_SIZE) == body
+    assert compressed_headers['Content-Encoding'] == 'gzip'
+    assert headers == {'Content-Length': str(len(body))}
+
+    # the stale content-length is dropped along with the raw body
+    _, twisted_headers = _build_body_producer(compressed, compressed_headers)
+    assert twisted_headers == {'Content-Encoding': 'gzip'}
+
+
+@pytest.mark.parametrize('body, headers', (
+    (b'', {}),
+    (iter([b'x' * 2048]), {}),
+    (b'x' * 1023, {}),
+    (b'x' * 2048, {b'content-encoding': b'br'}),
+))
+def test_compress_body_skipped(body, headers):
+    assert _compress_body(body, headers, 6, 1024) == (body, headers)
+
+
+def _response(headers):
+    return Response(
+        code=200, headers=Headers(headers), body=b'', reason=b'OK')
+
+
+def test_response_headers_case_insensitive():
+    response = _response({b'content-type': [b'text/plain']})
+
+    assert response.headers[b'Content-Type'] == [b'text/plain']
+    assert response.headers[b'CONTENT-TYPE'] == [b'text/plain']
+    assert response.headers['content-type'] == [b'text/plain']
+    assert response.headers.get(b'X-Missing') is None
+    assert b'Content-type' in response.headers
+    assert 1 not in response.headers
+    with pytest.raises(KeyError):
+        response.headers[b'X-Missing']
+
+
+def test_response_headers_dict_like():
+    response = _response({b'X-Foo': [b'a', b'b'], b'x-bar': [b'c']})
+
+    assert len(response.headers) == 2
+    assert sorted(response.headers) == [b'X-Bar', b'X-Foo']
+    assert response.headers == {b'X-Foo': [b'a', b'b'], b'X-Bar': [b'c']}
+    assert dict(response.headers) == {
+        b'X-Foo': [b'a', b'b'],
+        b'X-Bar': [b'c'],
+    }
+
+
+def test_response_headers_read_only():
+    response = _response({b'X-Foo': [b'a']})
+
+    with pytest.raises(TypeError):
+        response.headers[b'X-Foo'] = [b'b']
+    with pytest.raises(AttributeError):
+        response.headers = {}
+
+
+def test_response_headers_built_lazily():
+    headers = mock.Mock(spec=Headers)
+    response = Response(code=200, headers=headers, body=b'', reason=b'OK')
+
+    assert not headers.method_calls
+    assert response.headers is response.headers
+
+
+def test_response_has_no_instance_dict():
+    response = _response({})
+
+    assert not hasattr(response, '__dict__')
+    with pytest.raises(AttributeError):
+        response.extra = True
+
+
+def test_response_json_parses_bytes_once():
+    decoder = mock.Mock(return_value={'a': 1})
+    response = Response(
+        code=200, headers=Headers(), body=b'{"a": 1}', reason=b'OK',
+        json_decoder=decoder,
+    )
+
+    assert response.json() == {'a': 1}
+    assert response.json() is response.json()
+    decoder.assert_called_once_with(b'{"a": 1}')
+
+
+def test_response_json_default_decoder():
+    response = Response(
+        code=200, headers=Headers(), body=b'null', reason=b'OK')
+
+    with mock.patch.object(fido.fido, 'DEFAULT_JSON_DECODER') as decoder:
+        decoder.return_value = None
+        assert response.json() is None
+        assert response.json() is None
+
+    decoder.assert_called_once_with(b'null')
+
+
+def test_default_json_decoder_is_stdlib():
+    # faster decoders are opt-in, whatever is installed
+    assert fido.fido.DEFAULT_JSON_DECODER is fido.fido._stdlib_json_loads
+
+    response = Response(
+        code=200,
+        headers=Headers(),
+        body=b'[NaN, 123456789012345678901234567890]',
+        reason=b'OK',
+    )
+    nan, large = response.json()
+    assert nan != nan
+    assert large == 123456789012345678901234567890
+
+
+class _SyncThreadPool(object):
+
+    def callInThreadWithCallback(self, onResult, function, *args):
+        try:
+            result = function(*args)
+        except Exception:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+
+def _sync_reactor():
+    reactor = mock.Mock()
+    reactor.getThreadPool.return_value = _SyncThreadPool()
+    reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    return reactor
+
+
+def test_parse_json_in_thread():
+    response = _response({})
+    response.body = b'[1]'
+
+    finished = _parse_json_in_thread(response, _sync_reactor())
+
+    assert finished.result is response
+    assert response._json == [1]
+
+
+def test_parse_json_in_thread_invalid_body():
+    response = _response({})
+    response.body = b'not json'
+
+    finished = _parse_json_in_thread(response, _sync_reactor())
+
+    assert finished.result is response
+    with pytest.raises(ValueError):
+        response.json()
+
+
 def test_get_agent_no_http_proxy():
-    with mock.patch.dict('os.environ', clear=True):
+    with _environ(clear=True):
         agent = fido.fido.get_agent(
             mock.Mock(spec=_twisted_web_client().Agent),
             connect_timeout=None)
@@ -72,14 +311,74 @@ def test_get_agent_no_http_proxy():
 
 
 def test_get_agent_with_http_proxy():
-    with mock.patch.dict('os.environ',
-                         {'http_proxy': 'http://localhost:8000'}):
+    with _environ({'http_proxy': 'http://localhost:8000'}):
         agent = fido.fido.get_agent(
             mock.Mock(spec=_twisted_web_client().Agent),
             connect_timeout=None)
     assert isinstance(agent, _twisted_web_client().ProxyAgent)
 
 
+def test_get_agent_with_https_proxy():
+    with _environ({'https_proxy': 'http://localhost:8000'}, clear=True):
+        agent = fido.fido.get_agent(mock.Mock(), connect_timeout=None)
+
+    from fido.proxy import ProxyEndpointFactory
+
+    assert isinstance(agent, _twisted_web_client().Agent)
+    assert isinstance(agent._endpointFactory, ProxyEndpointFactory)
+
+
+def test_get_agent_with_http_and_https_proxy():
+    with _environ({
+        'http_proxy': 'http://localhost:8000',
+        'https_proxy': 'http://localhost:8001',
+    }):
+        agent = fido.fido.get_agent(mock.Mock(), connect_timeout=None)
+
+    from fido.proxy import SchemeDispatchAgent
+
+    assert isinstance(agent, SchemeDispatchAgent)
+    assert isinstance(
+        agent._http_agent, _twisted_web_client().ProxyAgent)
+
+
+def test_get_agent_routes_no_proxy_hosts():
+    with _environ({
+        'http_proxy': 'http://localhost:8000',
+        'no_proxy': 'internal.example.com',
+    }):
+        agent = fido.fido.get_agent(mock.Mock(), connect_timeout=None)
+
+    from fido.proxy import ProxyRoutingAgent
+
+    assert isinstance(agent, ProxyRoutingAgent)
+    assert isinstance(
+        agent._proxied_agent, _twisted_web_client().ProxyAgent)
+    assert isinstance(agent._direct_agent, _twisted_web_client().Agent)
+
+
+def test_get_agent_proxy_config_read_once():
+    with _environ({'http_proxy': 'http://localhost:8000'}):
+        with mock.patch.dict('os.environ', clear=True):
+            agent = fido.fido.get_agent(mock.Mock(), connect_timeout=None)
+            assert isinstance(agent, _twisted_web_client().ProxyAgent)
+
+            refresh_proxy_config()
+            agent = fido.fido.get_agent(mock.Mock(), connect_timeout=None)
+            assert not isinstance(agent, _twisted_web_client().ProxyAgent)
+
+
+def test_get_agent_persistent_agent_cached():
+    mock_reactor = mock.Mock()
+    with _persistent_cache():
+        with _environ({'http_proxy': 'http://localhost:8000'}):
+            first = fido.fido.get_agent(mock_reactor, persistent=True)
+            second = fido.fido.get_agent(mock_reactor, persistent=True)
+
+    # http_proxy connections are pooled by proxy endpoint
+    assert first is second
+
+
 def test_get_agent_no_http_proxy_tcp_nodelay():
     agent = fido.fido.get_agent(
         mock.Mock(spec=_twisted_web_client().Agent),
@@ -94,8 +393,7 @@ def test_get_agent_no_http_proxy_tcp_nodelay():
 
 
 def test_get_agent_with_http_proxy_tcp_nodelay():
-    with mock.patch.dict('os.environ',
-                         {'http_proxy': 'http://yelp.com:80'}):
+    with _environ({'http_proxy': 'http://yelp.com:80'}):
         agent = fido.fido.get_agent(
             mock.Mock(spec=_twisted_web_client().Agent),
             connect_timeout=None,
@@ -108,6 +406,109 @@ def test_get_agent_with_http_proxy_tcp_nodelay():
     assert agent._pool._factory == HTTP11ClientFactoryOverride
 
 
+def test_get_agent_persistent_pool_shared():
+    mock_reactor = mock.Mock()
+    with _persistent_cache():
+        with _environ(clear=True):
+            first = fido.fido.get_agent(mock_reactor, persistent=True)
+            second = fido.fido.get_agent(mock_reactor, persistent=True)
+
+    assert first._pool is second._pool
+    assert first._pool.persistent is True
+    mock_reactor.addSystemEventTrigger.assert_called_once_with(
+        'before', 'shutdown', first._pool.closeCachedConnections,
+    )
+
+
+def test_get_agent_persistent_pool_keyed_by_options():
+    mock_reactor = mock.Mock()
+    with _persistent_cache():
+        with _environ(clear=True):
+            plain = fido.fido.get_agent(mock_reactor, persistent=True)
+            nodelay = fido.fido.get_agent(
+                mock_reactor, tcp_nodelay=True, persistent=True)
+            timeout = fido.fido.get_agent(
+                mock_reactor, connect_timeout=1.0, persistent=True)
+        with _environ({'http_proxy': 'http://localhost:8000'}):
+            proxied = fido.fido.get_agent(mock_reactor, persistent=True)
+        with _environ({'https_proxy': 'http://localhost:8000'}, clear=True):
+            tunneled = fido.fido.get_agent(mock_reactor, persistent=True)
+
+    from fido._client import HTTPConnectionPoolOverride
+
+    pools = [plain._pool, nodelay._pool, proxied._pool, tunneled._pool]
+    assert len(set(id(pool) for pool in pools)) == 4
+    assert isinstance(nodelay._pool, HTTPConnectionPoolOverride)
+    assert nodelay._pool.persistent is True
+    # idle connections are shared whatever the connect_timeout
+    assert timeout is not plain
+    assert timeout._pool is plain._pool
+
+
+def test_get_agent_persistent_reused_across_proxy_refreshes():
+    mock_reactor = mock.Mock()
+    with _persistent_cache():
+        with _environ({'http_proxy': 'http://localhost:8000'}):
+            first = fido.fido.get_agent(mock_reactor, persistent=True)
+            refresh_proxy_config()
+            second = fido.fido.get_agent(mock_reactor, persistent=True)
+            assert len(fido.fido._persistent_agents) == 1
+
+    assert second is first
+
+
+def test_get_agent_persistent_agents_bounded():
+    mock_reactor = mock.Mock()
+    with _persistent_cache():
+        with _environ(clear=True):
+            with mock.patch('fido.fido.MAX_PERSISTENT_AGENTS', 2):
+                first = fido.fido.get_agent(
+                    mock_reactor, connect_timeout=1.0, persistent=True)
+                fido.fido.get_agent(
+                    mock_reactor, connect_timeout=2.0, persistent=True)
+                # the least recently used agent is evicted
+                assert fido.fido.get_agent(
+                    mock_reactor, connect_timeout=1.0, persistent=True,
+                ) is first
+                fido.fido.get_agent(
+                    mock_reactor, connect_timeout=3.0, persistent=True)
+
+                timeouts = [key[4] for key in fido.fido._persistent_agents]
+                assert timeouts == [1.0, 3.0]
+                assert len(fido.fido._persistent_pools) == 1
+
+
+def test_get_agent_not_persistent_by_default():
+    with _persistent_cache():
+        fido.fido.get_agent(mock.Mock(), tcp_nodelay=True)
+        assert fido.fido._persistent_pools == {}
+        assert fido.fido._persistent_agents == {}
+
+
+@pytest.mark.parametrize('version, connection, pooled', (
+    (1, [], True),
+    (1, [b'Keep-Alive'], True),
+    (0, [], False),
+    (0, [b'keep-alive'], True),
+    (0, [b'foo, Keep-Alive'], True),
+))
+def test_pool_http10_connections(version, connection, pooled):
+    from fido._client import HTTPConnectionPool
+
+    pool = HTTPConnectionPool(Clock(), persistent=True)
+    connection_mock = mock.Mock()
+    connection_mock.state = 'QUIESCENT'
+    connection_mock.transport.disconnecting = False
+    connection_mock._parser.response.version = (b'HTTP', 1, version)
+    connection_mock._parser.connHeaders = Headers(
+        {b'Connection': connection})
+
+    pool._putConnection(('http', b'some_url', 80), connection_mock)
+
+    assert bool(pool._connections) is pooled
+    assert connection_mock.transport.loseConnection.called is not pooled
+
+
 def test_deferred_errback_chain():
     """
     Test exception thrown on the deferred correctly triggers the errback chain
@@ -131,6 +532,24 @@ def test_deferred_errback_chain():
         assert e.value.args == (ERROR_MESSAGE,)
 
 
+def test_fetch_inner_backwards_compatible():
+    # careful while patching _send_request cause it's being accessed by the
+    # reactor thread
+    with mock.patch('fido.fido.get_agent'):
+        with mock.patch(
+            'fido.fido._send_request', return_value=succeed(None),
+        ) as send_request:
+            fido.fido.fetch_inner(
+                b'http://some_url', b'POST', {'X-Foo': ['bar']}, b'', 5, 2,
+                False, True,
+            ).wait(timeout=TIMEOUT_TEST)
+
+    args = send_request.call_args[0]
+    assert args[2:4] == (b'http://some_url', b'POST')
+    assert args[4].getRawHeaders(b'X-Foo') == [b'bar']
+    assert args[6:9] == (5, 2, True)
+
+
 def test_fetch_inner_exception_thrown_in_reactor_thread():
     """
     Test that an exception thrown in the reactor thread is trapped inside
@@ -169,3 +588,331 @@ def test_fetch_normally_throws_exception():
             fido.fido.fetch('http://some_url')
 
     assert e.value.args == (ERROR_MESSAGE,)
+
+
+def _compress(data, wbits):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decode_bytewise(decoder, data):
+    """Feed the data one byte at a time, like a very fragmented body."""
+    body = b''.join(
+        decoder.decompress(data[i:i + 1]) for i in range(len(data))
+    )
+    return body + decoder.flush()
+
+
+@pytest.mark.parametrize('encoding, wbits', (
+    ('gzip', GZIP_WINDOW_SIZE),
+    ('deflate', zlib.MAX_WBITS),
+    ('deflate', -zlib.MAX_WBITS),
+))
+def test_content_decoder_incremental(encoding, wbits):
+    body = b'hello world' * 100
+    decoder = ContentDecoder(encoding)
+    assert _decode_bytewise(decoder, _compress(body, wbits)) == body
+
+
+@pytest.mark.parametrize('encoding', ('gzip', 'deflate'))
+def test_content_decoder_corrupt(encoding):
+    with pytest.raises(zlib.error):
+        _decode_bytewise(ContentDecoder(encoding), b'\xffnot compressed')
+
+
+@pytest.mark.skipif(six.PY2, reason='truncation undetectable on Python 2')
+def test_content_decoder_truncated():
+    data = _compress(b'hello world' * 100, GZIP_WINDOW_SIZE)
+    decoder = ContentDecoder('gzip')
+    decoder.decompress(data[:-4])
+    with pytest.raises(zlib.error):
+        decoder.flush()
+
+
+@pytest.mark.parametrize('content_encoding, expected', (
+    ([], None),
+    (['gzip'], 'gzip'),
+    (['X-Gzip'], 'gzip'),
+    (['deflate'], 'deflate'),
+    (['br'], None),
+    (['gzip, br'], None),
+))
+def test_content_decoder_for_response(content_encoding, expected):
+    response = mock.Mock()
+    response.headers = Headers({b'Content-Encoding': content_encoding})
+    decoder = ContentDecoder.for_response(response)
+    assert getattr(decoder, 'encoding', None) == expected
+
+
+@pytest.mark.parametrize('accept_encoding, expected', (
+    ([], ['gzip', 'deflate']),
+    (['deflate, br, identity'], ['deflate, br, identity', 'gzip']),
+    (['gzip;q=1.0', 'Deflate'], ['gzip;q=1.0', 'Deflate']),
+))
+def test_send_request_accept_encoding(accept_encoding, expected):
+    headers = Headers({'accept-encoding': accept_encoding})
+    mock_agent = mock.Mock()
+    mock_agent.request.return_value = Deferred()
+
+    fido.fido._send_request(
+        mock.Mock(), mock_agent, b'http://some_url', b'GET', headers, None,
+        None, None, decompress_gzip=True,
+    )
+    assert headers.getRawHeaders('accept-encoding') == expected
+
+
+def _send_with_breaker(clock, agent, breaker, timeout=None):
+    return fido.fido._send_request(
+        clock, agent, b'http://some_url', b'GET', Headers(), None,
+        timeout, None, False, breaker=breaker,
+    )
+
+
+def test_send_request_breaker_open_fails_fast():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1)
+    mock_agent = mock.Mock()
+    mock_agent.request.return_value = fail(ConnectError())
+
+    first = _send_with_breaker(clock, mock_agent, breaker)
+    assert isinstance(failure_of(first), TCPConnectionError)
+
+    second = _send_with_breaker(clock, mock_agent, breaker)
+    assert isinstance(failure_of(second), CircuitOpenError)
+    assert mock_agent.request.call_count == 1
+
+
+def test_send_request_breaker_counts_timeouts_not_cancellations():
+    clock = Clock()
+    breaker = CircuitBreaker(consecutive_failures=1)
+    mock_agent = mock.Mock()
+    mock_agent.request.side_effect = lambda **kwargs: Deferred()
+
+    cancelled = _send_with_breaker(clock, mock_agent, breaker, timeout=1)
+    cancelled.cancel()
+    failure_of(cancelled)
+    assert breaker.state(clock, 'some_url:80') == 'closed'
+
+    timed_out = _send_with_breaker(clock, mock_agent, breaker, timeout=1)
+    clock.advance(1)
+    failure_of(timed_out)
+    assert breaker.state(clock, 'some_url:80') == 'open'
+
+
+def _body_fetcher(length, content_encoding=(), **kwargs):
+    response = mock.Mock()
+    response.length = length
+    response.headers = Headers({b'Content-Encoding': list(content_encoding)})
+    finished = Deferred()
+    fetcher = HTTPBodyFetcher(
+        response, finished, bool(content_encoding), **kwargs)
+    fetcher.makeConnection(mock.Mock())
+    return fetcher, finished
+
+
+def test_max_body_size_content_length():
+    fetcher, finished = _body_fetcher(1025, max_body_size=1024)
+    assert isinstance(failure_of(finished), ResponseTooLargeError)
+    fetcher.transport.stopProducing.assert_called_once_with()
+
+
+def test_max_body_size_while_receiving():
+    fetcher, finished = _body_fetcher(
+        _twisted_web_client().UNKNOWN_LENGTH, max_body_size=1024)
+    fetcher.dataReceived(b'x' * 1024)
+    assert not finished.called
+
+    fetcher.dataReceived(b'x')
+    assert isinstance(failure_of(finished), ResponseTooLargeError)
+    fetcher.transport.stopProducing.assert_called_once_with()
+
+    # data still buffered by twisted is ignored
+    fetcher.dataReceived(b'x')
+    fetcher.connectionLost(mock.Mock())
+
+
+def test_max_decompressed_size_bounds_inflation():
+    data = _compress(b'\0' * (10 * 1024 * 1024), GZIP_WINDOW_SIZE)
+    fetcher, finished = _body_fetcher(
+        len(data), ['gzip'], max_decompressed_size=1024)
+    with mock.patch.object(
+        fetcher, '_deliver', wraps=fetcher._deliver,
+    ) as mock_deliver:
+        fetcher.dataReceived(data)
+
+    assert not mock_deliver.called
+    assert fetcher.delivered == 1025
+    assert isinstance(failure_of(finished), ResponseTooLargeError)
+
+
+def test_body_fetcher_timings():
+    data = _compress(b'corpus', GZIP_WINDOW_SIZE)
+    timings = Timings(start=0)
+    fetcher, finished = _body_fetcher(len(data), ['gzip'], timings=timings)
+
+    with mock.patch('fido.fido.now', side_effect=itertools.count(1)):
+        fetcher.dataReceived(data)
+        fetcher.connectionLost(
+            Failure(_twisted_web_client().ResponseDone()))
+
+    response = finished.result
+    assert response.body == b'corpus'
+    assert response.timings is timings
+    # decompressing the data then flushing the decoder took 1 second each
+    assert timings.decompress_time == 2
+    assert timings.body == 5
+
+
+def test_send_request_timings_attached_to_failure():
+    timings = Timings()
+    mock_agent = mock.Mock()
+
+    def request(**kwargs):
+        # the connection pool records the connection through it
+        assert fido.timings.current() is not None
+        return fail(ConnectError())
+    mock_agent.request.side_effect = request
+
+    deferred = fido.fido._send_request(
+        Clock(), mock_agent, b'http://some_url', b'GET', Headers(), None,
+        None, None, False, timings=timings,
+    )
+    error = failure_of(deferred)
+
+    assert isinstance(error, TCPConnectionError)
+    assert error.timings.attempt == 1
+    assert error.timings.start == timings.start
+    assert error.timings.sent <= error.timings.end
+    assert error.timings.headers is None
+    assert fido.timings.current() is None
+
+
+def test_send_request_metrics_connect_error():
+    metrics = InMemoryMetrics()
+    mock_agent = mock.Mock()
+    mock_agent.request.return_value = fail(ConnectError())
+
+    set_metrics(metrics)
+    try:
+        deferred = fido.fido._send_request(
+            Clock(), mock_agent, b'http://some_url', b'POST', Headers(),
+            _build_body_producer(b'corpus', {})[0], None, None, False,
+        )
+    finally:
+        set_metrics(None)
+    failure_of(deferred)
+
+    host = {'host': 'some_url:80'}
+    assert metrics.counter_value(CONNECT_ERRORS, host) == 1
+    assert metrics.counter_value(BYTES_SENT, host) == 6
+    assert metrics.counter_value(REQUESTS, {
+        'host': 'some_url:80',
+        'method': 'POST',
+        'status': 'TCPConnectionError',
+    }) == 1
+    assert len(metrics.histogram_values(LATENCY, host)) == 1
+
+
+def test_body_fetcher_metrics():
+    metrics = InMemoryMetrics()
+    data = _compress(b'corpus', GZIP_WINDOW_SIZE)
+    fetcher, _ = _body_fetcher(
+        len(data), ['gzip'], metrics=metrics, host='some_url:80')
+
+    fetcher.dataReceived(data)
+    fetcher.connectionLost(Failure(_twisted_web_client().ResponseDone()))
+
+    # counted as received, before decompression
+    assert metrics.counter_value(
+        BYTES_RECEIVED, {'host': 'some_url:80'}) == len(data)
+
+
+@pytest.mark.parametrize('stream', (False, True))
+def test_send_request_cache(stream):
+    cache = mock.Mock()
+    mock_agent = mock.Mock()
+    mock_agent.request.return_value = Deferred()
+
+    timings = Timings()
+    deferred = fido.fido._send_request(
+        Clock(), mock_agent, b'http://some_url', b'GET', Headers(), None,
+        None, None, True, stream=stream, cache=cache, timings=timings,
+    )
+
+    if stream:
+        # streamed responses bypass the cache
+        assert not cache.request.called
+        assert mock_agent.request.called
+        return
+
+    assert deferred is cache.request.return_value
+    assert not mock_agent.request.called
+    (_, method, url, headers, send, decompressed, _, cache_timings), _ = (
+        cache.request.call_args)
+    assert (method, url, decompressed) == (b'GET', b'http://some_url', True)
+    # the responses returned from the cache get the timings of the request
+    assert cache_timings is timings
+    # the cache key includes the accept-encoding of decompress_gzip
+    assert headers.hasHeader(b'accept-encoding')
+
+    send()
+    assert mock_agent.request.call_count == 1
+
+
+def test_send_request_coalescer():
+    coalescer = RequestCoalescer()
+    mock_agent = mock.Mock()
+    mock_agent.request.side_effect = lambda **kwargs: Deferred()
+
+    def send(method=b'GET', body=None):
+        return fido.fido._send_request(
+            Clock(), mock_agent, b'http://some_url', method, Headers(),
+            _build_body_producer(body, {})[0], None, None, False,
+            coalescer=coalescer,
+        )
+
+    send()
+    send()
+    assert mock_agent.request.call_count == 1
+
+    # requests with a body are sent as they are
+    send(b'PUT', b'data')
+    send(b'PUT', b'data')
+    assert mock_agent.request.call_count == 3
+    assert coalescer.coalesced == 1
+
+
+def test_send_request_coalescer_timeouts_per_caller():
+    clock = Clock()
+    coalescer = RequestCoalescer()
+    in_flight = Deferred()
+    mock_agent = mock.Mock()
+    mock_agent.request.return_value = in_flight
+
+    def send(timeout):
+        return fido.fido._send_request(
+            clock, mock_agent, b'http://some_url', b'GET', Headers(), None,
+            timeout, None, False, coalescer=coalescer,
+        )
+
+    short, slow, unbounded = send(1), send(5), send(None)
+    assert mock_agent.request.call_count == 1
+
+    # each caller stops waiting on its own timeout
+    clock.advance(1)
+    assert isinstance(failure_of(short), HTTPTimeoutError)
+    assert not slow.called
+    clock.advance(4)
+    assert isinstance(failure_of(slow), HTTPTimeoutError)
+
+    # the request in flight has no timeout of its own
+    clock.advance(100)
+    assert not in_flight.called
+    assert not unbounded.called
+    assert len(coalescer) == 1
+
+    # and is cancelled once nobody waits for it
+    unbounded.cancel()
+    assert in_flight.called
+    assert len(coalescer) == 0
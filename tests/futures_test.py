@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import crochet
+import mock
+import pytest
+from twisted.internet.defer import Deferred
+
+from fido.exceptions import HTTPTimeoutError
+
+futures = pytest.importorskip('concurrent.futures')
+fido_futures = pytest.importorskip('fido.futures')
+
+
+TIMEOUT_TEST = 1.0
+
+
+@pytest.yield_fixture
+def deferreds():
+    """Patch the requests sent by fido.futures with manual Deferreds."""
+    deferreds = []
+
+    def fetch_in_reactor(*args):
+        deferreds.append(Deferred())
+        return deferreds[-1]
+
+    # careful while patching _fetch_in_reactor cause it's being accessed
+    # by the reactor thread
+    with mock.patch(
+        'fido.futures._fetch_in_reactor',
+        side_effect=fetch_in_reactor,
+    ):
+        yield deferreds
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fire(deferred, result):
+    deferred.callback(result)
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def fail(deferred, exception):
+    deferred.errback(exception)
+
+
+@crochet.wait_for(timeout=TIMEOUT_TEST)
+def sync():
+    """Wait for the calls already scheduled in the reactor thread."""
+
+
+def test_fetch_result(deferreds):
+    future = fido_futures.fetch('http://some_url')
+    assert isinstance(future, futures.Future)
+    sync()
+    assert not future.done()
+
+    fire(deferreds[0], 'response')
+    assert future.result(timeout=TIMEOUT_TEST) == 'response'
+
+
+def test_fetch_exception(deferreds):
+    future = fido_futures.fetch('http://some_url')
+    sync()
+
+    fail(deferreds[0], HTTPTimeoutError('timeout'))
+    with pytest.raises(HTTPTimeoutError):
+        future.result(timeout=TIMEOUT_TEST)
+
+
+def test_fetch_cancel(deferreds):
+    future = fido_futures.fetch('http://some_url')
+    sync()
+
+    assert future.cancel()
+    sync()
+    assert deferreds[0].called
+    assert future.cancelled()
+
+
+def test_fetch_as_completed(deferreds):
+    pending = [fido_futures.fetch('http://some_url') for _ in range(3)]
+    sync()
+
+    fire(deferreds[2], 'third')
+    done = next(futures.as_completed(pending, timeout=TIMEOUT_TEST))
+    assert done is pending[2]
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import fail
+from twisted.internet.task import Clock
+
+from fido.exceptions import HTTPTimeoutError
+from fido.exceptions import TCPConnectionError
+from fido.fido import _send_with_policies
+from fido.hedge import HedgePolicy
+from fido.retry import RetryPolicy
+from tests.helpers import Attempts
+from tests.helpers import failure_of
+from tests.helpers import make_response
+
+
+def test_requires_delay_or_percentile():
+    with pytest.raises(ValueError):
+        HedgePolicy()
+
+
+def test_fast_response_not_hedged():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1)
+
+    result = policy.run(clock, b'GET', send)
+    clock.advance(0.5)
+    response = make_response()
+    send.deferreds[0].callback(response)
+    clock.advance(1)
+
+    assert result.result is response
+    assert len(send.deferreds) == 1
+    assert policy.hedges == 0
+
+
+@pytest.mark.parametrize('winner', (0, 1))
+def test_first_response_wins_loser_cancelled(winner):
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=1)
+
+    result = policy.run(clock, b'GET', send)
+    clock.advance(1)
+    assert len(send.deferreds) == 2
+
+    response = make_response()
+    send.deferreds[winner].callback(response)
+
+    assert result.result is response
+    assert send.cancelled == [1 - winner]
+    assert policy.hedges == 1
+    assert policy.wins == winner
+
+
+def test_fails_only_if_both_fail():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=1)
+
+    result = policy.run(clock, b'GET', send)
+    clock.advance(1)
+    send.deferreds[0].errback(HTTPTimeoutError())
+    assert not result.called
+
+    send.deferreds[1].errback(TCPConnectionError())
+    assert isinstance(failure_of(result), TCPConnectionError)
+
+
+def test_failure_before_hedge_surfaced():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=1)
+
+    result = policy.run(clock, b'GET', send)
+    send.deferreds[0].errback(TCPConnectionError())
+
+    assert isinstance(failure_of(result), TCPConnectionError)
+    assert not clock.getDelayedCalls()
+
+
+def test_max_ratio_limits_hedges():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=0.5)
+
+    for _ in range(4):
+        policy.run(clock, b'GET', send)
+    clock.advance(1)
+
+    # 4 requests allow 2 hedges
+    assert policy.hedges == 2
+    assert policy.denied == 2
+    assert len(send.deferreds) == 6
+
+
+def test_only_hedges_idempotent_methods_by_default():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=1)
+
+    policy.run(clock, b'POST', send)
+    clock.advance(1)
+
+    assert len(send.deferreds) == 1
+    assert policy.requests == 0
+
+
+def test_percentile_delay():
+    clock = Clock()
+    policy = HedgePolicy(percentile=90, min_samples=10, window=100)
+
+    for latency in range(10):
+        assert policy.hedge_delay() is None
+        send = mock.Mock(return_value=Deferred())
+        policy.run(clock, b'GET', send)
+        clock.advance(latency)
+        send.return_value.callback(make_response())
+
+    assert policy.hedge_delay() == 9
+
+
+def test_cancel_cancels_requests_in_flight():
+    clock = Clock()
+    send = Attempts()
+    policy = HedgePolicy(delay=1, max_ratio=1)
+
+    result = policy.run(clock, b'GET', send)
+    clock.advance(1)
+    result.cancel()
+
+    assert sorted(send.cancelled) == [0, 1]
+    assert result.called
+    result.addErrback(lambda _: None)
+
+
+def test_hedged_retries():
+    clock = Clock()
+    send = mock.Mock(side_effect=lambda: fail(TCPConnectionError()))
+    retry = RetryPolicy(max_retries=1, backoff_base=0, jitter=False)
+    hedge = HedgePolicy(delay=1)
+
+    result = _send_with_policies(clock, b'GET', b'', send, retry, hedge)
+    clock.advance(0)
+
+    assert isinstance(failure_of(result), TCPConnectionError)
+    assert send.call_count == 2
+    assert hedge.requests == 2
+
+
+def test_one_shot_body_not_hedged():
+    send = mock.Mock(return_value=Deferred())
+    hedge = HedgePolicy(delay=0)
+
+    _send_with_policies(Clock(), b'PUT', iter([b'data']), send, hedge=hedge)
+
+    assert hedge.requests == 0
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Fakes shared by the tests of the request policies."""
+from twisted.internet.defer import Deferred
+from twisted.web.http_headers import Headers
+
+from fido.fido import Response
+
+
+def make_response(code=200, headers=None, body=b''):
+    return Response(
+        code=code, headers=Headers(headers or {}), body=body, reason=b'')
+
+
+class Attempts(object):
+    """A fake request, each attempt getting a manual Deferred.
+
+    :ivar deferreds: the Deferreds of the attempts, in order.
+    :ivar cancelled: the indexes of the cancelled attempts.
+    """
+
+    def __init__(self):
+        self.deferreds = []
+        self.cancelled = []
+
+    def __call__(self):
+        index = len(self.deferreds)
+        self.deferreds.append(Deferred(
+            lambda _: self.cancelled.append(index)))
+        return self.deferreds[-1]
+
+
+def failure_of(deferred):
+    """Return the exception `deferred` failed with."""
+    failures = []
+    deferred.addErrback(failures.append)
+    return failures[0].value
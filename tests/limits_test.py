@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import pytest
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+
+from fido.exceptions import QueueTimeoutError
+from fido.limits import CancelledWhileQueued
+from fido.limits import ConcurrencyLimiter
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+class Requests(object):
+    """Records the order requests are sent and lets tests complete them."""
+
+    def __init__(self):
+        self.sent = []
+        self.deferreds = {}
+
+    def __call__(self, name):
+        def request():
+            self.sent.append(name)
+            self.deferreds[name] = Deferred()
+            return self.deferreds[name]
+        return request
+
+    def complete(self, name):
+        self.deferreds[name].callback(name)
+
+
+@pytest.fixture
+def requests():
+    return Requests()
+
+
+def test_run_without_limits(clock, requests):
+    limiter = ConcurrencyLimiter()
+    results = [
+        limiter.run(clock, 'a:80', requests(name))
+        for name in ('1', '2', '3')
+    ]
+    assert requests.sent == ['1', '2', '3']
+    assert limiter.in_flight() == 3
+    assert limiter.in_flight('a:80') == 3
+
+    for name in ('1', '2', '3'):
+        requests.complete(name)
+    assert [result.result for result in results] == ['1', '2', '3']
+    assert limiter.in_flight() == 0
+
+
+def test_max_per_host_queues_fifo(clock, requests):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    limiter.run(clock, 'a:80', requests('a1'))
+    limiter.run(clock, 'a:80', requests('a2'))
+    limiter.run(clock, 'b:80', requests('b1'))
+    limiter.run(clock, 'a:80', requests('a3'))
+
+    assert requests.sent == ['a1', 'b1']
+    assert limiter.queue_length() == 2
+    assert limiter.queue_length('a:80') == 2
+    assert limiter.queue_length('b:80') == 0
+
+    clock.advance(2)
+    requests.complete('a1')
+    assert requests.sent == ['a1', 'b1', 'a2']
+    assert limiter.in_flight('a:80') == 1
+
+    clock.advance(1)
+    requests.complete('a2')
+    assert requests.sent == ['a1', 'b1', 'a2', 'a3']
+    assert limiter.queue_length() == 0
+
+    assert limiter.wait_count == 2
+    assert limiter.total_wait_time == 5
+    assert limiter.max_wait_time == 3
+
+
+def test_max_total_grants_oldest_waiter(clock, requests):
+    limiter = ConcurrencyLimiter(max_total=1)
+    limiter.run(clock, 'a:80', requests('a1'))
+    limiter.run(clock, 'b:80', requests('b1'))
+    limiter.run(clock, 'a:80', requests('a2'))
+
+    requests.complete('a1')
+    assert requests.sent == ['a1', 'b1']
+    requests.complete('b1')
+    assert requests.sent == ['a1', 'b1', 'a2']
+
+
+def test_slot_released_on_failure(clock, requests):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    first = limiter.run(clock, 'a:80', requests('a1'))
+    limiter.run(clock, 'a:80', requests('a2'))
+
+    requests.deferreds['a1'].errback(ValueError())
+    assert requests.sent == ['a1', 'a2']
+    with pytest.raises(ValueError):
+        first.result.raiseException()
+    first.addErrback(lambda _: None)
+
+
+def test_queue_timeout(clock, requests):
+    limiter = ConcurrencyLimiter(max_per_host=1, queue_timeout=1)
+    limiter.run(clock, 'a:80', requests('a1'))
+    queued = limiter.run(clock, 'a:80', requests('a2'))
+
+    clock.advance(1)
+    assert limiter.queue_length() == 0
+    with pytest.raises(QueueTimeoutError):
+        queued.result.raiseException()
+    queued.addErrback(lambda _: None)
+
+    # the expired request is never sent
+    requests.complete('a1')
+    assert requests.sent == ['a1']
+    assert limiter.in_flight() == 0
+
+
+def test_queue_timeout_cancelled_when_granted(clock, requests):
+    limiter = ConcurrencyLimiter(max_per_host=1, queue_timeout=1)
+    limiter.run(clock, 'a:80', requests('a1'))
+    limiter.run(clock, 'a:80', requests('a2'))
+
+    requests.complete('a1')
+    assert clock.getDelayedCalls() == []
+
+
+def test_cancel_while_queued(clock, requests):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    limiter.run(clock, 'a:80', requests('a1'))
+    queued = limiter.run(clock, 'a:80', requests('a2'))
+    limiter.run(clock, 'a:80', requests('a3'))
+
+    queued.cancel()
+    assert limiter.queue_length('a:80') == 1
+    with pytest.raises(CancelledWhileQueued):
+        queued.result.raiseException()
+    queued.addErrback(lambda _: None)
+
+    requests.complete('a1')
+    assert requests.sent == ['a1', 'a3']
+
+
+def test_cancel_in_flight_releases_slot(clock):
+    limiter = ConcurrencyLimiter(max_per_host=1)
+    in_flight = limiter.run(clock, 'a:80', Deferred)
+    in_flight.cancel()
+    in_flight.addErrback(lambda _: None)
+    assert limiter.in_flight() == 0
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fido import metrics as metrics_module
+from fido.metrics import IN_FLIGHT
+from fido.metrics import LATENCY
+from fido.metrics import REQUESTS
+from fido.metrics import InMemoryMetrics
+from fido.metrics import Metrics
+from fido.metrics import get_metrics
+from fido.metrics import request_completed
+from fido.metrics import request_sent
+from fido.metrics import set_metrics
+
+
+@pytest.yield_fixture
+def metrics():
+    metrics = InMemoryMetrics()
+    set_metrics(metrics)
+    try:
+        yield metrics
+    finally:
+        set_metrics(None)
+
+
+def test_discarded_by_default():
+    assert get_metrics() is None
+
+    # the interface is a no-op
+    noop = Metrics()
+    noop.increment('name')
+    noop.observe('name', 1)
+    noop.gauge('name', 1)
+
+
+def test_set_metrics(metrics):
+    assert get_metrics() is metrics
+    set_metrics(None)
+    assert get_metrics() is None
+
+
+def test_in_memory_metrics():
+    metrics = InMemoryMetrics()
+    metrics.increment('count', tags={'host': 'a', 'status': '200'})
+    metrics.increment('count', 2, {'host': 'b', 'status': '200'})
+    metrics.increment('count', tags={'status': '200', 'host': 'a'})
+    metrics.observe('latency', 0.5, {'host': 'a'})
+    metrics.observe('latency', 1.5, {'host': 'b'})
+    metrics.gauge('gauge', 3)
+
+    assert metrics.counter_value('count') == 4
+    assert metrics.counter_value('count', {'host': 'a'}) == 2
+    assert metrics.counter_value('count', {'host': 'c'}) == 0
+    assert sorted(metrics.histogram_values('latency')) == [0.5, 1.5]
+    assert metrics.histogram_values('latency', {'host': 'b'}) == [1.5]
+    assert metrics.gauge_value('gauge') == 3
+    assert metrics.gauge_value('other') is None
+
+
+def test_requests_in_flight(metrics):
+    in_flight = metrics_module._in_flight
+
+    request_sent(metrics, 'a:80', 10)
+    request_sent(metrics, 'a:80', None)
+    assert metrics.gauge_value(IN_FLIGHT) == in_flight + 2
+
+    request_completed(metrics, 'a:80', 'GET', 200, 0.5)
+    request_completed(metrics, 'a:80', 'GET', 'HTTPTimeoutError', 1)
+    assert metrics.gauge_value(IN_FLIGHT) == in_flight
+
+    assert metrics.counter_value(REQUESTS, {'status': '200'}) == 1
+    assert metrics.counter_value(
+        REQUESTS, {'host': 'a:80', 'method': 'GET'}) == 2
+    assert metrics.histogram_values(
+        LATENCY, {'status': 'HTTPTimeoutError'}) == [1]
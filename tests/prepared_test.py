@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+
+import mock
+import pytest
+from twisted.internet.defer import succeed
+from twisted.web.http_headers import Headers
+
+import fido
+from fido.fido import DEFAULT_USER_AGENT
+from fido.prepared import PreparedRequest
+from fido.timings import Timings
+
+
+TIMEOUT_TEST = 1.0
+
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+def test_prepare_converts_once():
+    prepared = fido.prepare(
+        u'http://some_url', method=u'POST', headers={'X-Foo': 'bar'})
+
+    assert isinstance(prepared, PreparedRequest)
+    assert prepared.url == b'http://some_url'
+    assert prepared.method == b'POST'
+
+    with mock.patch('fido.common.listify_headers') as listify_headers:
+        args = prepared._fetch_args()
+
+    assert not listify_headers.called
+    assert args[:4] == (
+        b'http://some_url',
+        b'POST',
+        Headers({
+            b'X-Foo': [b'bar'],
+            b'User-Agent': [DEFAULT_USER_AGENT.encode('ascii')],
+        }),
+        '',
+    )
+
+
+def test_prepare_is_immutable():
+    prepared = fido.prepare('http://some_url')
+
+    with pytest.raises(AttributeError):
+        prepared.url = b'http://other_url'
+    with pytest.raises(AttributeError):
+        prepared.extra = True
+
+
+def test_prepared_fetch_overrides():
+    prepared = fido.prepare(
+        'http://some_url',
+        headers={'X-Foo': 'bar', 'X-Baz': 'qux'},
+        body=b'prepared',
+        timeout=5,
+        decompress_gzip=True,
+    )
+
+    args = prepared._fetch_args(
+        headers={'x-foo': ['override']}, body=b'other', timeout=None)
+
+    assert args[2].getRawHeaders(b'X-Foo') == [b'override']
+    assert args[2].getRawHeaders(b'X-Baz') == [b'qux']
+    assert args[3] == b'other'
+    assert args[4].timeout is None
+    assert args[4].decompress_gzip is True
+
+
+def test_prepared_timings_per_request():
+    prepared = fido.prepare('http://some_url', timings=True)
+
+    first = prepared._fetch_args()[4].timings
+    second = prepared._fetch_args()[4].timings
+    assert isinstance(first, Timings)
+    assert second is not first
+    assert prepared._fetch_args(timings=False)[4].timings is None
+    assert fido.prepare('http://some_url')._fetch_args()[4].timings is None
+
+
+def test_prepared_body_compressed_once():
+    body = b'a' * 2048
+    prepared = fido.prepare(
+        'http://some_url', method='POST', body=body, compress_body=True)
+
+    args = prepared._fetch_args()
+    assert _gunzip(args[3]) == body
+    assert args[2].getRawHeaders(b'Content-Encoding') == [b'gzip']
+    assert prepared._fetch_args()[3] is args[3]
+
+    # a small body given per call is sent as it is, without the header
+    args = prepared._fetch_args(body=b'small')
+    assert args[3] == b'small'
+    assert not args[2].hasHeader(b'Content-Encoding')
+
+    args = prepared._fetch_args(body=body)
+    assert _gunzip(args[3]) == body
+    assert args[2].getRawHeaders(b'Content-Encoding') == [b'gzip']
+
+
+def test_prepare_rejects_one_shot_bodies():
+    with pytest.raises(ValueError):
+        fido.prepare('http://some_url', body=io.BytesIO(b'data'))
+    with pytest.raises(ValueError):
+        fido.prepare('http://some_url', body=iter([b'data']))
+
+
+def test_prepared_fetch_removes_content_length():
+    prepared = fido.prepare(
+        'http://some_url',
+        method='POST',
+        headers={'Content-Length': '3'},
+        body=b'abc',
+    )
+
+    # careful while patching _send_request cause it's being accessed by the
+    # reactor thread
+    with mock.patch(
+        'fido.fido._send_request', return_value=succeed(None),
+    ) as send_request:
+        prepared.fetch().wait(timeout=TIMEOUT_TEST)
+
+    headers = send_request.call_args[0][4]
+    assert not headers.hasHeader(b'Content-Length')
+    # the prepared headers are left untouched
+    assert prepared._fetch_args()[2].hasHeader(b'Content-Length')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+from twisted.internet.defer import CancelledError
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import fail
+from twisted.internet.task import Clock
+
+from fido.exceptions import HTTPTimeoutError
+from fido.exceptions import TCPConnectionError
+from fido.retry import RetryBudget
+from fido.retry import RetryPolicy
+from tests.helpers import Attempts
+from tests.helpers import failure_of
+from tests.helpers import make_response
+
+
+def test_retries_exceptions_and_status_codes():
+    clock = Clock()
+    send = Attempts()
+    policy = RetryPolicy(backoff_base=1, jitter=False)
+
+    result = policy.run(clock, b'GET', send)
+    send.deferreds[0].errback(TCPConnectionError())
+
+    # first retry after backoff_base
+    clock.advance(0.9)
+    assert len(send.deferreds) == 1
+    clock.advance(0.1)
+    assert len(send.deferreds) == 2
+
+    send.deferreds[1].callback(make_response(503))
+    clock.advance(2)
+    assert len(send.deferreds) == 3
+
+    response = make_response(200)
+    send.deferreds[2].callback(response)
+    assert result.result is response
+    assert policy.retries == 2
+
+
+def test_gives_up_after_max_retries():
+    clock = Clock()
+    send = Attempts()
+    policy = RetryPolicy(max_retries=1, backoff_base=1, jitter=False)
+
+    result = policy.run(clock, b'GET', send)
+    send.deferreds[0].errback(HTTPTimeoutError())
+    clock.advance(1)
+    send.deferreds[1].errback(HTTPTimeoutError())
+
+    assert isinstance(failure_of(result), HTTPTimeoutError)
+    assert len(send.deferreds) == 2
+
+
+@pytest.mark.parametrize('outcome', (ValueError(), 404))
+def test_does_not_retry_other_errors(outcome):
+    send = Attempts()
+    policy = RetryPolicy()
+
+    result = policy.run(Clock(), b'GET', send)
+    if isinstance(outcome, Exception):
+        send.deferreds[0].errback(outcome)
+        assert failure_of(result) is outcome
+    else:
+        send.deferreds[0].callback(make_response(outcome))
+        assert result.result.code == outcome
+    assert len(send.deferreds) == 1
+
+
+def test_only_retries_idempotent_methods_by_default():
+    send = mock.Mock(return_value=fail(TCPConnectionError()))
+    policy = RetryPolicy()
+
+    result = policy.run(Clock(), b'POST', send)
+
+    assert isinstance(failure_of(result), TCPConnectionError)
+    assert send.call_count == 1
+
+
+def test_backoff_exponential_with_full_jitter():
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=3)
+
+    with mock.patch('fido.retry.random.uniform', side_effect=max):
+        assert [policy.backoff(retry) for retry in range(4)] == [
+            0.5, 1, 2, 3,
+        ]
+
+    with mock.patch('fido.retry.random.uniform') as uniform:
+        policy.backoff(1)
+    uniform.assert_called_once_with(0, 1)
+
+
+@pytest.mark.parametrize('retry_after, expected', (
+    (b'2', 2),
+    (b'60', 3),
+    (b'Wed, 21 Oct 2015 07:28:00 GMT', 0.5),
+))
+def test_backoff_retry_after(retry_after, expected):
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=3, jitter=False)
+    response = make_response(503, {b'Retry-After': [retry_after]})
+
+    assert policy.backoff(0, response) == expected
+
+
+def test_budget_limits_retries():
+    clock = Clock()
+    budget = RetryBudget(ratio=0.5, min_per_second=0, ttl=10)
+    policy = RetryPolicy(budget=budget, backoff_base=0, jitter=False)
+
+    results = []
+    for _ in range(4):
+        results.append(policy.run(
+            clock, b'GET', lambda: fail(TCPConnectionError())))
+        clock.advance(0)
+
+    # 4 requests allow 2 retries, the other failures are surfaced
+    assert policy.retries == 2
+    assert policy.exhausted == 4
+    for result in results:
+        assert isinstance(failure_of(result), TCPConnectionError)
+
+
+def test_budget_sliding_window():
+    budget = RetryBudget(ratio=0, min_per_second=0.1, ttl=10)
+
+    assert budget.withdraw(0)
+    assert not budget.withdraw(5)
+    # the first retry is no longer accounted for
+    assert budget.withdraw(10)
+
+
+def test_cancel_pending_retry():
+    clock = Clock()
+    send = Attempts()
+    policy = RetryPolicy(backoff_base=1, jitter=False)
+
+    result = policy.run(clock, b'GET', send)
+    send.deferreds[0].errback(TCPConnectionError())
+    result.cancel()
+    clock.advance(10)
+
+    assert isinstance(failure_of(result), CancelledError)
+    assert len(send.deferreds) == 1
+    assert not clock.getDelayedCalls()
+
+
+def test_cancel_attempt_in_progress_not_retried():
+    clock = Clock()
+    send = mock.Mock(side_effect=lambda: Deferred().addErrback(
+        # cancelled requests fail with a timeout error, see _send_request
+        lambda _: fail(HTTPTimeoutError())))
+    policy = RetryPolicy(backoff_base=0, jitter=False)
+
+    result = policy.run(clock, b'GET', send)
+    result.cancel()
+    clock.advance(10)
+
+    assert isinstance(failure_of(result), HTTPTimeoutError)
+    assert send.call_count == 1
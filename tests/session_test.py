@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import mock
+
+import pytest
+
+import fido
+from fido.fido import DEFAULT_USER_AGENT
+from fido.fido import _twisted_web_client
+from fido.proxy import ProxyConfig
+from fido.proxy import set_proxy_config
+from fido.timings import Timings
+
+
+TIMEOUT_TEST = 1.0
+
+
+@pytest.yield_fixture
+def mock_send_request():
+    # careful while patching _send_request cause it's being accessed
+    # by the reactor thread
+    with mock.patch(
+        'fido.fido._send_request',
+        return_value=mock.sentinel.response,
+    ) as mock_send_request:
+        yield mock_send_request
+
+
+def test_session_default_headers_listified():
+    session = fido.Session(headers={'foo': 'bar'})
+    assert session._headers.getRawHeaders(b'foo') == [b'bar']
+    assert session._headers.getRawHeaders(b'user-agent') == [
+        DEFAULT_USER_AGENT.encode('utf-8'),
+    ]
+
+
+def test_session_reads_proxy_config_once():
+    set_proxy_config(ProxyConfig(
+        http_proxy='http://localhost:8000',
+        no_proxy='internal.example.com',
+    ))
+    try:
+        session = fido.Session()
+    finally:
+        set_proxy_config(None)
+
+    assert session.http_proxy == 'http://localhost:8000'
+    assert session.no_proxy == 'internal.example.com'
+
+
+def test_session_fetch_merges_headers(mock_send_request):
+    session = fido.Session(headers={'foo': 'bar', 'baz': 'qux'})
+
+    response = session.fetch(
+        'http://some_url',
+        headers={'foo': ['override']},
+    ).wait(timeout=TIMEOUT_TEST)
+    assert response is mock.sentinel.response
+
+    headers = mock_send_request.call_args[0][4]
+    assert headers.getRawHeaders(b'foo') == [b'override']
+    assert headers.getRawHeaders(b'baz') == [b'qux']
+
+    # session defaults are not mutated
+    assert session._headers.getRawHeaders(b'foo') == [b'bar']
+
+
+def test_session_fetch_removes_default_content_length(mock_send_request):
+    session = fido.Session(headers={'Content-Length': '250'})
+    session.fetch('http://some_url', body=b'corpus').wait(
+        timeout=TIMEOUT_TEST)
+
+    headers = mock_send_request.call_args[0][4]
+    assert not headers.hasHeader(b'content-length')
+
+
+def test_session_fetch_uses_session_defaults(mock_send_request):
+    session = fido.Session(timeout=5, decompress_gzip=True)
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+    session.fetch('http://some_url', timeout=None).wait(timeout=TIMEOUT_TEST)
+
+    first_args = mock_send_request.call_args_list[0][0]
+    second_args = mock_send_request.call_args_list[1][0]
+    assert first_args[6:9] == (5, None, True)
+    assert second_args[6:9] == (None, None, True)
+
+
+def test_session_fetch_json_options(mock_send_request):
+    decoder = mock.Mock()
+    session = fido.Session(json_decoder=decoder, parse_json=True)
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+    session.fetch('http://some_url', parse_json=False).wait(
+        timeout=TIMEOUT_TEST)
+
+    first_kwargs = mock_send_request.call_args_list[0][1]
+    second_kwargs = mock_send_request.call_args_list[1][1]
+    assert first_kwargs['json_decoder'] is decoder
+    assert first_kwargs['parse_json'] is True
+    assert second_kwargs['json_decoder'] is decoder
+    assert second_kwargs['parse_json'] is False
+
+
+def test_session_fetch_timings(mock_send_request):
+    session = fido.Session(timings=True)
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+    session.fetch('http://some_url', timings=False).wait(
+        timeout=TIMEOUT_TEST)
+
+    timings = mock_send_request.call_args_list[0][1]['timings']
+    assert isinstance(timings, Timings)
+    assert timings.start <= timings.scheduled
+    assert mock_send_request.call_args_list[1][1]['timings'] is None
+
+
+def test_session_agent_reused_until_closed(mock_send_request):
+    session = fido.Session(
+        tcp_nodelay=True,
+        max_persistent_per_host=7,
+        http_proxy='',
+    )
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+
+    first_agent = mock_send_request.call_args_list[0][0][1]
+    assert mock_send_request.call_args_list[1][0][1] is first_agent
+    assert isinstance(first_agent, _twisted_web_client().Agent)
+
+    from fido._client import HTTPConnectionPoolOverride
+    assert isinstance(session._pool, HTTPConnectionPoolOverride)
+    assert session._pool.persistent is True
+    assert session._pool.maxPersistentPerHost == 7
+
+    session.close().wait(timeout=TIMEOUT_TEST)
+    assert session._pool is None
+
+    session.fetch('http://some_url').wait(timeout=TIMEOUT_TEST)
+    assert mock_send_request.call_args_list[2][0][1] is not first_agent
+
+
+def test_session_cache(mock_send_request):
+    cache = mock.Mock()
+    fido.Session(cache=cache).fetch('http://some_url').wait(
+        timeout=TIMEOUT_TEST)
+
+    assert mock_send_request.call_args[1]['cache'] is cache
+
+
+def test_session_coalescer(mock_send_request):
+    coalescer = mock.Mock()
+    fido.Session(coalescer=coalescer).fetch('http://some_url').wait(
+        timeout=TIMEOUT_TEST)
+
+    assert mock_send_request.call_args[1]['coalescer'] is coalescer
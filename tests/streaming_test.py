@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import mock
+import pytest
+from twisted.python.failure import Failure
+
+from fido.exceptions import HTTPTimeoutError
+from fido.streaming import BodyStream
+
+
+@pytest.fixture
+def reactor():
+    mock_reactor = mock.Mock()
+    mock_reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    return mock_reactor
+
+
+@pytest.fixture
+def transport():
+    return mock.Mock()
+
+
+@pytest.fixture
+def stream(reactor, transport):
+    stream = BodyStream(reactor, max_buffer_size=10)
+    stream._connect(transport)
+    return stream
+
+
+def write(stream, *chunks):
+    for chunk in chunks:
+        stream._write(chunk)
+        stream._update_production()
+
+
+def test_iterate_chunks(stream):
+    write(stream, b'foo', b'bar')
+    stream._finish()
+
+    assert list(stream) == [b'foo', b'bar']
+    assert stream._finished.called
+
+
+def test_read(stream):
+    write(stream, b'foo', b'bar')
+    stream._finish()
+
+    assert stream.read() == b'foobar'
+
+
+def test_iterate_waits_for_chunks(stream):
+    def produce():
+        write(stream, b'foo')
+        stream._finish()
+
+    threading.Timer(0.1, produce).start()
+    assert stream.read(timeout=1) == b'foo'
+
+
+def test_iterate_timeout(stream):
+    write(stream, b'foo')
+    chunks = stream.iter_chunks(timeout=0.1)
+
+    assert next(chunks) == b'foo'
+    with pytest.raises(HTTPTimeoutError):
+        next(chunks)
+
+
+def test_failure_raised_after_buffered_chunks(stream):
+    write(stream, b'foo')
+    stream._finish(Failure(ValueError('boom')))
+
+    chunks = iter(stream)
+    assert next(chunks) == b'foo'
+    with pytest.raises(ValueError):
+        next(chunks)
+
+
+def test_backpressure(stream, transport):
+    write(stream, b'12345', b'67890')
+    assert transport.pauseProducing.call_count == 1
+
+    # further data received while paused does not pause again
+    write(stream, b'abc')
+    assert transport.pauseProducing.call_count == 1
+
+    chunks = iter(stream)
+    assert next(chunks) == b'12345'
+    assert not transport.resumeProducing.called
+
+    # resumed once the buffer is half empty
+    assert next(chunks) == b'67890'
+    assert transport.resumeProducing.call_count == 1
+
+
+def test_stale_resume_ignored(stream, reactor, transport):
+    scheduled = []
+    reactor.callFromThread.side_effect = lambda f, *args: scheduled.append(f)
+
+    write(stream, b'1234567890')
+    chunks = iter(stream)
+    next(chunks)
+
+    # the buffer filled up again before the reactor resumed the transport
+    write(stream, b'1234567890')
+    assert transport.pauseProducing.call_count == 2
+
+    scheduled[0]()
+    assert not transport.resumeProducing.called
+
+
+def test_close(stream, transport):
+    write(stream, b'foo')
+    stream.close()
+
+    transport.stopProducing.assert_called_once_with()
+    assert list(stream) == []
+
+    # data received after closing is dropped
+    write(stream, b'bar')
+    assert list(stream) == []
+
+
+def test_close_after_finish(stream, transport):
+    write(stream, b'foo')
+    stream._finish()
+
+    with stream:
+        pass
+    assert not transport.stopProducing.called
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fido import timings as timings_module
+from fido.timings import Timings
+from fido.timings import recording
+
+
+def test_durations():
+    timings = Timings(start=1.0)
+    timings.scheduled = 1.5
+    timings.sent = 2.0
+    timings.resolved = 2.5
+    timings.connected = 3.0
+    timings.headers = 5.0
+    timings.body = 8.0
+    timings.end = 9.0
+
+    assert timings.reactor_delay == 0.5
+    assert timings.queue_time == 0.5
+    assert timings.dns_time == 0.5
+    assert timings.connect_time == 0.5
+    assert timings.ttfb == 2
+    assert timings.download_time == 3
+    assert timings.total_time == 8
+
+
+def test_durations_of_missing_phases():
+    timings = Timings(start=1.0)
+    timings.scheduled = 1.5
+    timings.sent = 2.0
+    timings.connected = 3.0
+
+    # the hostname resolution is part of the connection
+    assert timings.dns_time is None
+    assert timings.connect_time == 1
+    assert timings.ttfb is None
+    assert timings.download_time is None
+    assert timings.total_time is None
+    assert 'total_time=None' in repr(timings)
+
+
+def test_attempts_share_start():
+    timings = Timings(start=1.0)
+    timings.scheduled = 1.5
+
+    first = timings._next_attempt()
+    second = timings._next_attempt()
+
+    assert (first.attempt, second.attempt) == (1, 2)
+    for attempt in (first, second):
+        assert attempt.start == 1.0
+        assert attempt.scheduled == 1.5
+        assert attempt.sent is None
+
+
+def test_recording():
+    timings = Timings()
+    assert timings_module.current() is None
+
+    with pytest.raises(ValueError):
+        with recording(timings):
+            assert timings_module.current() is timings
+            raise ValueError()
+
+    assert timings_module.current() is None